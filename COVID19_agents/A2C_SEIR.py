@@ -1,49 +1,69 @@
 import sys
 sys.path.append("..")
 
-from COVID19_env.SEIR_env import SEIR_env
+import os
 
-from stable_baselines.common.policies import MlpPolicy
-from stable_baselines import results_plotter
-from stable_baselines import A2C
-from stable_baselines.common.evaluation import evaluate_policy
-from stable_baselines.common.vec_env import SubprocVecEnv
-from stable_baselines.common import set_global_seeds, make_vec_env
-
-import matplotlib as mpl
-import matplotlib.pyplot as plt
+from COVID19_env.SEIR_env import SEIR_env, read_input_r
+from COVID19_env.seir_inputs import export_inputs
+from COVID19_env.worker_pool import subproc_vec_env
 
 import numpy as np
 
-def make_env(hospitalCapacity, env_id, rank, seed=0):
+# stable_baselines (TensorFlow) and matplotlib are imported where they are
+# used, so the env workers do not have to load them
+
+def make_env(hospitalCapacity, env_id, rank, seed=0, input_path=None, profile=False):
     """
     Utility function for multiprocessed env.
 
     :param env_id: (str) the environment ID
+    :param input_path: (str) SEIR input snapshot shared by all subprocesses
+      (see seir_inputs.py), None to read the inputs with R in every subprocess
     :param num_env: (int) the number of environments you wish to have in subprocesses
     :param seed: (int) the inital seed for RNG
     :param rank: (int) index of the subprocess
+    :param profile: (bool) time the phases of every step (see step_profiler.py)
     """
     def _init():
-        env = SEIR_env(hospitalCapacity)
+        env = SEIR_env(hospitalCapacity, input_data=input_path, profile=profile)
         env.seed(seed + rank)
         return env
+    from stable_baselines.common import set_global_seeds
     set_global_seeds(seed)
     return _init
 
 if __name__ == "__main__":
+    from stable_baselines.common.policies import MlpPolicy
+    from stable_baselines import A2C
+
+    from COVID19_agents.callbacks import ProfilingCallback, TelemetryCallback, VecEpisodeTelemetry
+
     # Get environment inputs
     hospitalCapacity = 10000 # maximum number of people in the ICU
 
     env_id = "SEIR_env"
     num_cpu = 8  # Number of processes to use
-    # Create the vectorized environment
-    env = SubprocVecEnv([make_env(hospitalCapacity, env_id, i) for i in range(num_cpu)])
+    profile = False # write the env step timers to tensorboard (see callbacks.py)
+
+    # Read the model inputs once, the subprocesses map the snapshot read-only
+    input_path = "./SEIR_inputs.bin"
+    if not os.path.exists(input_path):
+        export_inputs(input_path, read_input_r())
+
+    # Create the vectorized environment, the workers are forked from a warm
+    # fork server (see worker_pool.py)
+    env = subproc_vec_env([make_env(hospitalCapacity, env_id, i, input_path=input_path, profile=profile)
+                           for i in range(num_cpu)],
+                          engine='native')
+    env = VecEpisodeTelemetry(env, hospitalCapacity) # episode metrics for TelemetryCallback
 
     # Define and Train the agent
     numTimesteps = 25000000 # number of training steps
-    model = A2C(MlpPolicy, env, tensorboard_log="./SEIR_tensorboard/", full_tensorboard_log=True, verbose=False)
-    trained_model = model.learn(total_timesteps=numTimesteps)
+    model = A2C(MlpPolicy, env, tensorboard_log="./SEIR_tensorboard/", verbose=False)
+    callbacks = [TelemetryCallback(sample_every=10)] # sampled episode metrics, see callbacks.py
+    if profile:
+        callbacks.append(ProfilingCallback())
+    trained_model = model.learn(total_timesteps=numTimesteps, callback=callbacks)
 
 
 #    #-- Test the trained agent on single environment
@@ -90,6 +110,7 @@ if __name__ == "__main__":
     actions.append('-') # no action for last time step
 
     #-- Plot results
+    import matplotlib.pyplot as plt
 
     # initiate figure
     fig, ax = plt.subplots(constrained_layout=True)
@@ -4,12 +4,7 @@ sys.path.append("..")
 from COVID19_env.simple_SIR_env import simple_SIR_env
 
 from stable_baselines.deepq.policies import MlpPolicy
-from stable_baselines import results_plotter
 from stable_baselines import DQN
-from stable_baselines.common.evaluation import evaluate_policy
-
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 
 import numpy as np
 
@@ -63,6 +58,7 @@ for step in range(max_steps):
 actions.append('-') # no action for last time step
 
 #-- Plot results
+import matplotlib.pyplot as plt # only needed for plotting
 
 # initiate figure
 fig, ax = plt.subplots(constrained_layout=True)
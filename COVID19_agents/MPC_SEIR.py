@@ -0,0 +1,167 @@
+"""
+model predictive control (MPC) agent for SEIR_env
+
+Every day the planner searches for the best schedule of travel restrictions
+over the next `horizon` days with the cross-entropy method (CEM): it samples
+num_candidates schedules from a Gaussian, simulates all of them at once with
+the native SEIR model (one (num_candidates, num_cities, 4) batch), refits the
+Gaussian to the num_elites best schedules and repeats. The first action of the
+best schedule found is taken and the rest is used to warm start the next day.
+method='random' is random shooting instead: one batch of uniformly sampled
+schedules.
+
+The simulated rewards are the ones of SEIR_env, so the planner is a reference
+for the RL agents: it needs no training and plans a whole episode in seconds.
+
+To plan an episode of SEIR_env:
+    $ cd COVID19_agents
+    $ python MPC_SEIR.py
+"""
+import sys
+sys.path.append("..")
+
+import os
+import time
+
+import numpy as np
+
+from COVID19_env.SEIR_env import SEIR_env, read_input_r
+from COVID19_env.seir_inputs import export_inputs
+from COVID19_env.seir_model import I
+
+
+class CEMPlanner(object):
+    """
+    Cross-entropy method planner over the SEIR_env dynamics and reward
+
+    :param env: (SEIR_env) environment with the native backend; its model,
+      action mode, hospital capacity and current day are used for planning
+    :param method: (str) 'cem' or 'random' (random shooting)
+    :param horizon: (int) number of env steps planned ahead
+    :param num_candidates: (int) schedules simulated per iteration
+    :param num_elites: (int) best schedules used to refit the distribution
+    :param iterations: (int) CEM iterations per decision
+    :param init_mean: (float) mean of the first sample (1 = no restriction)
+    :param init_std: (float) standard deviation of the first sample
+    :param min_std: (float) lower bound of the standard deviation
+    :param seed: (int) seed of the random number generator
+    """
+
+    methods = ('cem', 'random')
+
+    def __init__(self, env, method='cem', horizon=7, num_candidates=1000,
+                 num_elites=100, iterations=5, init_mean=1., init_std=0.5, min_std=0.05,
+                 seed=0):
+        if env.backend != 'native':
+            raise ValueError("the planner needs the native SEIR model")
+        if method not in self.methods:
+            raise ValueError("method must be one of %s, got %r" % (self.methods, method))
+        self.env = env
+        self.method = method
+        self.horizon = horizon
+        self.num_candidates = num_candidates
+        self.num_elites = num_elites
+        self.iterations = iterations
+        self.init_mean = init_mean
+        self.init_std = init_std
+        self.min_std = min_std
+        self.rng = np.random.default_rng(seed)
+        self.action_size = env.action_mode.size
+
+        # warm start of the next decision (the previous plan shifted by a day)
+        self._mean = None
+
+    def reset(self):
+        self._mean = None
+
+    def rollout(self, state, day, schedules):
+        """
+        Simulate candidate schedules from one state
+
+        :param state: (np.ndarray) compartments, shape (num_cities, 4)
+        :param day: (int) current day of the env
+        :param schedules: (np.ndarray) actions in [-1, 1], shape
+          (num_candidates, horizon, action_size)
+        :return: (np.ndarray) total reward of each schedule, shape (num_candidates,)
+        """
+        env = self.env
+        model = env.model
+        states = np.repeat(state[None], len(schedules), axis=0)
+        alive = np.ones(len(schedules), dtype=bool)
+        returns = np.zeros(len(schedules))
+        for t in range(schedules.shape[1]):
+            if day >= 62 - env.pred or not alive.any():
+                break # the episode is over for every candidate
+            reduction_factor = env.action_mode.reduction_factor(schedules[:, t])
+            model.predict(states, day, env.pred, reduction_factor, out=states)
+            It = states[:, :, I]
+
+            # same reward as SEIR_env.step
+            healthCost   = -1*It.sum(axis=1) + -10*(It > env.hospital_cap).sum(axis=1)
+            economicCost = model.economic_cost(reduction_factor, day)
+            returns += alive*(healthCost + economicCost)
+            alive &= ~(It < 0.5).all(axis=1)
+            day += env.pred
+        return returns
+
+    def plan(self, state, day):
+        """
+        :param state: (np.ndarray) compartments, shape (num_cities, 4)
+        :param day: (int) current day of the env
+        :return: (np.ndarray, float) best schedule, shape (horizon, action_size),
+          and its simulated return
+        """
+        shape = (self.horizon, self.action_size)
+        mean = np.full(shape, self.init_mean) if self._mean is None else self._mean
+        std = np.full(shape, self.init_std)
+        best, best_return = None, -np.inf
+        for it in range(self.iterations if self.method == 'cem' else 1):
+            if self.method == 'random':
+                schedules = self.rng.uniform(-1, 1, (self.num_candidates,) + shape)
+            else:
+                schedules = np.clip(mean + std*self.rng.standard_normal((self.num_candidates,) + shape), -1, 1)
+                schedules[0] = np.clip(mean, -1, 1) # never worse than the current mean
+            returns = self.rollout(state, day, schedules)
+            elites = schedules[np.argsort(returns)[-self.num_elites:]]
+            if returns.max() > best_return:
+                best, best_return = schedules[returns.argmax()], returns.max()
+            mean = elites.mean(axis=0)
+            std = np.maximum(elites.std(axis=0), self.min_std)
+
+        # warm start: tomorrow's plan starts with the rest of today's
+        self._mean = np.concatenate((best[1:], best[-1:]))
+        return best, best_return
+
+    def predict(self, observation=None, state=None, mask=None, deterministic=True):
+        """
+        Best action for the current state of the env (same signature as the
+        Stable Baselines models; the observation is read from the env)
+
+        :return: (np.ndarray, None) action in the env's action space
+        """
+        env = self.env
+        best, _ = self.plan(env.state.T, env.current)
+        return best[0].astype(env.action_space.dtype), None
+
+
+if __name__ == "__main__":
+    hospitalCapacity = 10000 # maximum number of people in the ICU
+
+    # Read the model inputs once (see seir_inputs.py)
+    input_path = "./SEIR_inputs.bin"
+    if not os.path.exists(input_path):
+        export_inputs(input_path, read_input_r())
+    env = SEIR_env(hospitalCapacity, input_data=input_path, action_mode='origin')
+    planner = CEMPlanner(env)
+
+    obs = env.reset()
+    total_reward = 0
+    start = time.time()
+    done = False
+    while not done:
+        action, _ = planner.predict(obs)
+        obs, reward, done, info = env.step(action)
+        total_reward += reward
+        print("Day %d: reward=%.1f, mean restriction=%.3f"
+              % (env.current, reward, 1 - np.mean((action+1)/2)))
+    print("Total reward: %.1f (%.1f s)" % (total_reward, time.time() - start))
@@ -0,0 +1,312 @@
+"""
+Stable Baselines callbacks for the agents training on COVID19_env environments
+
+ProfilingCallback writes the step timers of the environments (created with
+profile=True, see COVID19_env/step_profiler.py) to the tensorboard_log of the
+model:
+    profile/<phase>_ms      mean time per env step of every phase
+    profile/env_step_ms     sum of the phases
+    profile/other_ms        wall time per VecEnv step not spent in the envs:
+                            the agent, the VecEnv pipes and the callbacks
+    profile/env_steps_per_sec
+The stats of all workers of the VecEnv are collected with env_method, so it
+works with SubprocVecEnv and DummyVecEnv alike:
+    env = SubprocVecEnv([make_env(..., profile=True) for i in range(num_cpu)])
+    model = A2C(MlpPolicy, env, tensorboard_log="./SEIR_tensorboard/")
+    model.learn(total_timesteps, callback=ProfilingCallback(log_freq=500))
+
+TelemetryCallback logs a sample of the finished episodes, measured by the
+VecEpisodeTelemetry wrapper of the training env, in place of the histograms
+of full_tensorboard_log:
+    telemetry/episode_reward    total reward of the episode
+    telemetry/episode_length    number of days
+    telemetry/epidemic_peak     highest number of infected people (all cities)
+    telemetry/overflow_days     days on which a city was above hospital capacity
+    telemetry/mean_restriction  mean restriction level of the actions (0 =
+                                open everything, 1 = stay at home / no travel)
+The training loop only appends the sampled episodes to a buffer; full
+buffers are written (to TensorBoard and/or a JSON lines file) by a
+background thread:
+    env = VecEpisodeTelemetry(SubprocVecEnv([...]), hospitalCapacity)
+    model = A2C(MlpPolicy, env, tensorboard_log="./SEIR_tensorboard/")
+    model.learn(total_timesteps, callback=TelemetryCallback(sample_every=10))
+"""
+import sys
+sys.path.append("..")
+
+import json
+import queue
+import threading
+import time
+
+import numpy as np
+
+import tensorflow as tf
+
+from gym import spaces
+
+from stable_baselines.common.callbacks import BaseCallback
+from stable_baselines.common.vec_env import VecEnvWrapper
+
+from COVID19_env.step_profiler import PHASES, merge_stats
+
+
+class ProfilingCallback(BaseCallback):
+    """
+    :param log_freq: (int) collect and write the stats every log_freq VecEnv steps
+    :param verbose: (int) 1 to also print the stats
+    """
+
+    def __init__(self, log_freq=500, verbose=0):
+        super(ProfilingCallback, self).__init__(verbose)
+        self.log_freq = log_freq
+        self.last_stats = None
+        self._time = None
+        self._last_call = 0
+
+    def _on_training_start(self):
+        self.training_env.env_method('reset_profile_stats')
+        self._time = time.perf_counter()
+        self._last_call = self.n_calls
+
+    def _on_step(self):
+        if self.n_calls - self._last_call >= self.log_freq:
+            self._log()
+        return True
+
+    def _on_training_end(self):
+        if self.n_calls > self._last_call:
+            self._log()
+
+    def _log(self):
+        stats = [s for s in self.training_env.env_method('profile_stats') if s is not None]
+        self.training_env.env_method('reset_profile_stats')
+        now = time.perf_counter()
+        wall, vec_steps = now - self._time, self.n_calls - self._last_call
+        self._time, self._last_call = now, self.n_calls
+        if not stats:
+            return # the envs were created without profile=True
+        stats = merge_stats(stats)
+        if stats['steps'] == 0:
+            return
+
+        # the workers step in parallel: a VecEnv step takes about one env step
+        values = {'profile/%s_ms' % phase: stats[phase]['mean_ms'] for phase in PHASES}
+        env_step_ms = sum(stats[phase]['mean_ms'] for phase in PHASES)
+        values['profile/env_step_ms'] = env_step_ms
+        values['profile/other_ms'] = 1e3*wall/max(vec_steps, 1) - env_step_ms
+        values['profile/env_steps_per_sec'] = stats['steps']/wall
+        self.last_stats = values
+
+        writer = self.locals.get('writer')
+        if writer is not None:
+            summary = tf.Summary(value=[tf.Summary.Value(tag=tag, simple_value=value)
+                                        for tag, value in values.items()])
+            writer.add_summary(summary, self.num_timesteps)
+        if self.verbose > 0:
+            print(' '.join('%s=%.3f' % item for item in sorted(values.items())))
+
+
+# metrics of VecEpisodeTelemetry episodes, in TelemetryCallback order
+TELEMETRY = ('episode_reward', 'episode_length', 'epidemic_peak', 'overflow_days',
+             'mean_restriction')
+
+
+class VecEpisodeTelemetry(VecEnvWrapper):
+    """
+    Measures the episodes of a simple_SIR_env or SEIR_env VecEnv with a few
+    array operations per step; finished episodes are queued in self.episodes
+    for TelemetryCallback
+
+    The observation layout is taken from the envs: simple_SIR_env (discrete
+    actions) observes (S, I, R), SEIR_env the S, E, I and R rows of every
+    city, and with stack_days=True the envs stack action_repeat of those.
+    Episode lengths, peaks and overflow days are counted per simulated day
+    when the envs report info['days'] (action_repeat).
+
+    :param venv: (VecEnv) environments to measure
+    :param hospital_capacity: (float or np.ndarray) hospital capacity of the
+      envs (of every city), per env
+    """
+
+    def __init__(self, venv, hospital_capacity):
+        VecEnvWrapper.__init__(self, venv)
+        num_envs = self.num_envs
+        self.hospital_cap = np.broadcast_to(np.asarray(hospital_capacity, dtype=np.float64),
+                                            (num_envs,))
+        self._cap = self.hospital_cap[:, None, None]
+        self.discrete = isinstance(self.action_space, spaces.Discrete)
+        # (compartments, infected row) of an observation, and days stacked in it
+        self._layout = (3, 1) if self.discrete else (4, 2)
+        self.repeat = int(_env_attr(venv, 'action_repeat', 1))
+        self.stack = self.repeat if _env_attr(venv, 'stack_days', False) else 1
+        self._days = np.arange(self.stack)
+        self.episodes = []
+        self._reward = np.zeros(num_envs)
+        self._length = np.zeros(num_envs, dtype=np.int64)
+        self._peak = np.zeros(num_envs)
+        self._overflow = np.zeros(num_envs, dtype=np.int64)
+        self._action_sum = np.zeros(num_envs) # restriction level from the sum at the end
+        self._actions = None
+
+    def _infected(self, observations):
+        # (num_envs, stacked days, num_cities) infected
+        compartments, row = self._layout
+        observations = np.asarray(observations)
+        return observations.reshape(len(observations), self.stack, compartments, -1)[:, :, row]
+
+    def _mean_restriction(self, i):
+        # actions 0, 1, 2 of simple_SIR_env are restrictions 0, 0.5, 1; the
+        # SEIR_env actions in [-1, 1] are reduction factors 0 to 1
+        if self.discrete:
+            return self._action_sum[i]/self._length[i]/2
+        mean = self._action_sum[i]/(self._length[i]*int(np.prod(self.action_space.shape)))
+        return 1 - (mean + 1)/2
+
+    def reset(self):
+        observations = self.venv.reset()
+        for counter in (self._reward, self._length, self._overflow, self._action_sum):
+            counter[:] = 0
+        self._peak[:] = self._infected(observations)[:, -1].sum(axis=1)
+        return observations
+
+    def step_async(self, actions):
+        self._actions = actions
+        self.venv.step_async(actions)
+
+    def step_wait(self):
+        observations, rewards, dones, infos = self.venv.step_wait()
+        any_done = dones.any()
+
+        # the finished envs are reset already, measure their last observation
+        last = observations
+        if any_done:
+            done = np.flatnonzero(dones)
+            last = np.array(observations, dtype=np.float64)
+            for i in done:
+                last[i] = infos[i]['terminal_observation']
+        infected = self._infected(last)
+        overflow = (infected > self._cap).any(axis=2)
+        totals = infected.sum(axis=2)
+        actions = np.asarray(self._actions).reshape(self.num_envs, -1)
+        action_sum = np.add.reduce(actions, axis=1, dtype=np.float64)
+        if self.repeat == 1:
+            self._length += 1
+        else:
+            # per day: the action was held for info['days'] days
+            days = np.array([info.get('days', self.repeat) for info in infos])
+            self._length += days
+            action_sum *= days
+            if self.stack > 1:
+                # rows after the end of the episode repeat its last day
+                simulated = self._days < days[:, None]
+                overflow &= simulated
+                totals = np.where(simulated, totals, 0.)
+        self._reward += rewards
+        self._action_sum += action_sum
+        np.maximum(self._peak, totals.max(axis=1), out=self._peak)
+        self._overflow += overflow.sum(axis=1)
+
+        if any_done:
+            for i in done:
+                self.episodes.append((float(self._reward[i]), int(self._length[i]),
+                                      float(self._peak[i]), int(self._overflow[i]),
+                                      float(self._mean_restriction(i))))
+            self._reward[done] = 0
+            self._length[done] = 0
+            self._overflow[done] = 0
+            self._action_sum[done] = 0
+            self._peak[done] = self._infected(observations[done])[:, -1].sum(axis=1)
+        return observations, rewards, dones, infos
+
+
+def _env_attr(venv, name, default):
+    # attribute of the first env of a VecEnv (default if the envs have none)
+    try:
+        return venv.get_attr(name, indices=[0])[0]
+    except AttributeError:
+        return default
+
+
+def _find_telemetry(env):
+    while env is not None:
+        if isinstance(env, VecEpisodeTelemetry):
+            return env
+        env = getattr(env, 'venv', None)
+    raise ValueError("TelemetryCallback needs the training env wrapped with VecEpisodeTelemetry")
+
+
+class TelemetryCallback(BaseCallback):
+    """
+    :param sample_every: (int) log one in sample_every finished episodes
+    :param buffer_size: (int) sampled episodes buffered before they are
+      handed to the writer thread
+    :param path: (str) also append the sampled episodes to this JSON lines file
+    :param tensorboard: (bool) write to the tensorboard_log of the model (if set)
+    :param verbose: (int) verbosity
+    """
+
+    def __init__(self, sample_every=10, buffer_size=64, path=None, tensorboard=True, verbose=0):
+        super(TelemetryCallback, self).__init__(verbose)
+        self.sample_every = sample_every
+        self.buffer_size = buffer_size
+        self.path = path
+        self.tensorboard = tensorboard
+        self.episodes_seen = 0
+        self._telemetry = None
+        self._buffer = []
+        self._queue = None
+        self._thread = None
+
+    def _on_training_start(self):
+        self._telemetry = _find_telemetry(self.training_env)
+        del self._telemetry.episodes[:]
+        writer = self.locals.get('writer') if self.tensorboard else None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write, args=(writer, self.path), daemon=True)
+        self._thread.start()
+
+    def _on_step(self):
+        episodes = self._telemetry.episodes
+        if episodes:
+            for episode in episodes:
+                if self.episodes_seen % self.sample_every == 0:
+                    self._buffer.append((self.num_timesteps, episode))
+                self.episodes_seen += 1
+            del episodes[:]
+            if len(self._buffer) >= self.buffer_size:
+                self._queue.put(self._buffer)
+                self._buffer = []
+        return True
+
+    def _on_training_end(self):
+        if self._buffer:
+            self._queue.put(self._buffer)
+            self._buffer = []
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write(self, writer, path):
+        # writer thread: drains the queue until _on_training_end sends None
+        f = open(path, 'a') if path is not None else None
+        try:
+            while True:
+                batch = self._queue.get()
+                if batch is None:
+                    break
+                for timestep, episode in batch:
+                    if writer is not None:
+                        summary = tf.Summary(value=[
+                            tf.Summary.Value(tag='telemetry/' + name, simple_value=value)
+                            for name, value in zip(TELEMETRY, episode)])
+                        writer.add_summary(summary, timestep)
+                    if f is not None:
+                        record = dict(zip(TELEMETRY, episode), timestep=timestep, time=time.time())
+                        f.write(json.dumps(record) + '\n')
+                if f is not None:
+                    f.flush()
+                if self.verbose > 0:
+                    print("telemetry: wrote %d episodes" % len(batch))
+        finally:
+            if f is not None:
+                f.close()
@@ -0,0 +1,51 @@
+"""
+smoke test of render_results.py: records simple_SIR_env and SEIR_env style
+runs with trajectories.py and renders them with the headless Agg backend, two
+of the runs sharing their metadata (they must not overwrite each other)
+    $ cd COVID19_agents
+    $ python check_render_results.py
+"""
+import sys
+sys.path.append("..")
+
+import os
+import tempfile
+
+import numpy as np
+
+from COVID19_agents.trajectories import TrajectoryRecorder
+from COVID19_agents.render_results import render_runs
+
+
+def _record(path, metadata, observations, actions, rng):
+    with TrajectoryRecorder(path, metadata) as recorder:
+        recorder.record_episode(observations, actions, rng.uniform(-1, 0, len(actions)),
+                                hospital_capacity=300.)
+
+
+def check_render(steps=20, num_cities=14, seed=0):
+    """
+    :param steps: (int) number of steps of the recorded episodes
+    :param num_cities: (int) number of cities of the SEIR_env run
+    :param seed: (int) seed of the random episodes
+    :return: (list) paths of the figures
+    """
+    rng = np.random.default_rng(seed)
+    metadata = {'agent': 'DQN', 'timesteps': 1000}
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [os.path.join(tmp, name) for name in ('seed0', 'seed1', 'seir')]
+        for path in runs[:2]:
+            _record(path, metadata, rng.uniform(0, 1e3, (steps+1, 3)), rng.integers(0, 3, steps), rng)
+        _record(runs[2], dict(metadata, agent='A2C', env='SEIR'),
+                rng.uniform(0, 1e4, (steps+1, 4*num_cities)).astype(np.float32),
+                rng.uniform(-1, 1, (steps, num_cities, num_cities)).astype(np.float32), rng)
+        out_dir = os.path.join(tmp, 'Results')
+        paths = render_runs(runs, out_dir, processes=2)
+        assert len(set(paths)) == len(runs), "figures overwrite each other: %s" % paths
+        for path in paths:
+            assert os.path.getsize(path) > 0, "empty figure: %s" % path
+        return [os.path.basename(path) for path in paths]
+
+
+if __name__ == "__main__":
+    print("rendered:", ', '.join(check_render()))
@@ -0,0 +1,57 @@
+"""
+checks that a run recorded with trajectories.py survives an interruption:
+the rows written to the columns but not indexed are dropped when the run is
+opened again, and the next episodes read back unchanged
+    $ cd COVID19_agents
+    $ python check_trajectories.py
+"""
+import sys
+sys.path.append("..")
+
+import os
+import tempfile
+
+import numpy as np
+
+from COVID19_agents.trajectories import TrajectoryRecorder, load_run
+
+
+def _episode(rng, steps):
+    return (rng.uniform(0, 1e4, (steps+1, 3)).astype(np.float32),
+            rng.integers(0, 3, steps),
+            rng.uniform(-1, 0, steps))
+
+
+def check_recovery(seed=0):
+    """
+    :param seed: (int) seed of the random episodes
+    :return: (int) number of episodes read back
+    """
+    rng = np.random.default_rng(seed)
+    episodes = [_episode(rng, steps) for steps in (5, 8, 3)]
+    with tempfile.TemporaryDirectory() as path:
+        with TrajectoryRecorder(path, {'agent': 'DQN', 'timesteps': 100}) as recorder:
+            for observations, actions, rewards in episodes[:2]:
+                recorder.record_episode(observations, actions, rewards)
+        # interrupted run: one episode recorded but not indexed, one written
+        # to the first two columns only
+        recorder = TrajectoryRecorder(path)
+        recorder.record_episode(*_episode(rng, 4))
+        observations, actions, _ = _episode(rng, 6)
+        for name, values in (('observations', observations), ('actions', actions)):
+            with open(os.path.join(path, name + '.bin'), 'ab') as f:
+                f.write(values.tobytes())
+
+        with TrajectoryRecorder(path) as recorder:
+            recorder.record_episode(*episodes[2])
+        metadata, recorded = load_run(path)
+        assert metadata == {'agent': 'DQN', 'timesteps': 100}
+        assert len(recorded) == len(episodes)
+        for expected, episode in zip(episodes, recorded):
+            for name, values in zip(('observations', 'actions', 'rewards'), expected):
+                assert np.array_equal(episode[name], values), "%s differ after recovery" % name
+        return len(recorded)
+
+
+if __name__ == "__main__":
+    print("episodes read back after an interrupted one:", check_recovery())
@@ -0,0 +1,195 @@
+"""
+batched evaluation of trained agents over many scenarios
+
+Instead of stepping one environment and printing every step (see the test
+loops in DQN_simple_SIR.py and A2C_SEIR.py), every scenario -- a combination
+of initial condition and hospital capacity -- is one replica of a vectorized
+environment (simple_SIR_vec_env or SEIR_vec_env). All replicas are advanced
+together and the policy is queried with one batched model.predict call per
+day. Each seed is one such batched pass.
+
+The result holds per-episode arrays (scenario grid order: seed, initial
+condition, hospital capacity) and summary statistics of the episode rewards:
+    returns         (num_seeds, num_initial, num_capacities)
+    lengths         same shape, number of steps of each episode
+    observations    (..., max_steps+1, obs_dim), NaN after the episode ended
+    actions         (..., max_steps, *action_shape), NaN after the end
+    rewards         (..., max_steps), NaN after the end
+    hospital_capacity  (num_seeds, num_initial, num_capacities)
+    summary         dict of mean, std, min, p5, p50, p95 and max of returns
+
+Example, evaluating a saved DQN agent on simple_SIR_env:
+    $ cd COVID19_agents
+    $ python evaluation.py DQN path/to/model.zip
+"""
+import sys
+sys.path.append("..")
+
+import numpy as np
+
+from COVID19_env.simple_SIR_vec_env import simple_SIR_vec_env
+from COVID19_env.SEIR_vec_env import SEIR_vec_env
+
+
+def load_model(path, algo):
+    """
+    :param path: (str) file saved with model.save
+    :param algo: (str) Stable Baselines algorithm name, e.g. 'DQN' or 'A2C'
+    :return: (BaseRLModel) the model
+    """
+    import stable_baselines
+    return getattr(stable_baselines, algo).load(path)
+
+
+def _set_seed(seed):
+    try:
+        from stable_baselines.common import set_global_seeds
+    except ImportError:
+        np.random.seed(seed)
+    else:
+        set_global_seeds(seed)
+
+
+def run_episodes(model, env, obs, max_steps, deterministic=True):
+    """
+    Run one episode in every replica of a vectorized environment (from its
+    current state), querying the model once per step for all replicas
+
+    :param model: object with a Stable Baselines style predict(obs, deterministic)
+    :param env: (VecEnv) environment, already reset
+    :param obs: (np.ndarray) current observations of the replicas
+    :param max_steps: (int) maximum episode length
+    :param deterministic: (bool) deterministic actions
+    :return: (dict) returns, lengths, observations, actions and rewards
+    """
+    num_envs = env.num_envs
+    observations = np.full((num_envs, max_steps+1) + obs.shape[1:], np.nan)
+    observations[:, 0] = obs
+    rewards = np.full((num_envs, max_steps), np.nan)
+    actions = None
+    lengths = np.zeros(num_envs, dtype=np.int64)
+    active = np.ones(num_envs, dtype=bool)
+    for t in range(max_steps):
+        action, _ = model.predict(obs, deterministic=deterministic)
+        action = np.asarray(action)
+        if actions is None:
+            actions = np.full((num_envs, max_steps) + action.shape[1:], np.nan)
+        actions[active, t] = action[active]
+        obs, reward, done, infos = env.step(action)
+        rewards[active, t] = reward[active]
+        lengths[active] += 1
+
+        # the replicas are reset automatically, keep the last observation
+        last = np.array(obs, dtype=np.float64)
+        for i in np.flatnonzero(done & active):
+            last[i] = infos[i]['terminal_observation']
+        observations[active, t+1] = last[active]
+        active &= ~done
+        if not active.any():
+            break
+    returns = np.nansum(rewards, axis=1)
+    return {'returns': returns, 'lengths': lengths, 'observations': observations,
+            'actions': actions, 'rewards': rewards}
+
+
+def summarize(returns):
+    """
+    :param returns: (np.ndarray) episode rewards
+    :return: (dict) mean, std, min, p5, p50, p95 and max
+    """
+    returns = np.ravel(returns)
+    p5, p50, p95 = np.percentile(returns, (5, 50, 95))
+    return {'mean': returns.mean(), 'std': returns.std(), 'min': returns.min(),
+            'p5': p5, 'p50': p50, 'p95': p95, 'max': returns.max()}
+
+
+def _evaluate(model, make_env, num_initial, capacities, seeds, max_steps, deterministic,
+              restore=None):
+    # one batched pass per seed over the (initial condition, capacity) grid
+    num_scenarios = num_initial*len(capacities)
+    env = make_env(num_scenarios, np.tile(capacities, num_initial))
+    passes = []
+    for seed in seeds:
+        _set_seed(seed)
+        env.seed(seed)
+        obs = env.reset()
+        if restore is not None:
+            obs = restore(env)
+        passes.append(run_episodes(model, env, obs, max_steps, deterministic))
+    env.close()
+
+    grid = (len(seeds), num_initial, len(capacities))
+    result = {key: np.stack([p[key] for p in passes]).reshape(grid + passes[0][key].shape[1:])
+              for key in passes[0]}
+    result['hospital_capacity'] = np.broadcast_to(capacities, grid).copy()
+    result['summary'] = summarize(result['returns'])
+    return result
+
+
+def evaluate_simple_SIR(model, initial_conditions, hospital_capacities, seeds=(0,),
+                        max_steps=100, deterministic=True, backend='native'):
+    """
+    Evaluate a model on simple_SIR_env scenarios
+
+    :param model: model, or (path, algo) of a saved Stable Baselines model
+    :param initial_conditions: (np.ndarray) (S0, I0, R0) rows, shape (num_initial, 3)
+    :param hospital_capacities: (list) hospital capacities
+    :param seeds: (list) seeds, one batched pass each
+    :param max_steps: (int) maximum episode length in days
+    :param deterministic: (bool) deterministic actions
+    :param backend: (str) SIR integrator of simple_SIR_vec_env
+    :return: (dict) see module docstring
+    """
+    if isinstance(model, tuple):
+        model = load_model(*model)
+    initial = np.asarray(initial_conditions, dtype=np.float64).reshape(-1, 3)
+    capacities = np.asarray(hospital_capacities, dtype=np.float64)
+    per_env = np.repeat(initial, len(capacities), axis=0)
+
+    def make_env(num_envs, caps):
+        return simple_SIR_vec_env(num_envs, per_env[:, 0], per_env[:, 1], per_env[:, 2],
+                                  caps, backend=backend, max_steps=max_steps)
+    return _evaluate(model, make_env, len(initial), capacities, seeds, max_steps, deterministic)
+
+
+def evaluate_SEIR(model, input_data, hospital_capacities, initial_states=None, seeds=(0,),
+                  deterministic=True, **env_kwargs):
+    """
+    Evaluate a model on SEIR_env scenarios
+
+    :param model: model, or (path, algo) of a saved Stable Baselines model
+    :param input_data: (dict or str) SEIR model inputs, or a snapshot path
+    :param hospital_capacities: (list) hospital capacities
+    :param initial_states: (list) SEIR_env.get_state snapshots to start from,
+      None to start from the input data
+    :param seeds: (list) seeds, one batched pass each
+    :param deterministic: (bool) deterministic actions
+    :param env_kwargs: other SEIR_vec_env arguments (e.g. action_mode)
+    :return: (dict) see module docstring
+    """
+    if isinstance(model, tuple):
+        model = load_model(*model)
+    capacities = np.asarray(hospital_capacities, dtype=np.float64)
+    num_initial = 1 if initial_states is None else len(initial_states)
+    restore = None
+    if initial_states is not None:
+        per_env = [s for s in initial_states for _ in capacities]
+        restore = lambda env: env.set_states(per_env)
+
+    def make_env(num_envs, caps):
+        return SEIR_vec_env(num_envs, caps, input_data, **env_kwargs)
+    max_steps = 62 # the SEIR episodes end before day 62
+    return _evaluate(model, make_env, num_initial, capacities, seeds, max_steps, deterministic,
+                     restore)
+
+
+if __name__ == "__main__":
+    # Evaluate a saved simple_SIR_env agent over a grid of scenarios
+    algo, path = sys.argv[1], sys.argv[2]
+    initial_conditions = [(1000 - I0, I0, 0) for I0 in (1, 5, 10, 50)]
+    hospital_capacities = np.linspace(100, 500, 9)
+    result = evaluate_simple_SIR((path, algo), initial_conditions, hospital_capacities,
+                                 seeds=range(5))
+    print("%d episodes" % result['returns'].size)
+    for key, value in result['summary'].items():
+        print("%s: %.1f" % (key, value))
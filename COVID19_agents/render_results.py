@@ -0,0 +1,148 @@
+"""
+offline rendering of recorded runs (see trajectories.py) into Results/ figures
+
+Every run is drawn in the style of the figures in Results/ (compartments,
+hospital capacity and the action of every day), with the headless Agg
+backend, by a pool of worker processes. Runs can be rendered long after
+training, without re-running anything:
+    $ cd COVID19_agents
+    $ python render_results.py runs/* --out ../Results
+
+The figure name and title come from the run metadata: 'agent', 'env',
+'timesteps' and 'hospital_capacity' (the hospital capacity can also be stored
+per episode). The figure name ends with the run directory name.
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import multiprocessing
+import os
+
+import numpy as np
+
+from COVID19_agents.trajectories import load_run
+
+# action text box of the simple_SIR_env figures
+SIR_ACTIONS = '\n'.join(('0: Open all', '1: Open half', '2: Stay home'))
+
+
+def _compartments(observations):
+    # simple_SIR_env observations are (S, I, R), SEIR_env ones the S, E, I
+    # and R rows of every city
+    if observations.shape[1] == 3:
+        return (("Susceptible", "-b", observations[:, 0]),
+                ("Infected", "-r", observations[:, 1]),
+                ("Recovered", "-y", observations[:, 2]))
+    totals = observations.reshape(len(observations), 4, -1).sum(axis=2)
+    return (("Susceptible", "-b", totals[:, 0]),
+            ("Exposed", "-g", totals[:, 1]),
+            ("Infected", "-r", totals[:, 2]),
+            ("Recovered", "-y", totals[:, 3]))
+
+
+def _action_labels(actions):
+    if actions.ndim == 1:
+        return ['%d' % a for a in actions]
+    # continuous SEIR_env actions: mean reduction factor
+    return ['%.2f' % a for a in ((actions.reshape(len(actions), -1)+1)/2).mean(axis=1)]
+
+
+def figure_name(metadata, run_path):
+    """
+    :param metadata: (dict) run metadata
+    :param run_path: (str) run directory
+    :return: (str) Results/ style file name ending with the run directory name,
+      e.g. DQN_simple_SIR_results50000_seed0.png for the run seed0; runs with
+      the same agent, env and training steps do not overwrite each other
+    """
+    run = os.path.basename(os.path.normpath(run_path))
+    if 'agent' in metadata and 'timesteps' in metadata:
+        return "%s_%s_results%d_%s.png" % (metadata['agent'], metadata.get('env', 'simple_SIR'),
+                                           metadata['timesteps'], run)
+    return run + ".png"
+
+
+def render_run(run_path, out_dir, episode=0):
+    """
+    Draw one episode of a recorded run
+
+    :param run_path: (str) run directory
+    :param out_dir: (str) directory of the figure
+    :param episode: (int) index of the episode to draw
+    :return: (str) path of the figure
+    """
+    import matplotlib
+    matplotlib.use('Agg') # headless, no display needed
+    import matplotlib.pyplot as plt
+
+    metadata, episodes = load_run(run_path)
+    data = episodes[episode]
+    observations = np.asarray(data['observations'])
+    actions = np.asarray(data['actions'])
+    n_steps = len(actions)
+
+    # initiate figure
+    fig, ax = plt.subplots(constrained_layout=True)
+
+    # define time vector for plot
+    steps = np.linspace(0,n_steps,n_steps+1)
+
+    # plot recorded data
+    for label, style, values in _compartments(observations):
+        plt.plot(steps, values, style, label=label)
+    hospitalCapacity = data.get('hospital_capacity', metadata.get('hospital_capacity'))
+    if hospitalCapacity is not None:
+        plt.plot([0,max(steps)], [hospitalCapacity,hospitalCapacity], "--k", label="Hospital Capacity")
+
+    # Create 'Action' axis
+    secax = ax.secondary_xaxis('top')
+    secax.set_xticks(steps)
+    secax.set_xticklabels(_action_labels(actions) + ['-']) # no action for last time step
+    secax.set_xlabel("Action")
+
+    # Create legends and labels
+    if actions.ndim == 1:
+        ax.text(0.7, 0.85, SIR_ACTIONS, transform=ax.transAxes, fontsize=11,
+                verticalalignment='top') # action text box / legend
+    plt.legend(loc="best")
+    plt.xlabel("Day")
+    plt.ylabel("Number of People")
+    if 'agent' in metadata and 'timesteps' in metadata:
+        plt.title("%s agent after %d training steps" % (metadata['agent'], metadata['timesteps']))
+
+    # save figure
+    os.makedirs(out_dir, exist_ok=True)
+    save_path = os.path.join(out_dir, figure_name(metadata, run_path))
+    fig.savefig(save_path)
+    plt.close(fig)
+    return save_path
+
+
+def _render(args):
+    return render_run(*args)
+
+
+def render_runs(run_paths, out_dir, episode=0, processes=None):
+    """
+    Draw many runs in parallel
+
+    :param run_paths: (list) run directories
+    :param out_dir: (str) directory of the figures
+    :param episode: (int) index of the episode to draw in every run
+    :param processes: (int) number of worker processes, default: all cores
+    :return: (list) paths of the figures
+    """
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(_render, [(path, out_dir, episode) for path in run_paths])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="render recorded runs into figures")
+    parser.add_argument('runs', nargs='+', help="run directories")
+    parser.add_argument('--out', default='../Results', help="directory of the figures")
+    parser.add_argument('--episode', type=int, default=0, help="episode to draw")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes")
+    args = parser.parse_args()
+    for path in render_runs(args.runs, args.out, args.episode, args.processes):
+        print(path)
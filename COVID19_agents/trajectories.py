@@ -0,0 +1,161 @@
+"""
+append-only columnar storage of evaluation trajectories
+
+A run is a directory holding one binary file per column and a small index:
+    <run>/observations.bin   observations of every episode, back to back
+    <run>/actions.bin        actions of every episode
+    <run>/rewards.bin        rewards of every episode
+    <run>/index.json         dtype and row shape of every column, the run
+                             metadata (agent, training steps, hospital
+                             capacity, ...) and the rows of every episode
+Each recorded episode is appended as one chunk to every column file. The
+index is rewritten once per record_evaluation and on flush / close (not after
+every episode, which would make recording quadratic in the number of
+episodes), so a run can be read (memory mapped) while it is still being
+recorded, up to the last index write. An interrupted run only loses the
+episodes recorded since then: when a run is opened again, bytes past the
+rows of its index are cut from the column files.
+
+Figures are rendered from these files later with render_results.py, so
+nothing has to be plotted during training.
+"""
+import json
+import os
+
+import numpy as np
+
+COLUMNS = ('observations', 'actions', 'rewards')
+
+
+class TrajectoryRecorder(object):
+    """
+    :param path: (str) run directory (created if needed, appended to if it exists)
+    :param metadata: (dict) JSON serializable description of the run, e.g.
+      {'agent': 'DQN', 'timesteps': 50000, 'hospital_capacity': 300}
+
+    Episodes added with record_episode are indexed by the next flush (or
+    close, or the end of a with block).
+    """
+
+    def __init__(self, path, metadata=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        index_path = os.path.join(path, 'index.json')
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = json.load(f)
+            if metadata:
+                self.index['metadata'].update(metadata)
+            self._dirty = bool(metadata)
+        else:
+            self.index = {'metadata': dict(metadata or {}), 'columns': {}, 'episodes': []}
+            self._dirty = True
+        self._truncate_columns()
+
+    def record_episode(self, observations, actions, rewards, **info):
+        """
+        Append one episode (indexed by the next flush)
+
+        :param observations: (np.ndarray) observations, shape (steps+1, ...)
+        :param actions: (np.ndarray) actions, shape (steps, ...)
+        :param rewards: (np.ndarray) rewards, shape (steps,)
+        :param info: JSON serializable values stored with the episode (e.g. seed)
+        """
+        episode = dict(info)
+        for name, values in zip(COLUMNS, (observations, actions, rewards)):
+            values = np.ascontiguousarray(values)
+            column = self.index['columns'].setdefault(
+                name, {'dtype': values.dtype.str, 'shape': list(values.shape[1:]), 'rows': 0})
+            if values.dtype.str != column['dtype'] or list(values.shape[1:]) != column['shape']:
+                raise ValueError("%s: expected rows of %s %s, got %s %s"
+                                 % (name, column['dtype'], column['shape'], values.dtype.str,
+                                    list(values.shape[1:])))
+            with open(os.path.join(self.path, name + '.bin'), 'ab') as f:
+                f.write(values.tobytes())
+            episode[name] = [column['rows'], len(values)]
+            column['rows'] += len(values)
+        self.index['episodes'].append(episode)
+        self._dirty = True
+
+    def record_evaluation(self, result, **info):
+        """
+        Append every episode of an evaluation.py result and write the index
+
+        :param result: (dict) returned by evaluate_simple_SIR / evaluate_SEIR
+        :param info: JSON serializable values stored with every episode
+        """
+        grid = result['returns'].shape
+        for scenario in np.ndindex(*grid):
+            steps = int(result['lengths'][scenario])
+            self.record_episode(result['observations'][scenario][:steps+1],
+                                result['actions'][scenario][:steps],
+                                result['rewards'][scenario][:steps],
+                                scenario=list(scenario),
+                                hospital_capacity=float(result['hospital_capacity'][scenario]),
+                                **info)
+        self.flush()
+
+    def flush(self):
+        """
+        Write the index, making the episodes recorded so far readable
+        """
+        if self._dirty:
+            self._write_index()
+            self._dirty = False
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _truncate_columns(self):
+        # drop the rows an interrupted record_episode appended after the last
+        # index write, so that the next episode starts at the indexed row
+        for name in COLUMNS:
+            column_path = os.path.join(self.path, name + '.bin')
+            if not os.path.exists(column_path):
+                continue
+            column = self.index['columns'].get(name)
+            size = 0
+            if column is not None:
+                size = column['rows'] * np.dtype(column['dtype']).itemsize * int(np.prod(column['shape']))
+            if os.path.getsize(column_path) > size:
+                os.truncate(column_path, size)
+
+    def _write_index(self):
+        index_path = os.path.join(self.path, 'index.json')
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(index_path + '.tmp', index_path)
+
+
+def load_run(path):
+    """
+    Open a recorded run
+
+    :param path: (str) run directory
+    :return: (dict, list) run metadata and the episodes; every episode is a dict
+      of its info and read-only views (memory mapped) of its columns
+    """
+    with open(os.path.join(path, 'index.json')) as f:
+        index = json.load(f)
+    columns = {}
+    for name, column in index['columns'].items():
+        shape = (column['rows'],) + tuple(column['shape'])
+        if column['rows'] == 0:
+            columns[name] = np.empty(shape, dtype=np.dtype(column['dtype']))
+        else:
+            columns[name] = np.memmap(os.path.join(path, name + '.bin'), dtype=np.dtype(column['dtype']),
+                                          mode='r', shape=shape)
+    episodes = []
+    for episode in index['episodes']:
+        episode = dict(episode)
+        for name in columns:
+            start, rows = episode[name]
+            episode[name] = columns[name][start:start+rows]
+        episodes.append(episode)
+    return index['metadata'], episodes
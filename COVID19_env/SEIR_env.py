@@ -8,16 +8,45 @@ sys.path.append("..")
 
 import os
 
-import rpy2.robjects as robjects
-from rpy2.robjects import numpy2ri
-
 import gym
 from gym import spaces
 from gym.utils import seeding
 
 import numpy as np
 
-from rpy2.robjects.packages import STAP
+from COVID19_env.seir_model import SEIRModel, SparseOD, FactoredReduction
+from COVID19_env.stochastic_seir import StochasticSEIRModel
+from COVID19_env.action_modes import make_action_mode, FullAction
+from COVID19_env.seir_inputs import load_inputs
+from COVID19_env.env_state import rng_state, set_rng_state
+from COVID19_env.step_profiler import StepProfiler
+
+# names of the SEIR model inputs returned by read_input.R's getData
+INPUT_NAMES = ("beta_data", "beta_sd_data", "latent", "gamma", "St_data",
+               "Et_data", "It_data", "Rt_data", "ODs", "pops", "current",
+               "pred", "city_names")
+
+# inputs that do not change during an episode (converted to R objects once)
+R_STATIC_INPUTS = ("beta_data", "beta_sd_data", "latent", "gamma", "ODs",
+                   "pops", "city_names")
+
+# location of read_input.R, seir_r.R and RL_input (SEIR submodule)
+SEIR_MODEL_DIR = '/Users/benbernhard/Documents/GitHub/COVID19_RL/COVID19_models/SEIR/'
+
+def read_input_r():
+  """
+  Read the SEIR model inputs from RL_input with read_input.R (requires R)
+
+  :return: (dict) R objects keyed by INPUT_NAMES
+  """
+  from COVID19_env.r_models import package_function
+
+  # Get input data
+  getData_r = package_function(SEIR_MODEL_DIR + 'read_input.R', 'getData')
+  cwd = os.getcwd()
+  input_data = getData_r(SEIR_MODEL_DIR + 'RL_input')
+  os.chdir(cwd)
+  return {name: input_data.rx2(name) for name in INPUT_NAMES}
 
 class SEIR_env(gym.Env):
   """
@@ -39,12 +68,21 @@ class SEIR_env(gym.Env):
         2       Infected          0       Total Population
         3       Recovered         0       Total Population
 
+        With stack_days=True: Box(action_repeat*4*14,), the compartments at
+        the end of every model step of the env step (see Action repeat)
+
   Actions:
         Type: Box(14,14), min=0 max=1
         Num     Action                          Change in model
         1       No travel restriction           reduction_factor = 1
         0       Complete travel restriction     reduction_factor = 0
 
+        With action_mode other than 'full' the actions are factors of the
+        reduction factor matrix (see action_modes.py):
+        'origin'    Box(14,), one restriction per origin city
+        'rank'      Box(2*rank*14,), rank-k origin x destination factors
+        'cluster'   Box(num_clusters**2,), one restriction per pair of regions
+
   Reward:
         reward = health cost + economic cost
 
@@ -53,147 +91,350 @@ class SEIR_env(gym.Env):
            -10 for every infected case that brings total infected count of a
                 given city above a specified maximum (hospital capacity)
         Economic cost:
-            sum(-(10*(1-action))**2)
+            sum(-(10*(1-action))**2) over all the OD pairs
 
   Episode Termination:
         Episode length (time) reaches specified maximum (end time)
+
+  Backends:
+        'native'   numpy implementation of the model in seir_model.py (default)
+        'r'        seirPredictions in seir_r.R, called through rpy2
+
+  Action repeat:
+        With action_repeat=k every step holds the action for k model steps of
+        pred days (k days with the RL_input data, pred = 1): the native
+        backend simulates them in one call (SEIRModel.rollout) and the reward
+        is the sum of the k rewards of single steps. The step stops at the
+        end of the episode; info['days'] is the number of days simulated.
+
+  Stochastic dynamics:
+        With stochastic=True the native backend draws the daily transitions
+        and travel of whole people (chain binomial, see stochastic_seir.py).
+        The draws come from a counter-based stream keyed by the seed and the
+        replica index, so an episode only depends on (seed, replica, episode
+        number): give every env of a run the same seed and its own replica.
   """
 
 
   metadata = {'render.modes': ['human']}
-
-  def __init__(self, hospitalCapacity):
+  backends = ('native', 'r')
+
+  def __init__(self, hospitalCapacity, backend='native', input_data=None,
+               action_mode='full', rank=1, clusters=None, profile=False,
+               action_repeat=1, stack_days=False, stochastic=False, replica=0):
+    """
+    :param hospitalCapacity: (float) maximum number of people in the ICU
+    :param backend: (str) SEIR model implementation, see Backends above
+    :param input_data: (dict or str) SEIR model inputs keyed by INPUT_NAMES,
+      or the path of a snapshot written by seir_inputs.export_inputs (memory
+      mapped read-only). If None, the inputs are read from RL_input with
+      read_input.R (requires R). ODs can be a seir_model.SparseOD (native
+      backend only)
+    :param action_mode: (str) action parameterization, see Actions above
+    :param rank: (int) number of factors of the 'rank' action mode
+    :param clusters: (np.ndarray) region of each city, for the 'cluster'
+      action mode
+    :param profile: (bool) time the phases of every step, see step_profiler.py
+    :param action_repeat: (int) model steps per env step, see Action repeat
+      above
+    :param stack_days: (bool) observe the compartments after every model step
+      of the env step instead of the last one only
+    :param stochastic: (bool) random dynamics, see Stochastic dynamics above
+    :param replica: (int) index of the env among the envs of a run, selects
+      its random stream
+    """
     super(SEIR_env, self).__init__()
 
-    # get r
-    cwd = os.getcwd()
-    with open('/Users/benbernhard/Documents/GitHub/COVID19_RL/COVID19_models/SEIR/read_input.R', 'r') as f:
-        string = f.read()
-    read_input = STAP(string, "read_input")
-    getData_r=read_input.getData
+    # SEIR model backend
+    if backend not in self.backends:
+      raise ValueError("backend must be one of %s, got %r" % (self.backends, backend))
+    self.backend = backend
 
     # Get input data
-    input_data = getData_r("/Users/benbernhard/Documents/GitHub/COVID19_RL/COVID19_models/SEIR/RL_input")
-    os.chdir(cwd)
+    if input_data is None:
+      input_data = read_input_r()
+    elif isinstance(input_data, str):
+      input_data = load_inputs(input_data)
+    if backend == 'r' and isinstance(input_data["ODs"], SparseOD):
+      raise ValueError("sparse OD data is only supported by the native backend")
+    if backend == 'r' and stochastic:
+      raise ValueError("stochastic dynamics are only supported by the native backend")
+    self.stochastic = stochastic
+    self.replica    = replica
 
     # SEIR model inputs
     self.hospital_cap = hospitalCapacity
-    self.beta_data    = input_data.rx2("beta_data")
-    self.beta_sd_data = input_data.rx2("beta_sd_data")
-    self.latent       = input_data.rx2("latent")
-    self.gamma        = input_data.rx2("gamma")
-    self.St_data      = np.array(input_data.rx2("St_data"))
-    self.Et_data      = np.array(input_data.rx2("Et_data"))
-    self.It_data      = np.array(input_data.rx2("It_data"))
-    self.Rt_data      = np.array(input_data.rx2("Rt_data"))
-    self.ODs          = input_data.rx2("ODs")
-    self.pops         = input_data.rx2("pops")
-    self.current      = int(input_data.rx2("current")[0])
-    self.pred         = int(input_data.rx2("pred")[0])
-    self.city_names   = input_data.rx2("city_names")
+    self.beta_data    = input_data["beta_data"]
+    self.beta_sd_data = input_data["beta_sd_data"]
+    self.latent       = input_data["latent"]
+    self.gamma        = input_data["gamma"]
+    self.ODs          = input_data["ODs"]
+    self.pops         = input_data["pops"]
+    self.current      = int(np.ravel(input_data["current"])[0])
+    self.pred         = int(np.ravel(input_data["pred"])[0])
+    self.city_names   = input_data["city_names"]
+    self.action_repeat = int(action_repeat)
+    self.stack_days   = stack_days
+
+    # R objects for the static inputs, created on the first R step
+    self._r_inputs = None
+
+    # Native SEIR model
+    if self.backend == 'native':
+      model = StochasticSEIRModel if stochastic else SEIRModel
+      self.model = model.from_input_data(input_data)
+
+    # Compartment data, one contiguous (4, num_days, num_cities) buffer.
+    # St_data, Et_data, It_data and Rt_data are views of its rows; steps write
+    # into it and reset restores the rows written since the last reset from
+    # the untouched copy in self._data0.
+    self._data0 = np.stack([np.array(input_data[name], dtype=np.float64)
+                            for name in ("St_data", "Et_data", "It_data", "Rt_data")])
+    self._data0.flags.writeable = False
+    self._data = self._data0.copy()
+    self.St_data, self.Et_data, self.It_data, self.Rt_data = self._data
+    self.St_data0, self.Et_data0, self.It_data0, self.Rt_data0 = self._data0
 
     # Save intial conditions for reset
     self.current0 = self.current
-    self.St_data0 = self.St_data
-    self.Et_data0 = self.Et_data
-    self.It_data0 = self.It_data
-    self.Rt_data0 = self.Rt_data
 
     # Define action and observation space
     # They must be gym.spaces objects
     num_cities = len(self.city_names)
     self.num_cities = num_cities
-    self.action_space = spaces.Box(low=-1, high=1,shape=(num_cities*num_cities,),dtype=np.float16)
-    self.observation_space = spaces.Box(0, np.inf,shape=(4*num_cities,),dtype=np.float64)
+    self.action_mode = make_action_mode(action_mode, num_cities, rank, clusters)
+    self.action_space = spaces.Box(low=-1, high=1,shape=(self.action_mode.size,),dtype=np.float16)
+    obs_size = 4*num_cities*(self.action_repeat if stack_days else 1)
+    self.observation_space = spaces.Box(0, np.inf,shape=(obs_size,),dtype=np.float64)
 
     # random seed
     self.seed()
 
-    # initialize state
-    self.state  = np.empty(shape=(4*num_cities,))
+    # initialize state: (4, num_cities) buffer and the observation, a flat
+    # view of it. The native model works in a (num_cities, 4) buffer
+    self.state  = np.zeros((4, num_cities))
+    self._observation = self.state.reshape(4*num_cities)
+    self._states = np.empty((num_cities, 4))
+    self._mask  = np.empty(num_cities, dtype=bool)
+    self._reduction_factor = {} # buffers of the 'full' action mode, by dtype
+
+    # compartments after every model step of an env step, (k, 4, num_cities),
+    # and the native model's (k, num_cities, 4) counterpart. With stack_days
+    # the observation is a flat view of the trajectory.
+    k = self.action_repeat
+    self._trajectory = np.empty((k, 4, num_cities))
+    self._trajectory_states = np.empty((k, num_cities, 4))
+    if stack_days:
+      self._observation = self._trajectory.reshape(k*4*num_cities)
+
+    # step timers, None unless profiling
+    self._profiler = StepProfiler() if profile else None
 
   def seed(self, seed=None):
     self.np_random, seed = seeding.np_random(seed)
+    if self.stochastic:
+      # episode numbers count from the next reset
+      self.model.set_replicas(seed, self.replica)
+      self.model.episode[:] = -1
     return [seed]
 
   def step(self, action):
-    # Check for valid action
-    err_msg = "%r (%s) invalid" % (action, type(action))
-    assert self.action_space.contains(action), err_msg
+    profiler = self._profiler
+    if profiler is not None:
+      profiler.start()
 
-    # R <--> python conversions
-    numpy2ri.activate() # automatic conversion of numpy objects to rpy2 objects
+    # Check for valid action (the message is only formatted on failure)
+    assert self.action_space.contains(action), "%r (%s) invalid" % (action, type(action))
 
     # Update model based on actions
-    action = (action+1)/2
-    reduction_factor = np.reshape(action,(self.num_cities,self.num_cities))
+    if isinstance(self.action_mode, FullAction):
+      dtype = np.result_type(action, np.float16)
+      if dtype not in self._reduction_factor:
+        self._reduction_factor[dtype] = np.empty((self.num_cities, self.num_cities), dtype=dtype)
+      reduction_factor = self.action_mode.reduction_factor(action, out=self._reduction_factor[dtype])
+    else:
+      reduction_factor = self.action_mode.reduction_factor(action)
+    if self.backend == 'r' and isinstance(reduction_factor, FactoredReduction):
+      reduction_factor = reduction_factor.dense()
+    if profiler is not None:
+      profiler.lap('conversion')
+
+    # Plug in SEIR model, for action_repeat model steps (fewer near the end
+    # of the episode)
+    day = self.current
+    n_steps = max(1, min(self.action_repeat, -(-(62 - self.pred - day)//self.pred)))
+    trajectory = self._trajectory[:n_steps]
+    if self.backend == 'r':
+      for i in range(n_steps):
+        trajectory[i] = self._step_r(reduction_factor)
+        self.current += self.pred
+        self._data[:, self.current] = trajectory[i]
+        if (trajectory[i, 2] < 0.5).all():
+          break # episode over
+      n_steps = (self.current - day)//self.pred
+      trajectory = trajectory[:n_steps]
+    else:
+      np.copyto(self._states, self._data[:, self.current].T)
+      states = self.model.rollout(self._states, day, n_steps, self.pred, reduction_factor,
+                                  out=self._trajectory_states[:n_steps])
+      np.copyto(trajectory, np.swapaxes(states, 1, 2))
+      if n_steps > 1:
+        # stop at the first step without infections
+        over = (trajectory[:, 2] < 0.5).all(axis=1)
+        if over.any():
+          n_steps = int(np.argmax(over)) + 1
+          trajectory = trajectory[:n_steps]
+      self.current += n_steps*self.pred
+      self._data[:, day+self.pred:self.current+1:self.pred] = np.moveaxis(trajectory, 0, 1)
 
-    # Get model
-    cwd = os.getcwd()
-    with open('/Users/benbernhard/Documents/GitHub/COVID19_RL/COVID19_models/SEIR/seir_r.R', 'r') as f:
-        string = f.read()
-    seir_r = STAP(string, "seir_r")
-    seir_r=seir_r.seirPredictions
+    # Update state
+    self.state[:] = trajectory[-1]
+    I = self.state[2]
+    if profiler is not None:
+      profiler.lap('dynamics')
+
+    # Reward, summed over the model steps
+    if n_steps == 1:
+      np.greater(I, self.hospital_cap, out=self._mask)
+      healthCost = -1*I.sum() + -10*np.count_nonzero(self._mask)
+    else:
+      It = trajectory[:, 2]
+      healthCost = (-1*It.sum(axis=1) + -10*np.count_nonzero(It > self.hospital_cap, axis=1)).sum()
+    if self.backend == 'r':
+      economicCost = np.sum(-(10*(1-reduction_factor))**2)
+    else:
+      economicCost = self.model.economic_cost(reduction_factor, day)
+    if n_steps > 1:
+      # same cost every step (in float64, the cost of float16 actions is float16)
+      economicCost = n_steps*np.float64(economicCost)
+    reward = healthCost + economicCost
+    if profiler is not None:
+      profiler.lap('reward')
+
+    # Observation (a view of the state buffer, or of the trajectory)
+    observation = self._observation
+    if self.stack_days and n_steps < self.action_repeat:
+      self._trajectory[n_steps:] = self.state # the episode ended early
+
+    # Check if episode is over
+    np.less(I, 0.5, out=self._mask)
+    done = bool(
+        self._mask.all() or
+        self.current >= 62 - self.pred
+    )
+    if done:
+      # the last observation of an episode is a copy: VecEnvs keep it as
+      # info['terminal_observation'] and reset the env, which overwrites the
+      # state buffer
+      observation = observation.copy()
+    info = {'days': self.current - day}
+    if profiler is not None:
+      profiler.lap('observation')
+      info['profile'] = profiler.stop()
+    return observation, reward, done, info
+
+  def _step_r(self, reduction_factor):
+    from COVID19_env.r_models import activate_numpy2ri, package_function, to_r
+
+    # R <--> python conversions
+    activate_numpy2ri() # automatic conversion of numpy objects to rpy2 objects
+
+    # Get model (loaded once per process)
+    seir_r = package_function(SEIR_MODEL_DIR + 'seir_r.R', 'seirPredictions')
+
+    # Static inputs are converted to R objects once per environment
+    if self._r_inputs is None:
+      self._r_inputs = {name: to_r(getattr(self, name)) for name in R_STATIC_INPUTS}
 
     # Plug in SEIR model
+    if self._profiler is not None:
+      self._profiler.lap('conversion')
+    cwd = os.getcwd()
     modelOut = seir_r(reduction_factor,
-                      beta_data    = self.beta_data,
-                      beta_sd_data = self.beta_sd_data,
-                      latent       = self.latent,
-                      gamma        = self.gamma,
                       St_data      = self.St_data,
                       Et_data      = self.Et_data,
                       It_data      = self.It_data,
                       Rt_data      = self.Rt_data,
-                      ODs          = self.ODs,
-                      pops         = self.pops,
                       current      = self.current,
                       pred         = self.pred,
-                      city_names   = self.city_names)
+                      **self._r_inputs)
     os.chdir(cwd)
+    if self._profiler is not None:
+      self._profiler.lap('dynamics')
     # Unpack output
     S  = np.array(modelOut.rx2("S"))
     E  = np.array(modelOut.rx2("E"))
     I  = np.array(modelOut.rx2("I"))
     R  = np.array(modelOut.rx2("R"))
-
-    # Update state
-    self.state = np.matrix((S,E,I,R))
-    self.current += self.pred
-    self.St_data[self.current] = S
-    self.Et_data[self.current] = E
-    self.It_data[self.current] = I
-    self.Rt_data[self.current] = R
-
-    # Reward
-    overflowI    = I - self.hospital_cap
-    healthCost   = -1*sum(I) + -10*sum(overflowI>0)
-    economicCost = np.sum(-(10*(1-action))**2)
-    reward = healthCost + economicCost
-
-    # Observation
-    observation = np.reshape(self.state,(4*self.num_cities,))
-
-    # Check if episode is over
-    done = bool(
-        all(I < 0.5) or
-        self.current >= 62 - self.pred
-    )
-    return observation, reward, done, {}
+    if self._profiler is not None:
+      self._profiler.lap('conversion')
+    return S, E, I, R
+
+  def profile_stats(self):
+    """
+    :return: (dict) step timers since the last reset_profile_stats (see
+      StepProfiler.stats), None if the env was created without profile=True
+    """
+    if self._profiler is None:
+      return None
+    return self._profiler.stats()
+
+  def reset_profile_stats(self):
+    if self._profiler is not None:
+      self._profiler.reset()
+
+  def _restore_episode_rows(self):
+    # undo the writes to the compartment data since the last reset
+    self._data[:, self.current0:self.current+1] = self._data0[:, self.current0:self.current+1]
+
+  def get_state(self):
+    """
+    Snapshot of the episode, for branching rollouts (restore it with
+    set_state, here or in any SEIR_env / SEIR_vec_env replica)
+
+    :return: (dict) picklable snapshot: day index, compartments (4,
+      num_cities), the compartment rows written earlier in the episode and
+      the RNG state
+    """
+    state = {'current': self.current,
+             'state': self.state.copy(),
+             'history': self._data[:, self.current0+1:self.current].copy(),
+             'rng': rng_state(self.np_random)}
+    if self.stochastic:
+      state['episode'] = int(self.model.episode[0])
+    return state
+
+  def set_state(self, state):
+    """
+    Continue from a snapshot returned by get_state (or SEIR_vec_env.get_states,
+    which carries no history: the earlier rows are then the input data)
+
+    :param state: (dict) snapshot
+    :return: (np.ndarray) observation of the restored state (a view, see step)
+    """
+    self._restore_episode_rows()
+    self.current = int(state['current'])
+    if state.get('history') is not None:
+      self._data[:, self.current0+1:self.current] = state['history']
+    self._data[:, self.current] = state['state']
+    self.state[:] = state['state']
+    self._trajectory[:] = self.state
+    if 'rng' in state:
+      set_rng_state(self.np_random, state['rng'])
+    if self.stochastic and 'episode' in state:
+      self.model.episode[:] = state['episode']
+    return self._observation
 
   def reset(self):
 
-    # reset to initial conditions
+    # reset to initial conditions, restoring the rows written by the episode
+    self._restore_episode_rows()
     self.current = self.current0
-    self.St_data = self.St_data0
-    self.Et_data = self.Et_data0
-    self.It_data = self.It_data0
-    self.Rt_data = self.Rt_data0
-
-    self.state = np.matrix((self.St_data[self.current],
-                            self.Et_data[self.current],
-                            self.It_data[self.current],
-                            self.Rt_data[self.current]),dtype=np.float64)
-    observation = np.reshape(self.state,(4*self.num_cities,))
+    if self.stochastic:
+      self.model.episode += 1
+
+    self.state[:] = self._data[:, self.current]
+    self._trajectory[:] = self.state
+    observation = self._observation
 
     return observation  # reward, done, info can't be included
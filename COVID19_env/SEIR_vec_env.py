@@ -0,0 +1,246 @@
+"""
+vectorized version of SEIR_env
+
+Follows the Stable Baselines VecEnv interface:
+    https://stable-baselines.readthedocs.io/en/master/guide/vec_envs.html
+"""
+import sys
+sys.path.append("..")
+
+from gym import spaces
+from gym.utils import seeding
+
+import numpy as np
+
+from stable_baselines.common.vec_env import VecEnv
+
+from COVID19_env.seir_model import SEIRModel, I
+from COVID19_env.stochastic_seir import StochasticSEIRModel
+from COVID19_env.action_modes import make_action_mode
+from COVID19_env.seir_inputs import load_inputs
+
+class SEIR_vec_env(VecEnv):
+  """
+  Description:
+        num_envs replicas of SEIR_env advanced together in one process by the
+        native SEIR model (seir_model.py). The replicas are held in a single
+        (num_envs, num_cities, 4) array and one call to step advances all of
+        them.
+
+        Observations, actions, rewards and the episode termination rule are
+        the same as in SEIR_env, with a leading batch dimension:
+            observations    (num_envs, 4*num_cities)
+            actions         (num_envs, num_cities*num_cities) in [-1, 1], or
+                            (num_envs, num_cities, num_cities); with other
+                            action modes (num_envs, action_mode.size)
+            rewards, dones  (num_envs,)
+        Replicas whose episode is over are reset automatically, and the last
+        observation of the episode is returned in info['terminal_observation']
+        (same as DummyVecEnv).
+
+        The replicas are stepped in place and the observations returned by
+        step and reset are a view of a buffer that is overwritten by the next
+        call (copy them to keep them).
+
+        With stochastic=True the replicas follow the chain binomial model of
+        stochastic_seir.py, replica i drawing from the stream of replica
+        replica_offset + i: a run split between several SEIR_vec_env (or
+        SEIR_env) with consecutive offsets gives the same episodes whatever
+        the number of workers.
+  """
+
+  def __init__(self, num_envs, hospitalCapacity, input_data, action_mode='full',
+               rank=1, clusters=None, stochastic=False, replica_offset=0):
+    """
+    :param num_envs: (int) number of replicas
+    :param hospitalCapacity: (float or np.ndarray) maximum number of people in
+      the ICU, per replica
+    :param input_data: (dict or str) SEIR model inputs keyed by
+      SEIR_env.INPUT_NAMES, or the path of a snapshot written by
+      seir_inputs.export_inputs
+    :param action_mode: (str) action parameterization, see action_modes.py
+    :param rank: (int) number of factors of the 'rank' action mode
+    :param clusters: (np.ndarray) region of each city, for the 'cluster'
+      action mode
+    :param stochastic: (bool) random dynamics, see above
+    :param replica_offset: (int) replica index of the first replica
+    """
+    if isinstance(input_data, str):
+      input_data = load_inputs(input_data)
+    self.stochastic = stochastic
+    self.replica_offset = replica_offset
+    model = StochasticSEIRModel if stochastic else SEIRModel
+    self.model = model.from_input_data(input_data)
+    num_cities = self.model.num_cities
+    self.num_cities = num_cities
+    self.hospital_cap = np.broadcast_to(np.asarray(hospitalCapacity, dtype=np.float64), (num_envs,))
+
+    # Initial conditions, shared by all replicas
+    self.current0 = int(np.ravel(input_data["current"])[0])
+    self.pred     = int(np.ravel(input_data["pred"])[0])
+    self.state0   = np.stack([np.array(input_data[name])[self.current0]
+                              for name in ("St_data", "Et_data", "It_data", "Rt_data")],
+                             axis=-1)
+
+    # Define action and observation space
+    self.action_mode = make_action_mode(action_mode, num_cities, rank, clusters)
+    action_space = spaces.Box(low=-1, high=1,shape=(self.action_mode.size,),dtype=np.float16)
+    observation_space = spaces.Box(0, np.inf,shape=(4*num_cities,),dtype=np.float64)
+    VecEnv.__init__(self, num_envs, observation_space, action_space)
+
+    # random seed
+    self.seed()
+
+    # initialize state (stepped in place) and the observation buffer
+    self.state   = np.empty((num_envs, num_cities, 4))
+    self.current = np.empty(num_envs, dtype=np.int64)
+    self._day    = np.empty(num_envs, dtype=np.int64)
+    self._observations = np.empty((num_envs, 4*num_cities))
+    self._reset_envs(slice(None))
+    self.actions = None
+
+  def seed(self, seed=None):
+    self.np_random, seed = seeding.np_random(seed)
+    if self.stochastic:
+      # episode numbers count from the next reset, as in SEIR_env
+      self.model.set_replicas(seed, self.replica_offset + np.arange(self.num_envs))
+      self.model.episode[:] = -1
+    return [seed]
+
+  def _observe(self, states, out=None):
+    # (num_envs, num_cities, 4) -> (num_envs, 4*num_cities), as in SEIR_env
+    if out is None:
+      return np.swapaxes(states, 1, 2).reshape(len(states), 4*self.num_cities)
+    np.copyto(out.reshape(len(states), 4, self.num_cities), np.swapaxes(states, 1, 2))
+    return out
+
+  def step_async(self, actions):
+    self.actions = np.asarray(actions).reshape(self.num_envs, self.action_mode.size)
+
+  def step_wait(self):
+    # Update model based on actions
+    reduction_factor = self.action_mode.reduction_factor(self.actions)
+
+    # Plug in SEIR model
+    day = self._day
+    np.copyto(day, self.current)
+    self.model.predict(self.state, self.current, self.pred, reduction_factor, out=self.state)
+    self.current += self.pred
+    It = self.state[:, :, I]
+
+    # Reward
+    healthCost   = -1*It.sum(axis=1) + -10*(It > self.hospital_cap[:, None]).sum(axis=1)
+    economicCost = self.model.economic_cost(reduction_factor, day)
+    rewards = healthCost + economicCost
+
+    # Check which episodes are over
+    dones = (It < 0.5).all(axis=1) | (self.current >= 62 - self.pred)
+
+    # Observation, with finished replicas reset to their initial conditions
+    observations = self._observe(self.state, out=self._observations)
+    infos = [{} for _ in range(self.num_envs)]
+    for i in np.flatnonzero(dones):
+      infos[i]['terminal_observation'] = observations[i].copy()
+    self._reset_envs(dones)
+    if self.stochastic:
+      self.model.episode[dones] += 1
+    observations[dones] = self._observe(self.state[dones])
+
+    return observations, rewards, dones, infos
+
+  def _reset_envs(self, mask):
+    self.state[mask] = self.state0
+    self.current[mask] = self.current0
+
+  def reset(self):
+    self._reset_envs(slice(None))
+    if self.stochastic:
+      self.model.episode += 1
+    return self._observe(self.state, out=self._observations)
+
+  def get_states(self, indices=None):
+    """
+    Snapshots of replicas, same format as SEIR_env.get_state without the
+    history and RNG state (the generator is shared by all replicas)
+
+    :param indices: (None, int, Iterable) replicas, all by default
+    :return: (list) one snapshot dict per replica
+    """
+    states = [{'current': int(self.current[i]), 'state': self.state[i].T.copy(), 'history': None}
+              for i in self._get_indices(indices)]
+    if self.stochastic:
+      for i, state in zip(self._get_indices(indices), states):
+        state['episode'] = int(self.model.episode[i])
+    return states
+
+  def set_states(self, states, indices=None):
+    """
+    Restore snapshots into replicas in one vectorized assignment, e.g. to
+    branch one state of SEIR_env into all replicas
+
+    :param states: (dict or list) one snapshot for all the replicas, or one per
+      replica (from SEIR_env.get_state or get_states)
+    :param indices: (None, int, Iterable) replicas, all by default
+    :return: (np.ndarray) observations of the restored replicas
+    """
+    indices = list(self._get_indices(indices))
+    if isinstance(states, dict):
+      states = [states]*len(indices)
+    self.state[indices] = np.swapaxes(np.array([s['state'] for s in states], dtype=np.float64), 1, 2)
+    self.current[indices] = [s['current'] for s in states]
+    if self.stochastic:
+      for i, state in zip(indices, states):
+        if 'episode' in state:
+          self.model.episode[i] = state['episode']
+    return self._observe(self.state[indices])
+
+  def close(self):
+    pass
+
+  def get_attr(self, attr_name, indices=None):
+    value = getattr(self, attr_name)
+    indices = self._get_indices(indices)
+    if isinstance(value, np.ndarray) and value.shape[:1] == (self.num_envs,):
+      return [value[i] for i in indices]
+    return [value for _ in indices]
+
+  def set_attr(self, attr_name, value, indices=None):
+    current = getattr(self, attr_name)
+    if isinstance(current, np.ndarray) and current.shape[:1] == (self.num_envs,):
+      current = current.copy()
+      current[self._get_indices(indices)] = value
+      value = current
+    setattr(self, attr_name, value)
+
+  def profile_stats(self):
+    """
+    The batched env has no step timers (only the single env does, see
+    step_profiler.py), so ProfilingCallback logs nothing for it
+
+    :return: None
+    """
+    return None
+
+  def reset_profile_stats(self):
+    pass
+
+  def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+    """
+    Call a method of the batched env. There are no per-replica env objects:
+    the method is called once, on the whole batch, so indices must select
+    every replica (a subset of the replicas raises ValueError).
+
+    :param method_name: (str) name of a method of SEIR_vec_env
+    :param indices: (None, int, Iterable) replicas, all by default
+    :return: (list) the result, once per index
+    """
+    method = getattr(type(self), method_name, None)
+    if not callable(method):
+      raise AttributeError("SEIR_vec_env has no method %r (env_method calls methods of the "
+                           "batched env, not of single env replicas)" % method_name)
+    indices = list(self._get_indices(indices))
+    if sorted(indices) != list(range(self.num_envs)):
+      raise ValueError("SEIR_vec_env.env_method calls %r once on the whole batch, indices must "
+                       "select all %d replicas, got %s" % (method_name, self.num_envs, indices))
+    result = getattr(self, method_name)(*method_args, **method_kwargs)
+    return [result for _ in indices]
@@ -0,0 +1,144 @@
+"""
+action parameterizations of the SEIR environments
+
+The SEIR model takes a reduction factor for every OD pair, i.e. num_cities**2
+numbers per step. An action mode maps a smaller action vector in [-1, 1] to
+those reduction factors, so the size of the policy output does not have to
+grow with the square of the number of cities:
+
+    'full'      one action per OD pair (num_cities**2 actions, default)
+    'origin'    one restriction per origin city (num_cities actions),
+                rf[i, j] = a[i]
+    'rank'      rank-k origin and destination factors (2*k*num_cities
+                actions), rf[i, j] = mean_k(u[i, k] * v[j, k])
+    'cluster'   one restriction per pair of regions (num_clusters**2 actions),
+                rf[i, j] = b[cluster[i], cluster[j]]
+
+Every action is mapped from [-1, 1] to [0, 1] first, so the reduction factors
+of all modes are in [0, 1]. Except for 'full', the reduction factors are
+returned as a seir_model.FactoredReduction, which the model expands with an
+outer product (or only on the nonzero flows of a sparse OD).
+"""
+import sys
+sys.path.append("..")
+
+import numpy as np
+
+from COVID19_env.seir_model import FactoredReduction
+
+ACTION_MODES = ('full', 'origin', 'rank', 'cluster')
+
+
+def make_action_mode(mode, num_cities, rank=1, clusters=None):
+  """
+  :param mode: (str) one of ACTION_MODES
+  :param num_cities: (int) number of cities
+  :param rank: (int) number of factors of the 'rank' mode
+  :param clusters: (np.ndarray) region (0 to num_clusters-1) of each city, for
+    the 'cluster' mode
+  :return: action mode object
+  """
+  if mode == 'full':
+    return FullAction(num_cities)
+  if mode == 'origin':
+    return OriginAction(num_cities)
+  if mode == 'rank':
+    return RankAction(num_cities, rank)
+  if mode == 'cluster':
+    if clusters is None:
+      raise ValueError("the 'cluster' action mode needs the cluster of each city")
+    return ClusterAction(clusters)
+  raise ValueError("action_mode must be one of %s, got %r" % (ACTION_MODES, mode))
+
+
+class FullAction(object):
+  """
+  One action per OD pair, (num_cities*num_cities,)
+  """
+
+  def __init__(self, num_cities):
+    self.num_cities = num_cities
+    self.size = num_cities*num_cities
+
+  def reduction_factor(self, action, out=None):
+    """
+    :param action: (np.ndarray) actions in [-1, 1], shape (..., size)
+    :param out: (np.ndarray) optional output array, shape
+      (..., num_cities, num_cities) and the dtype of action
+    :return: (np.ndarray) reduction factors, shape (..., num_cities, num_cities)
+    """
+    if out is None:
+      action = (action+1)/2
+      return np.reshape(action, action.shape[:-1] + (self.num_cities, self.num_cities))
+    action = np.reshape(action, out.shape)
+    np.add(action, 1, out=out)
+    return np.divide(out, 2, out=out)
+
+
+class OriginAction(object):
+  """
+  One restriction per origin city, applied to all of its outgoing flows
+  """
+
+  def __init__(self, num_cities):
+    self.num_cities = num_cities
+    self.size = num_cities
+    self._ones = np.ones((num_cities, 1))
+
+  def reduction_factor(self, action):
+    """
+    :param action: (np.ndarray) actions in [-1, 1], shape (..., num_cities)
+    :return: (FactoredReduction) rank 1 reduction factors
+    """
+    U = ((np.asarray(action, dtype=np.float64)+1)/2)[..., None]
+    return FactoredReduction(U, self._ones)
+
+
+class RankAction(object):
+  """
+  Rank-k origin x destination factors. The first k*num_cities actions are the
+  origin factors u, the last k*num_cities the destination factors v, both
+  ordered city by city.
+  """
+
+  def __init__(self, num_cities, rank=1):
+    if rank < 1:
+      raise ValueError("rank must be at least 1, got %r" % rank)
+    self.num_cities = num_cities
+    self.rank = rank
+    self.size = 2*rank*num_cities
+
+  def reduction_factor(self, action):
+    """
+    :param action: (np.ndarray) actions in [-1, 1], shape (..., 2*rank*num_cities)
+    :return: (FactoredReduction) rank k reduction factors
+    """
+    factors = (np.asarray(action, dtype=np.float64)+1)/2
+    factors = factors.reshape(factors.shape[:-1] + (2, self.num_cities, self.rank))
+    # the mean over the k factors keeps the reduction factors in [0, 1]
+    return FactoredReduction(factors[..., 0, :, :] / self.rank, factors[..., 1, :, :])
+
+
+class ClusterAction(object):
+  """
+  One restriction per (origin region, destination region) pair, the same for
+  every OD pair between the two regions
+  """
+
+  def __init__(self, clusters):
+    self.clusters = np.asarray(clusters, dtype=np.int64)
+    self.num_cities = len(self.clusters)
+    self.num_clusters = int(self.clusters.max()) + 1
+    self.size = self.num_clusters*self.num_clusters
+    # membership of each city, (num_cities, num_clusters)
+    self._members = np.eye(self.num_clusters)[self.clusters]
+
+  def reduction_factor(self, action):
+    """
+    :param action: (np.ndarray) actions in [-1, 1], shape (..., num_clusters**2)
+    :return: (FactoredReduction) block reduction factors
+    """
+    blocks = (np.asarray(action, dtype=np.float64)+1)/2
+    blocks = blocks.reshape(blocks.shape[:-1] + (self.num_clusters, self.num_clusters))
+    # rf = (members @ blocks) @ members.T
+    return FactoredReduction(blocks[..., self.clusters, :], self._members)
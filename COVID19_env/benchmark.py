@@ -0,0 +1,462 @@
+"""
+performance benchmarks of the environments and the SEIR model code
+
+Measures steps per second, the p50 / p99 latency of a call and the peak
+resident memory of:
+    sir      simple_SIR_env with every backend ('native', 'rk4', 'r') and
+             simple_SIR_vec_env (the batched backend) at batch sizes 1 to 4096
+    seir     SEIR_env ('native', 'r') and SEIR_vec_env from 14 cities up to
+             a synthetic county scale OD set (3142 cities, sparse ODs)
+    filter   one day of the particle filter in SEIR_estimation.py
+    trips    parsing and loading (cached) the trip data with SEIR_data.py,
+             and opening an input snapshot (seir_inputs.py)
+
+Every case runs in a fresh process, so its peak memory is its own. The peak
+of the setup (building the env and its inputs) is peak_rss_setup_mb; on Linux
+the peak is then reset (/proc/self/clear_refs) and the peak during the timed
+calls is peak_rss_mb (VmHWM of /proc/self/status). Where the peak cannot be
+reset peak_rss_mb is None and only peak_rss_process_mb, the peak of the
+whole process, is recorded. A call is one env step (a batch of steps for
+the vectorized envs), one particle filter day or one load; finished episodes
+are reset as part of the call, as the vectorized envs do. Cases whose backend
+is not available (R, Stable Baselines) are recorded with status 'error'
+instead of failing the run.
+
+The results are written as JSON lines, a 'machine' record followed by one
+'case' record per case, and can be compared against an earlier run:
+    $ cd COVID19_env
+    $ python benchmark.py --out baseline.jsonl
+    $ python benchmark.py --suite seir --out new.jsonl --compare baseline.jsonl
+The comparison exits with status 1 if a case got slower or needs more memory
+than the baseline by more than --tolerance.
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+SUITES = ('sir', 'seir', 'filter', 'trips')
+
+# batch sizes of the vectorized envs
+BATCH_SIZES = (1, 16, 256, 4096)
+
+# number of US counties, the scale of the synthetic sparse OD set
+COUNTY_CITIES = 3142
+
+# (num_cities, batch sizes) of SEIR_vec_env. At county scale the per-edge
+# temporaries of a 4096 batch alone would take several GB
+SEIR_VEC_GRID = ((14, BATCH_SIZES), (COUNTY_CITIES, (1, 16, 256)))
+
+
+def synthetic_inputs(num_cities, sparse=False, degree=30, num_days=70, od_days=62,
+                     current=1, seed=0):
+  """
+  Random SEIR_env inputs of any size (in place of read_input.R)
+
+  :param num_cities: (int) number of cities
+  :param sparse: (bool) ODs as a seir_model.SparseOD, with `degree`
+    destinations per city, instead of a dense array
+  :param degree: (int) destinations per city of the sparse ODs
+  :param num_days: (int) number of rows of the compartment data
+  :param od_days: (int) number of days of OD data
+  :param current: (int) first day of the episodes
+  :param seed: (int) seed of the random number generator
+  :return: (dict) SEIR model inputs keyed by SEIR_env.INPUT_NAMES
+  """
+  from COVID19_env.seir_model import SparseOD
+
+  rng = np.random.default_rng(seed)
+  pops = np.round(rng.lognormal(np.log(2e5), 1.2, num_cities)) + 1000
+  if sparse:
+    degree = min(degree, num_cities - 1)
+    offsets = rng.choice(np.arange(1, num_cities), degree, replace=False)
+    origin = np.tile(np.repeat(np.arange(num_cities), degree), od_days)
+    dest = (origin + np.tile(offsets, num_cities*od_days)) % num_cities
+    day = np.repeat(np.arange(od_days), num_cities*degree)
+    passengers = rng.gamma(2., pops[origin]*5e-4/degree)
+    ODs = SparseOD.from_edges(day, origin, dest, passengers, od_days, num_cities)
+  else:
+    ODs = rng.gamma(2., pops[None, :, None]*5e-4/num_cities, (od_days, num_cities, num_cities))
+    ODs[:, np.arange(num_cities), np.arange(num_cities)] = 0
+
+  data = {name: np.zeros((num_days, num_cities)) for name in ("St_data", "Et_data", "It_data", "Rt_data")}
+  data["Et_data"][current] = rng.uniform(0, 50, num_cities)
+  data["It_data"][current] = rng.uniform(0, 20, num_cities)
+  data["St_data"][current] = pops - data["Et_data"][current] - data["It_data"][current]
+  data.update(beta_data    = rng.uniform(0.1, 0.3, num_cities),
+              beta_sd_data = np.full(num_cities, 0.01),
+              latent       = np.array([5.1]),
+              gamma        = np.array([0.06]),
+              ODs          = ODs,
+              pops         = pops,
+              current      = np.array([current]),
+              pred         = np.array([1]),
+              city_names   = np.array(["city%d" % i for i in range(num_cities)]))
+  return data
+
+
+def _peak_rss_mb():
+  # peak of the whole process (ru_maxrss is never reset); in kB on Linux and
+  # in bytes on macOS
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak / (1024.**2 if sys.platform == 'darwin' else 1024.)
+
+
+def _reset_peak_rss():
+  # Linux: reset VmHWM to the current resident memory, so the peak of the
+  # timed calls is measured without the setup
+  try:
+    with open('/proc/self/clear_refs', 'w') as f:
+      f.write('5')
+    return True
+  except OSError:
+    return False
+
+
+def _hwm_rss_mb():
+  # Linux: peak resident memory since the last _reset_peak_rss (VmHWM)
+  try:
+    with open('/proc/self/status') as f:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1]) / 1024.
+  except (OSError, ValueError):
+    pass
+  return None
+
+
+def _current_rss_mb():
+  try:
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024.**2
+  except (OSError, ValueError):
+    return None
+
+
+def _time_calls(call, seconds, min_calls):
+  # one warm-up call (buffers are allocated on the first step), then time
+  # calls until `seconds` have passed and at least min_calls were made (or
+  # 10*seconds have passed, for very slow cases)
+  call()
+  latencies = []
+  start = time.perf_counter()
+  while True:
+    t = time.perf_counter()
+    call()
+    now = time.perf_counter()
+    latencies.append(now - t)
+    if now - start >= seconds and (len(latencies) >= min_calls or now - start >= 10*seconds):
+      return np.array(latencies), now - start
+
+
+# temporary directories of the running case, removed by run_case
+_TEMP_DIRS = []
+
+
+def _temp_dir():
+  path = tempfile.mkdtemp()
+  _TEMP_DIRS.append(path)
+  return path
+
+
+# Cases: each returns (call, steps per call) after its setup
+
+
+def _sir_env(backend):
+  from COVID19_env.simple_SIR_env import simple_SIR_env
+  env = simple_SIR_env(999, 1, 0, 300, backend=backend)
+  env.reset()
+
+  def call():
+    _, _, done, _ = env.step(0)
+    if done:
+      env.reset()
+  return call, 1
+
+
+def _sir_vec(backend, batch):
+  from COVID19_env.simple_SIR_vec_env import simple_SIR_vec_env
+  env = simple_SIR_vec_env(batch, 999, 1, 0, 300, backend=backend)
+  env.reset()
+  actions = np.zeros(batch, dtype=np.int64)
+  return lambda: env.step(actions), batch
+
+
+def _seir_inputs(cities):
+  # dense ODs up to a few hundred cities, sparse at county scale
+  sparse = cities > 1000
+  return synthetic_inputs(cities, sparse=sparse), ('origin' if sparse else 'full')
+
+
+def _seir_env(backend, cities):
+  from COVID19_env.SEIR_env import SEIR_env
+  input_data, action_mode = _seir_inputs(cities)
+  env = SEIR_env(1000., backend=backend, input_data=input_data, action_mode=action_mode)
+  env.reset()
+  action = np.ones(env.action_space.shape, dtype=env.action_space.dtype)
+
+  def call():
+    _, _, done, _ = env.step(action)
+    if done:
+      env.reset()
+  return call, 1
+
+
+def _seir_vec(cities, batch):
+  from COVID19_env.SEIR_vec_env import SEIR_vec_env
+  input_data, action_mode = _seir_inputs(cities)
+  env = SEIR_vec_env(batch, 1000., input_data, action_mode=action_mode)
+  env.reset()
+  actions = np.ones((batch,) + env.action_space.shape, dtype=env.action_space.dtype)
+  return lambda: env.step(actions), batch
+
+
+def _filter_day(particles):
+  from COVID19_models.SEIR_data import load_population, load_cases, load_trip_data
+  from COVID19_models.SEIR_estimation import (initial_particles, filter_day,
+                                              start_date, end_date)
+  rng = np.random.default_rng(3)
+  city_names, pop_data = load_population()
+  case_data = load_cases(city_names)
+  trips = load_trip_data(city_names)
+  filter_state = {'day': start_date}
+
+  def start():
+    p, s = initial_particles(rng, particles, pop_data)
+    filter_state.update(particles=p, states=s, day=start_date,
+                        log_w=np.full_like(p, -np.log(particles)))
+  start()
+
+  def call():
+    day = filter_state['day']
+    if day > end_date:
+      start()
+      day = start_date
+    p, s, w = filter_day(rng, filter_state['particles'], filter_state['states'],
+                         filter_state['log_w'], trips[day-1], case_data[day-1], pop_data)
+    filter_state.update(particles=p, states=s, log_w=w, day=day+1)
+  return call, 1
+
+
+def _trips(cached):
+  from COVID19_models.SEIR_data import load_population, load_trip_data
+  city_names, _ = load_population()
+  cache_dir = _temp_dir()
+  if cached:
+    load_trip_data(city_names, cache_dir=cache_dir)
+    return lambda: load_trip_data(city_names, cache_dir=cache_dir), 1
+
+  def call():
+    # an empty cache directory every time, so the csv files are parsed
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    load_trip_data(city_names, cache_dir=cache_dir)
+  return call, 1
+
+
+def _snapshot(cities):
+  from COVID19_env.seir_inputs import export_inputs, load_inputs
+  input_data, _ = _seir_inputs(cities)
+  path = os.path.join(_temp_dir(), 'SEIR_inputs.bin')
+  export_inputs(path, input_data)
+  del input_data
+  return lambda: load_inputs(path), 1
+
+
+def cases(suites=SUITES, quick=False):
+  """
+  :param suites: (list) suites to run, see SUITES
+  :param quick: (bool) only the smallest and a medium size of every grid
+  :return: (list) (suite, case id, function name, parameters) of every case
+  """
+  batch_sizes = (1, 256) if quick else BATCH_SIZES
+  seir_cities = (14, 200) if quick else (14, 200, COUNTY_CITIES)
+  result = []
+
+  def add(suite, name, function, **params):
+    if suite in suites:
+      case_id = name + '[%s]' % ','.join('%s=%s' % item for item in sorted(params.items()))
+      result.append((suite, case_id, function, params))
+
+  for backend in ('native', 'rk4', 'r'):
+    add('sir', 'sir_env', '_sir_env', backend=backend)
+  for backend in ('native', 'rk4'):
+    for batch in batch_sizes:
+      add('sir', 'sir_vec', '_sir_vec', backend=backend, batch=batch)
+  for cities in seir_cities:
+    add('seir', 'seir_env', '_seir_env', backend='native', cities=cities)
+  add('seir', 'seir_env', '_seir_env', backend='r', cities=14)
+  for cities, batches in SEIR_VEC_GRID:
+    if cities in seir_cities:
+      for batch in batches:
+        if batch in batch_sizes:
+          add('seir', 'seir_vec', '_seir_vec', cities=cities, batch=batch)
+  for particles in ((1000,) if quick else (1000, 50000)):
+    add('filter', 'filter_day', '_filter_day', particles=particles)
+  add('trips', 'trips_load', '_trips', cached=False)
+  add('trips', 'trips_load', '_trips', cached=True)
+  add('trips', 'snapshot_load', '_snapshot', cities=seir_cities[-1])
+  return result
+
+
+def run_case(case, seconds=2., min_calls=20):
+  """
+  Run one case (call it in a fresh process to measure its peak memory)
+
+  :param case: (tuple) one of cases()
+  :param seconds: (float) minimum timed duration
+  :param min_calls: (int) minimum number of timed calls
+  :return: (dict) 'case' record
+  """
+  suite, case_id, function, params = case
+  record = {'record': 'case', 'suite': suite, 'id': case_id, 'params': params}
+  try:
+    start = time.perf_counter()
+    call, steps = globals()[function](**params)
+    record['setup_s'] = time.perf_counter() - start
+    record['rss_setup_mb'] = _current_rss_mb()
+    record['peak_rss_setup_mb'] = _peak_rss_mb()
+    record['peak_rss_reset'] = _reset_peak_rss()
+    latencies, elapsed = _time_calls(call, seconds, min_calls)
+  except Exception as e:
+    record.update(status='error', error='%s: %s' % (type(e).__name__, e))
+    return record
+  finally:
+    while _TEMP_DIRS:
+      shutil.rmtree(_TEMP_DIRS.pop(), ignore_errors=True)
+  p50, p99 = np.percentile(latencies, (50, 99))
+  record.update(status='ok',
+                calls=len(latencies),
+                steps=steps*len(latencies),
+                steps_per_sec=steps*len(latencies)/elapsed,
+                latency_p50_ms=1e3*p50,
+                latency_p99_ms=1e3*p99,
+                latency_mean_ms=1e3*latencies.mean(),
+                peak_rss_mb=_hwm_rss_mb() if record['peak_rss_reset'] else None,
+                peak_rss_process_mb=_peak_rss_mb())
+  return record
+
+
+def _run_case(args):
+  return run_case(*args)
+
+
+def machine_record():
+  """
+  :return: (dict) 'machine' record: host, versions and git commit
+  """
+  try:
+    commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                     cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    commit = None
+  return {'record': 'machine', 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+          'host': platform.node(), 'platform': platform.platform(),
+          'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+          'python': platform.python_version(), 'numpy': np.__version__, 'commit': commit}
+
+
+def run(suites=SUITES, out='benchmark.jsonl', quick=False, seconds=2., min_calls=20,
+        match=None):
+  """
+  Run the benchmarks, every case in its own process
+
+  :param suites: (list) suites to run, see SUITES
+  :param out: (str) JSON lines output file
+  :param quick: (bool) see cases
+  :param seconds: (float) minimum timed duration of a case
+  :param min_calls: (int) minimum number of timed calls of a case
+  :param match: (str) only run the cases whose id contains this string
+  :return: (list) the records written
+  """
+  selected = [case for case in cases(suites, quick) if match is None or match in case[1]]
+  records = [machine_record()]
+  # spawn: every case starts from a clean interpreter
+  with open(out, 'w') as f, \
+       multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+    f.write(json.dumps(records[0]) + '\n')
+    for record in pool.imap(_run_case, [(case, seconds, min_calls) for case in selected]):
+      f.write(json.dumps(record) + '\n')
+      f.flush()
+      records.append(record)
+      print(format_record(record))
+  return records
+
+
+def format_record(record):
+  """
+  :param record: (dict) 'case' record
+  :return: (str) one line summary
+  """
+  if record['status'] != 'ok':
+    return "%-45s %s" % (record['id'], record['error'])
+  peak = record.get('peak_rss_mb')
+  return ("%-45s %12.1f steps/s  p50 %9.3f ms  p99 %9.3f ms  peak %s MB"
+          % (record['id'], record['steps_per_sec'], record['latency_p50_ms'],
+             record['latency_p99_ms'], 'n/a' if peak is None else '%8.1f' % peak))
+
+
+def load_records(path):
+  """
+  :param path: (str) JSON lines file written by run
+  :return: (dict) 'case' records keyed by case id
+  """
+  with open(path) as f:
+    records = [json.loads(line) for line in f if line.strip()]
+  return {r['id']: r for r in records if r['record'] == 'case'}
+
+
+def compare(baseline, records, tolerance=0.1):
+  """
+  :param baseline: (dict) 'case' records of the baseline, keyed by case id
+  :param records: (dict) 'case' records of the new run, keyed by case id
+  :param tolerance: (float) allowed relative loss of steps/s and growth of
+    peak memory of the timed calls (not compared if either run could not
+    measure it)
+  :return: (list) (case id, metric, baseline value, new value) of every regression
+  """
+  regressions = []
+  for case_id, new in sorted(records.items()):
+    old = baseline.get(case_id)
+    if old is None or old['status'] != 'ok' or new['status'] != 'ok':
+      continue
+    if new['steps_per_sec'] < (1 - tolerance)*old['steps_per_sec']:
+      regressions.append((case_id, 'steps_per_sec', old['steps_per_sec'], new['steps_per_sec']))
+    if old.get('peak_rss_mb') is None or new.get('peak_rss_mb') is None:
+      continue
+    if new['peak_rss_mb'] > (1 + tolerance)*old['peak_rss_mb']:
+      regressions.append((case_id, 'peak_rss_mb', old['peak_rss_mb'], new['peak_rss_mb']))
+  return regressions
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="benchmarks of the COVID19 envs and models")
+  parser.add_argument('--suite', action='append', choices=SUITES,
+                      help="suite to run (repeatable), default: all")
+  parser.add_argument('--out', default='benchmark.jsonl', help="JSON lines output file")
+  parser.add_argument('--quick', action='store_true', help="smaller grids")
+  parser.add_argument('--seconds', type=float, default=2., help="minimum timed duration per case")
+  parser.add_argument('--min-calls', type=int, default=20, help="minimum timed calls per case")
+  parser.add_argument('--match', default=None, help="only cases whose id contains this string")
+  parser.add_argument('--compare', default=None, help="baseline JSON lines file")
+  parser.add_argument('--tolerance', type=float, default=0.1,
+                      help="allowed relative regression against the baseline")
+  args = parser.parse_args()
+
+  records = run(args.suite or SUITES, args.out, args.quick, args.seconds, args.min_calls, args.match)
+  if args.compare is not None:
+    new = {r['id']: r for r in records if r['record'] == 'case'}
+    regressions = compare(load_records(args.compare), new, args.tolerance)
+    for case_id, metric, old, value in regressions:
+      print("REGRESSION %s %s: %.1f -> %.1f" % (case_id, metric, old, value))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,52 @@
+"""
+checks that SEIR_env under a Stable Baselines DummyVecEnv keeps the last
+observation of every episode in info['terminal_observation'] (step returns
+views of the state buffer, which the automatic reset overwrites)
+    $ cd COVID19_env
+    $ python check_seir_env.py
+"""
+import sys
+sys.path.append("..")
+
+import numpy as np
+
+from stable_baselines.common.vec_env import DummyVecEnv
+
+from COVID19_env.SEIR_env import SEIR_env
+from COVID19_env.check_seir_model import small_inputs
+
+
+def check_terminal_observation(action_repeat=1, stack_days=False, seed=0):
+  """
+  :param action_repeat: (int) SEIR_env action_repeat
+  :param stack_days: (bool) SEIR_env stack_days
+  :param seed: (int) seed of the actions
+  :return: (int) number of steps of the checked episode
+  """
+  input_data = small_inputs()
+  env = SEIR_env(1000., input_data=input_data, action_repeat=action_repeat, stack_days=stack_days)
+  vec_env = DummyVecEnv([lambda: env])
+  reference = SEIR_env(1000., input_data=input_data, action_repeat=action_repeat,
+                       stack_days=stack_days)
+  vec_env.reset()
+  expected = reference.reset().copy()
+  env.action_space.seed(seed)
+  for steps in range(1, 1000):
+    action = env.action_space.sample()
+    observations, _, dones, infos = vec_env.step([action])
+    expected, _, done, _ = reference.step(action)
+    expected = expected.copy()
+    assert dones[0] == done
+    if done:
+      terminal = infos[0]['terminal_observation']
+      assert np.array_equal(terminal, expected), "terminal observation overwritten by reset"
+      assert np.array_equal(observations[0], reference.reset()), "observation after reset"
+      assert not np.array_equal(terminal, observations[0])
+      return steps
+  raise AssertionError("the episode did not end")
+
+
+if __name__ == "__main__":
+  for kwargs in ({}, {'action_repeat': 4, 'stack_days': True}):
+    steps = check_terminal_observation(**kwargs)
+    print("terminal_observation kept %s: episode of %d steps" % (kwargs or '', steps))
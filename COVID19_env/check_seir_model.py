@@ -0,0 +1,77 @@
+"""
+checks that SEIRModel.step gives the same result with and without out= (the
+preallocated dense path, _step_into), also with out being states itself, for
+full, factored and batched reduction factors
+    $ cd COVID19_env
+    $ python check_seir_model.py
+"""
+import sys
+sys.path.append("..")
+
+import numpy as np
+
+from COVID19_env.seir_model import SEIRModel, FactoredReduction
+
+
+def small_inputs(num_cities=14, num_days=70, current=10, seed=0):
+  """
+  Random SEIR_env inputs with dense ODs (in place of read_input.R)
+
+  :param num_cities: (int) number of cities
+  :param num_days: (int) number of days of compartment and OD data
+  :param current: (int) first day of the episodes
+  :param seed: (int) seed of the random number generator
+  :return: (dict) SEIR model inputs keyed by SEIR_env.INPUT_NAMES
+  """
+  rng = np.random.default_rng(seed)
+  pops = rng.uniform(2e6, 2e7, num_cities)
+  ODs = rng.uniform(0, 3000, (num_days, num_cities, num_cities))
+  ODs[:, np.arange(num_cities), np.arange(num_cities)] = 0
+  St, Et, It, Rt = (np.zeros((num_days, num_cities)) for _ in range(4))
+  Et[current] = rng.uniform(0, 50, num_cities)
+  It[current] = rng.uniform(0, 20, num_cities)
+  St[current] = pops - Et[current] - It[current]
+  return dict(beta_data=rng.uniform(0.1, 0.3, num_cities),
+              beta_sd_data=np.full(num_cities, 0.01),
+              latent=np.array([5.1]), gamma=np.array([0.06]),
+              St_data=St, Et_data=Et, It_data=It, Rt_data=Rt,
+              ODs=ODs, pops=pops, current=np.array([current]), pred=np.array([1]),
+              city_names=np.array(["city%d" % i for i in range(num_cities)]))
+
+
+def check_step_out(num_cities=14, batch=5, rank=2, seed=0):
+  """
+  :param num_cities: (int) number of cities of the random inputs
+  :param batch: (int) batch size of the batched cases
+  :param rank: (int) number of factors of the factored cases
+  :param seed: (int) seed of the random states and reduction factors
+  :return: (list) names of the cases that were checked
+  """
+  model = SEIRModel.from_input_data(small_inputs(num_cities))
+  rng = np.random.default_rng(seed)
+  n = num_cities
+  states = rng.uniform(0, 1e4, (n, 4))
+  batch_states = rng.uniform(0, 1e4, (batch, n, 4))
+  days = rng.integers(0, 70, batch)
+  cases = {
+      'none':              (states, 3, None),
+      'dense':             (states, 3, rng.uniform(0, 1, (n, n))),
+      'factored':          (states, 3, FactoredReduction(rng.uniform(0, 1, (n, rank)),
+                                                         rng.uniform(0, 1, (n, rank)))),
+      'batched dense':     (batch_states, days, rng.uniform(0, 1, (batch, n, n))),
+      'batched factored':  (batch_states, days, FactoredReduction(rng.uniform(0, 1, (batch, n, rank)),
+                                                                  rng.uniform(0, 1, (n, rank)))),
+      'batched, shared rf': (batch_states, days, rng.uniform(0, 1, (n, n))),
+  }
+  for name, (s, day, rf) in cases.items():
+    expected = model.step(s, day, rf)
+    result = model.step(s, day, rf, out=np.empty_like(s))
+    in_place = s.copy()
+    model.step(in_place, day, rf, out=in_place)
+    for r in (result, in_place):
+      assert np.allclose(r, expected, rtol=1e-12, atol=0), "step(out=) differs: %s" % name
+  return list(cases)
+
+
+if __name__ == "__main__":
+  print("step(out=) matches step():", ', '.join(check_step_out()))
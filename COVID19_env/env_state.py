@@ -0,0 +1,28 @@
+"""
+helpers of the environment get_state/set_state snapshots
+
+Snapshots are plain dicts of numbers and numpy arrays, so they can be pickled,
+sent to other processes and restored into a single environment or into one
+replica of the matching vectorized environment.
+"""
+
+
+def rng_state(rng):
+  """
+  :param rng: (np.random.RandomState or np.random.Generator) env.np_random
+  :return: picklable state of the generator
+  """
+  if hasattr(rng, 'bit_generator'):
+    return rng.bit_generator.state # np.random.Generator (gym >= 0.22)
+  return rng.get_state()
+
+
+def set_rng_state(rng, state):
+  """
+  :param rng: (np.random.RandomState or np.random.Generator) env.np_random
+  :param state: state returned by rng_state
+  """
+  if hasattr(rng, 'bit_generator'):
+    rng.bit_generator.state = state
+  else:
+    rng.set_state(state)
@@ -1,10 +1,227 @@
+"""
+parallel Optuna hyperparameter search for the agents on the COVID19 envs
+
+The environments are registered with gym (simple_SIR-v0, SEIR-v0) and the
+trials of one study are run concurrently by a pool of worker processes. The
+workers share the study through a local SQLite database, so a sweep can be
+stopped and resumed, and several sweeps can be started against the same
+study. Each trial trains in n_evaluations chunks and reports the mean
+evaluation reward after every chunk (the pruner steps are the evaluation
+indices), so the pruner stops unpromising trials early. Every worker creates its training and evaluation environments once and
+reuses them for all of its trials (for SEIR-v0 that avoids reading the model
+inputs with R for every trial); they are reseeded with the trial number and
+reset at the start of every trial, so a trial does not depend on the trials
+run before it in the same worker. A trial that diverges (NaN or inf rewards,
+numerical errors of the model or of TensorFlow) is recorded as failed and the
+worker goes on with the next one.
+
+Example, 1000 A2C trials on SEIR_env with 8 processes:
+    $ cd COVID19_env
+    $ python opt_hyp.py --algo a2c --env SEIR-v0 -n 50000 --n-trials 1000 --n-jobs 8 \
+        --sampler tpe --pruner median --seir-inputs SEIR_inputs.bin
+
+Results are in the study database (default opt_hyp.db), e.g.
+    optuna.load_study(study_name, storage="sqlite:///opt_hyp.db").best_params
+"""
 import sys
 sys.path.append("..")
 
-from SEIR_env import SEIR_env
-import rl_baselines_zoo
-import gym
+import argparse
+import multiprocessing
+
+import numpy as np
+
+# gym ids of the environments and their default arguments
+ENV_IDS = {
+  'simple_SIR-v0': ('COVID19_env.simple_SIR_env:simple_SIR_env',
+                    {'S0': 999, 'I0': 1, 'R0': 0, 'hospitalCapacity': 300}),
+  'SEIR-v0': ('COVID19_env.SEIR_env:SEIR_env',
+              {'hospitalCapacity': 10000}),
+}
+
+# Stable Baselines algorithms that can be tuned
+ALGOS = ('a2c', 'acktr', 'ppo2', 'dqn')
+
+# environments of this worker process, reused by all of its trials
+_envs = {}
+
+
+def register_envs():
+  """
+  Register simple_SIR_env and SEIR_env with gym (once per process)
+  """
+  from gym.envs.registration import register, registry
+  for env_id, (entry_point, kwargs) in ENV_IDS.items():
+    if env_id not in getattr(registry, 'env_specs', registry):
+      register(id=env_id, entry_point=entry_point, kwargs=kwargs)
+
+
+def sample_params(trial, algo):
+  """
+  :param trial: (optuna.trial.Trial) trial
+  :param algo: (str) one of ALGOS
+  :return: (dict) keyword arguments of the algorithm
+  """
+  params = {
+    'gamma': trial.suggest_categorical('gamma', [0.9, 0.95, 0.98, 0.99, 0.995, 0.999]),
+    'learning_rate': trial.suggest_loguniform('learning_rate', 1e-5, 1e-2),
+  }
+  if algo == 'dqn':
+    params['batch_size'] = trial.suggest_categorical('batch_size', [16, 32, 64, 128])
+    params['buffer_size'] = trial.suggest_categorical('buffer_size', [5000, 10000, 50000])
+    params['exploration_fraction'] = trial.suggest_uniform('exploration_fraction', 0.05, 0.5)
+    params['exploration_final_eps'] = trial.suggest_uniform('exploration_final_eps', 0.01, 0.2)
+    return params
+  params['n_steps'] = trial.suggest_categorical('n_steps', [5, 16, 32, 64, 128])
+  params['ent_coef'] = trial.suggest_loguniform('ent_coef', 1e-8, 0.1)
+  params['vf_coef'] = trial.suggest_uniform('vf_coef', 0.1, 1.0)
+  if algo == 'ppo2':
+    params['nminibatches'] = 1
+    params['noptepochs'] = trial.suggest_categorical('noptepochs', [1, 5, 10, 20])
+    params['cliprange'] = trial.suggest_categorical('cliprange', [0.1, 0.2, 0.3])
+  return params
+
+
+def _get_envs(env_id, env_kwargs):
+  # training and evaluation envs, created once per worker process
+  key = (env_id, tuple(sorted(env_kwargs.items())))
+  if key not in _envs:
+    import gym
+    register_envs()
+    _envs[key] = (gym.make(env_id, **env_kwargs), gym.make(env_id, **env_kwargs))
+  return _envs[key]
+
+
+def _reset_envs(envs, seed):
+  # start a trial from a fresh state of the reused envs
+  for i, env in enumerate(envs):
+    env.seed(seed + i)
+    env.reset()
+
+
+def _trial_errors():
+  # errors of a single diverging trial, caught by study.optimize
+  errors = (ValueError, ArithmeticError, RuntimeError)
+  try:
+    import tensorflow as tf
+  except ImportError:
+    return errors
+  return errors + (tf.errors.InvalidArgumentError,)
+
+
+def _evaluate(model, env, n_episodes, max_steps=100):
+  # mean episode reward with the deterministic policy
+  totals = []
+  for _ in range(n_episodes):
+    obs, total = env.reset(), 0.
+    for _ in range(max_steps):
+      action, _ = model.predict(obs, deterministic=True)
+      obs, reward, done, _ = env.step(action)
+      total += reward
+      if done:
+        break
+    totals.append(total)
+  return float(np.mean(totals))
+
+
+def objective(trial, args):
+  """
+  Train an agent with sampled hyperparameters and return its evaluation reward
+
+  :param trial: (optuna.trial.Trial) trial
+  :param args: (argparse.Namespace) command line arguments
+  :return: (float) mean evaluation reward after training
+  """
+  import optuna
+  import stable_baselines
+
+  env_kwargs = {}
+  if args.env == 'SEIR-v0' and args.seir_inputs is not None:
+    env_kwargs['input_data'] = args.seir_inputs
+  env, eval_env = _get_envs(args.env, env_kwargs)
+  seed = args.seed + trial.number
+  _reset_envs((env, eval_env), 2*seed)
+
+  algo = getattr(stable_baselines, args.algo.upper())
+  policy = 'MlpPolicy'
+  model = algo(policy, env, verbose=0, seed=seed, **sample_params(trial, args.algo))
+
+  chunk = max(1, args.n_timesteps // args.n_evaluations)
+  reward = -np.inf
+  for i in range(args.n_evaluations):
+    model.learn(total_timesteps=chunk, reset_num_timesteps=(i == 0))
+    reward = _evaluate(model, eval_env, args.n_eval_episodes)
+    if not np.isfinite(reward):
+      raise FloatingPointError("training diverged: evaluation reward %r" % reward)
+    trial.report(reward, i) # step = evaluation index, the unit of n_warmup_steps
+    if trial.should_prune():
+      raise optuna.TrialPruned()
+  return reward
+
+
+def _make_study(args, load):
+  import optuna
+  if args.sampler == 'random':
+    sampler = optuna.samplers.RandomSampler(seed=args.seed)
+  else:
+    sampler = optuna.samplers.TPESampler(n_startup_trials=5, seed=args.seed)
+  if args.pruner == 'median':
+    pruner = optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=args.n_evaluations // 3)
+  else:
+    pruner = optuna.pruners.NopPruner()
+  return optuna.create_study(study_name=args.study_name, storage=args.storage,
+                             sampler=sampler, pruner=pruner, direction='maximize',
+                             load_if_exists=load)
+
+
+def _worker(args_and_trials):
+  # run trials of the shared study in this process
+  args, n_trials = args_and_trials
+  study = _make_study(args, load=True)
+  study.optimize(lambda trial: objective(trial, args), n_trials=n_trials,
+                 catch=_trial_errors())
+  return n_trials
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="parallel Optuna search for the COVID19 envs")
+  parser.add_argument('--algo', choices=ALGOS, default='a2c')
+  parser.add_argument('--env', choices=sorted(ENV_IDS), default='SEIR-v0')
+  parser.add_argument('-n', '--n-timesteps', type=int, default=50000, help="training steps per trial")
+  parser.add_argument('--n-trials', type=int, default=100)
+  parser.add_argument('--n-jobs', type=int, default=multiprocessing.cpu_count(),
+                      help="number of worker processes")
+  parser.add_argument('--n-evaluations', type=int, default=10,
+                      help="evaluations (pruning checks) per trial")
+  parser.add_argument('--n-eval-episodes', type=int, default=5)
+  parser.add_argument('--sampler', choices=('tpe', 'random'), default='tpe')
+  parser.add_argument('--pruner', choices=('median', 'none'), default='median')
+  parser.add_argument('--storage', default='sqlite:///opt_hyp.db')
+  parser.add_argument('--study-name', default=None, help="default: <algo>_<env>")
+  parser.add_argument('--seir-inputs', default=None,
+                      help="SEIR input snapshot (seir_inputs.py), read with R if not given")
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args(argv)
+  if args.algo == 'dqn' and args.env == 'SEIR-v0':
+    parser.error("dqn needs a discrete action space, SEIR-v0 actions are continuous")
+  if args.study_name is None:
+    args.study_name = "%s_%s" % (args.algo, args.env)
+
+  # create the study once, then let the workers share it
+  _make_study(args, load=True)
+  shares = [args.n_trials // args.n_jobs + (i < args.n_trials % args.n_jobs)
+            for i in range(args.n_jobs)]
+  shares = [n for n in shares if n > 0]
+  with multiprocessing.Pool(len(shares)) as pool:
+    pool.map(_worker, [(args, n) for n in shares], chunksize=1)
 
+  study = _make_study(args, load=True)
+  print("Number of finished trials: %d" % len(study.trials))
+  print("Best value: %f" % study.best_value)
+  print("Best params:")
+  for key, value in study.best_params.items():
+    print("  %s: %s" % (key, value))
 
 
-train.py --algo a2c --env SEIR-v0 -n 50000 -optimize --n-trials 1000 --n-jobs 2 --sampler tpe --pruner median
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,98 @@
+"""
+process-wide cache of the R models used by the environments
+
+Sourcing an R file or building a STAP package from it is slow, so every file
+is loaded once per process and the resulting R function handles are reused by
+every environment (and every step) in that process. Static model inputs can
+be converted to R objects once with to_r and passed to the cached functions
+as they are.
+"""
+import os
+
+import numpy as np
+
+import rpy2.robjects as robjects
+from rpy2.robjects import numpy2ri
+from rpy2.robjects.packages import STAP
+
+# loaded R functions, keyed by (absolute file path, function name)
+_functions = {}
+
+# STAP packages, keyed by absolute file path
+_packages = {}
+
+_numpy2ri_active = False
+
+
+def activate_numpy2ri():
+  """
+  Turn on automatic numpy <--> R conversion (once per process)
+  """
+  global _numpy2ri_active
+  if not _numpy2ri_active:
+    numpy2ri.activate()
+    _numpy2ri_active = True
+
+
+def sourced_function(path, name):
+  """
+  R function defined in a file that is run with source()
+
+  :param path: (str) path of the R file
+  :param name: (str) name of the function defined by the file
+  :return: (rpy2.robjects.functions.Function) cached R function
+  """
+  key = (os.path.abspath(path), name)
+  if key not in _functions:
+    robjects.r['source'](key[0]) # source all R functions in the specified file
+    _functions[key] = robjects.globalenv[name]
+  return _functions[key]
+
+
+def package_function(path, name):
+  """
+  R function of a file loaded as a STAP package
+
+  :param path: (str) path of the R file
+  :param name: (str) name of the function defined by the file
+  :return: (rpy2.robjects.functions.Function) cached R function
+  """
+  path = os.path.abspath(path)
+  key = (path, name)
+  if key not in _functions:
+    if path not in _packages:
+      cwd = os.getcwd()
+      with open(path, 'r') as f:
+        string = f.read()
+      _packages[path] = STAP(string, os.path.splitext(os.path.basename(path))[0])
+      os.chdir(cwd)
+    _functions[key] = getattr(_packages[path], name)
+  return _functions[key]
+
+
+def to_r(value):
+  """
+  Convert a model input to an R object so it can be reused across calls.
+  R objects are returned unchanged, strings (e.g. city_names) become an R
+  character vector, a sequence of arrays becomes an R list of matrices (e.g.
+  ODs) and arrays become R vectors/matrices.
+
+  :param value: input value
+  :return: (rpy2.robjects.RObject)
+  """
+  if isinstance(value, robjects.RObject):
+    return value
+  if isinstance(value, str):
+    return robjects.StrVector([value])
+  if isinstance(value, (list, tuple)):
+    if all(isinstance(v, str) for v in value):
+      return robjects.StrVector(list(value))
+    return robjects.r['list'](*[to_r(v) for v in value])
+  value = np.asarray(value)
+  if value.dtype.kind == 'S':
+    value = np.char.decode(value)
+  if value.dtype.kind == 'U':
+    return robjects.StrVector(value.ravel().tolist())
+  if value.ndim == 3:
+    return robjects.r['list'](*[to_r(v) for v in value])
+  return numpy2ri.py2rpy(value)
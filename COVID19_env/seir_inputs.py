@@ -0,0 +1,121 @@
+"""
+binary snapshot of the SEIR environment inputs
+
+Reading RL_input with read_input.R and converting the result to numpy takes a
+few seconds per environment, and every SubprocVecEnv worker would hold its own
+copy of the OD matrices. Instead, the inputs are exported once to a single
+file and every environment maps that file read-only:
+
+    $ cd COVID19_env
+    $ python seir_inputs.py SEIR_inputs.bin     # requires R
+
+    env = SEIR_env(hospitalCapacity, input_data='SEIR_inputs.bin')
+
+Opening a snapshot only parses a small header; the arrays are views into the
+memory mapped file, so the OD data is read from disk once and shared by all
+processes through the page cache.
+
+Layout: the 8 byte magic SNAPSHOT_MAGIC, the length of the header (8 byte
+little endian unsigned int), a JSON header giving the dtype, shape and offset
+of every array, and the raw C-ordered arrays, each aligned to 64 bytes.
+"""
+import sys
+sys.path.append("..")
+
+import json
+import os
+
+import numpy as np
+
+from COVID19_env.seir_model import SparseOD
+
+SNAPSHOT_MAGIC = b'SEIRSNAP'
+_ALIGNMENT = 64
+
+# arrays of a SparseOD, stored as ODs.<name>
+_SPARSE_OD_ARRAYS = ("day_ptr", "origin", "dest", "passengers")
+
+
+def _aligned(nbytes):
+  return -(-nbytes // _ALIGNMENT) * _ALIGNMENT
+
+
+def _to_numpy(name, value):
+  # R objects (as returned by read_input.R) and python values to numpy
+  if name == "ODs" and not isinstance(value, np.ndarray):
+    return np.array([np.array(od, dtype=np.float64) for od in value])
+  return np.array(value)
+
+
+def export_inputs(path, input_data):
+  """
+  Write the SEIR environment inputs to a snapshot file
+
+  :param path: (str) snapshot file
+  :param input_data: (dict) SEIR model inputs keyed by SEIR_env.INPUT_NAMES,
+    numpy arrays or R objects. ODs can be a seir_model.SparseOD
+  """
+  arrays = {}
+  header = {"arrays": {}, "strings": {}, "sparse_ODs": None}
+  for name, value in input_data.items():
+    if name == "city_names":
+      header["strings"][name] = [str(c) for c in value]
+    elif isinstance(value, SparseOD):
+      header["sparse_ODs"] = {"num_cities": value.num_cities}
+      for field in _SPARSE_OD_ARRAYS:
+        arrays[name + "." + field] = getattr(value, field)
+    else:
+      arrays[name] = _to_numpy(name, value)
+
+  offset = 0
+  for name, array in arrays.items():
+    header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+    offset += _aligned(array.nbytes)
+  size = offset
+  header_bytes = json.dumps(header).encode()
+  data_start = _aligned(len(SNAPSHOT_MAGIC) + 8 + len(header_bytes))
+
+  # write to a temporary file first so workers never map a partial snapshot
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'wb') as f:
+    f.write(SNAPSHOT_MAGIC)
+    f.write(len(header_bytes).to_bytes(8, 'little'))
+    f.write(header_bytes)
+    for name, array in arrays.items():
+      f.seek(data_start + header["arrays"][name]["offset"])
+      f.write(np.ascontiguousarray(array).tobytes())
+    f.truncate(data_start + size)
+  os.replace(tmp_path, path)
+
+
+def load_inputs(path):
+  """
+  Open a snapshot written by export_inputs
+
+  :param path: (str) snapshot file
+  :return: (dict) SEIR model inputs keyed by SEIR_env.INPUT_NAMES; the arrays
+    are read-only views into the memory mapped file
+  """
+  with open(path, 'rb') as f:
+    if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+      raise ValueError("%s is not a SEIR input snapshot" % path)
+    header_len = int.from_bytes(f.read(8), 'little')
+    header = json.loads(f.read(header_len).decode())
+  data_start = _aligned(len(SNAPSHOT_MAGIC) + 8 + header_len)
+  buffer = np.memmap(path, dtype=np.uint8, mode='r')
+
+  input_data = {}
+  for name, spec in header["arrays"].items():
+    input_data[name] = np.ndarray(spec["shape"], dtype=np.dtype(spec["dtype"]),
+                                  buffer=buffer, offset=data_start + spec["offset"])
+  for name, strings in header["strings"].items():
+    input_data[name] = strings
+  if header["sparse_ODs"] is not None:
+    input_data["ODs"] = SparseOD(*[input_data.pop("ODs." + field) for field in _SPARSE_OD_ARRAYS],
+                                 num_cities=header["sparse_ODs"]["num_cities"])
+  return input_data
+
+
+if __name__ == "__main__":
+  from COVID19_env.SEIR_env import read_input_r
+  export_inputs(sys.argv[1] if len(sys.argv) > 1 else 'SEIR_inputs.bin', read_input_r())
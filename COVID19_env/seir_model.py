@@ -0,0 +1,461 @@
+"""
+native python implementation of the 14 city SEIR model with air travel
+
+The equations are the ones in
+COVID19_models/distributable version/SEIR model (prediction).R. People in
+compartment X leave city i at rate sum_j(OD[i,j]) * X_i / pop_i and arrive in
+city j at rate sum_i(OD[i,j] * X_i / pop_i), i.e. the compartment composition
+of the travellers is the one of their origin city. The per-city loops of the R
+script become two matrix products over the OD matrix.
+
+States are arrays of shape (..., num_cities, 4) holding (S, E, I, R) along the
+last axis, so one call can advance a single trajectory or a whole batch.
+
+The OD data is either a dense (num_days, num_cities, num_cities) array, fine
+for the 14 metro areas, or a SparseOD holding only the nonzero flows of each
+day, for county level models where almost all OD pairs are zero. With a
+SparseOD the cost of travel grows with the number of nonzero flows instead of
+num_cities**2. The economic cost counts every OD pair with either format, so
+both give the same rewards.
+
+Reduction factors are either full (..., num_cities, num_cities) arrays or a
+FactoredReduction, which is only expanded where it is needed: to the full
+matrix for dense OD data, and to the nonzero flows for a SparseOD.
+"""
+
+import numpy as np
+
+# compartment indices along the last axis of a state array
+S, E, I, R = 0, 1, 2, 3
+
+
+class SparseOD(object):
+  """
+  Daily OD matrices stored as edge lists in compressed sparse row order
+
+  The edges of day d are day_ptr[d]:day_ptr[d+1] of origin, dest and
+  passengers, sorted by origin and then destination. Indices are int32, so a
+  90 day horizon with 100,000 flows per day takes about 140 MB.
+
+  :param day_ptr: (np.ndarray) start of each day's edges, shape (num_days+1,)
+  :param origin: (np.ndarray) origin city of each edge
+  :param dest: (np.ndarray) destination city of each edge
+  :param passengers: (np.ndarray) passengers travelling along each edge
+  :param num_cities: (int) number of cities
+  """
+
+  def __init__(self, day_ptr, origin, dest, passengers, num_cities):
+    self.day_ptr    = np.asarray(day_ptr, dtype=np.int64)
+    self.origin     = np.asarray(origin, dtype=np.int32)
+    self.dest       = np.asarray(dest, dtype=np.int32)
+    self.passengers = np.asarray(passengers, dtype=np.float64)
+    self.num_cities = int(num_cities)
+    self.num_days   = len(self.day_ptr) - 1
+
+  @classmethod
+  def from_edges(cls, day, origin, dest, passengers, num_days, num_cities):
+    """
+    :param day: (np.ndarray) day index (0 based) of each edge
+    :param origin: (np.ndarray) origin city of each edge
+    :param dest: (np.ndarray) destination city of each edge
+    :param passengers: (np.ndarray) passengers of each edge (zeros are dropped)
+    :param num_days: (int) number of days
+    :param num_cities: (int) number of cities
+    :return: (SparseOD)
+    """
+    day, origin, dest, passengers = (np.asarray(a) for a in (day, origin, dest, passengers))
+    keep = passengers != 0
+    order = np.lexsort((dest[keep], origin[keep], day[keep]))
+    day = day[keep][order]
+    day_ptr = np.searchsorted(day, np.arange(num_days+1))
+    return cls(day_ptr, origin[keep][order], dest[keep][order], passengers[keep][order], num_cities)
+
+  @classmethod
+  def from_dense(cls, ODs):
+    """
+    :param ODs: (np.ndarray) shape (num_days, num_cities, num_cities)
+    :return: (SparseOD)
+    """
+    ODs = np.asarray(ODs)
+    day, origin, dest = np.nonzero(ODs)
+    return cls.from_edges(day, origin, dest, ODs[day, origin, dest], ODs.shape[0], ODs.shape[1])
+
+  def edges(self, day):
+    """
+    :param day: (int) row of the OD data
+    :return: (np.ndarray, np.ndarray, np.ndarray) origin, dest and passengers
+      of the day's nonzero flows
+    """
+    lo, hi = self.day_ptr[day], self.day_ptr[day+1]
+    return self.origin[lo:hi], self.dest[lo:hi], self.passengers[lo:hi]
+
+  def travel(self, states, pops, day, edge_factor=None):
+    """
+    Net change of each compartment due to travel, in O(number of flows)
+
+    :param states: (np.ndarray) compartments, shape (..., num_cities, 4)
+    :param pops: (np.ndarray) population of each city
+    :param day: (int) row of the OD data
+    :param edge_factor: (np.ndarray) multiplier of each flow, shape (..., nnz)
+    :return: (np.ndarray) inflow - outflow, shape (..., num_cities, 4)
+    """
+    origin, dest, trips = self.edges(day)
+    if edge_factor is not None:
+      trips = trips * edge_factor
+    batch = states.shape[:-2]
+    n_batch = int(np.prod(batch))
+    n = self.num_cities
+    share = (states / pops[:, None]).reshape(n_batch, n, 4)
+    trips = np.broadcast_to(trips, batch + trips.shape[-1:]).reshape(n_batch, -1)
+
+    # people leaving each origin, and arriving at each destination (one
+    # bincount over (batch, city, compartment) bins)
+    offset = (np.arange(n_batch)*n)[:, None]
+    outflow = np.bincount((offset + origin).ravel(), trips.ravel(),
+                          minlength=n_batch*n).reshape(n_batch, n, 1) * share
+    moving = trips[:, :, None] * share[:, origin, :]
+    bins = ((offset + dest)[:, :, None]*4 + np.arange(4)).ravel()
+    inflow = np.bincount(bins, moving.ravel(), minlength=n_batch*n*4).reshape(n_batch, n, 4)
+    return (inflow - outflow).reshape(states.shape)
+
+
+class FactoredReduction(object):
+  """
+  Reduction factor matrix given by its factors, rf = U @ V.T, i.e.
+  rf[..., i, j] = sum_k(U[..., i, k] * V[..., j, k])
+
+  :param U: (np.ndarray) origin factors, shape (..., num_cities, k)
+  :param V: (np.ndarray) destination factors, shape (..., num_cities, k) or
+    (num_cities, k) when shared by the batch
+  """
+
+  def __init__(self, U, V):
+    self.U = U
+    self.V = V
+
+  @property
+  def batch_shape(self):
+    return self.U.shape[:-2]
+
+  def __getitem__(self, index):
+    # select batch members
+    return FactoredReduction(self.U[index], self.V[index] if self.V.ndim > 2 else self.V)
+
+  def dense(self, out=None):
+    """
+    :param out: (np.ndarray) optional output array
+    :return: (np.ndarray) full reduction factors, shape (..., num_cities, num_cities)
+    """
+    return np.matmul(self.U, np.swapaxes(self.V, -1, -2), out=out)
+
+  def on_edges(self, origin, dest):
+    """
+    :param origin: (np.ndarray) origin city of each flow
+    :param dest: (np.ndarray) destination city of each flow
+    :return: (np.ndarray) reduction factor of each flow, shape (..., nnz)
+    """
+    return (self.U[..., origin, :] * self.V[..., dest, :]).sum(axis=-1)
+
+
+def _on_edges(reduction_factor, origin, dest):
+  if isinstance(reduction_factor, FactoredReduction):
+    return reduction_factor.on_edges(origin, dest)
+  return reduction_factor[..., origin, dest]
+
+
+def _dense(reduction_factor):
+  if isinstance(reduction_factor, FactoredReduction):
+    return reduction_factor.dense()
+  return reduction_factor
+
+
+def _batch_ndim(reduction_factor):
+  if isinstance(reduction_factor, FactoredReduction):
+    return len(reduction_factor.batch_shape)
+  return reduction_factor.ndim - 2
+
+
+class SEIRModel(object):
+  """
+  Deterministic metapopulation SEIR model
+
+  :param beta: (np.ndarray) transmission rate per city, shape (num_cities,),
+    or per day and city, shape (num_days, num_cities)
+  :param latent: (float) latent period (days)
+  :param gamma: (float) recovery rate (/day)
+  :param ODs: (np.ndarray or SparseOD) passengers travelling from city i to
+    city j on each day, shape (num_days, num_cities, num_cities)
+  :param pops: (np.ndarray) population of each city, shape (num_cities,)
+  """
+
+  def __init__(self, beta, latent, gamma, ODs, pops):
+    self.beta   = np.asarray(beta, dtype=np.float64)
+    self.latent = float(latent)
+    self.gamma  = float(gamma)
+    self.sparse = isinstance(ODs, SparseOD)
+    self.ODs    = ODs if self.sparse else np.asarray(ODs, dtype=np.float64)
+    self.pops   = np.asarray(pops, dtype=np.float64)
+    self.num_cities = len(self.pops)
+    self.num_days   = self.ODs.num_days if self.sparse else self.ODs.shape[0]
+
+    # scratch arrays of step(..., out=...), keyed by (name, shape, dtype)
+    self._buffers = {}
+
+  @classmethod
+  def from_input_data(cls, input_data):
+    """
+    Build the model from the SEIR_env inputs (as returned by read_input.R)
+
+    :param input_data: (dict) SEIR model inputs keyed by SEIR_env.INPUT_NAMES
+    :return: (SEIRModel)
+    """
+    ODs = input_data["ODs"]
+    if not isinstance(ODs, (SparseOD, np.ndarray)):
+      ODs = np.array([np.array(od) for od in ODs]) # R list of matrices
+    return cls(beta   = np.array(input_data["beta_data"]),
+               latent = np.ravel(input_data["latent"])[0],
+               gamma  = np.ravel(input_data["gamma"])[0],
+               ODs    = ODs,
+               pops   = np.array(input_data["pops"]))
+
+  def od_day(self, day):
+    """
+    Index into ODs for a given day. Days past the end of the mobility data
+    repeat the last week, as in the prediction script.
+
+    :param day: (int or np.ndarray) day index (0 based), one per batch member
+    :return: (np.ndarray) row of ODs to use
+    """
+    day = np.asarray(day)
+    return np.where(day < self.num_days, day,
+                    self.num_days - 7 + (day - self.num_days) % 7)
+
+  def _od_row(self, day):
+    # od_day for a single day, as a python int
+    if day < self.num_days:
+      return int(day)
+    return self.num_days - 7 + (int(day) - self.num_days) % 7
+
+  def _buffer(self, name, shape, dtype=np.float64):
+    key = (name, shape, np.dtype(dtype))
+    buffer = self._buffers.get(key)
+    if buffer is None:
+      buffer = self._buffers[key] = np.empty(shape, dtype=dtype)
+    return buffer
+
+  def beta_day(self, day):
+    """
+    :param day: (int or np.ndarray) day index (0 based), one per batch member
+    :return: (np.ndarray) transmission rate of each city on the given day
+    """
+    if self.beta.ndim == 1:
+      return self.beta
+    return self.beta[np.minimum(day, len(self.beta) - 1)]
+
+  def travel(self, states, trips):
+    """
+    Net change of each compartment due to travel
+
+    :param states: (np.ndarray) compartments, shape (..., num_cities, 4)
+    :param trips: (np.ndarray) passengers from city i to city j, shape
+      (..., num_cities, num_cities)
+    :return: (np.ndarray) inflow - outflow, shape (..., num_cities, 4)
+    """
+    share   = states / self.pops[:, None]
+    outflow = trips.sum(axis=-1)[..., None] * share
+    inflow  = np.swapaxes(trips, -1, -2) @ share
+    return inflow - outflow
+
+  def travel_delta(self, states, day, reduction_factor=None):
+    """
+    Net change of each compartment due to travel on a given day
+
+    :param states: (np.ndarray) compartments, shape (..., num_cities, 4)
+    :param day: (int) day index (0 based)
+    :param reduction_factor: (np.ndarray or FactoredReduction) multiplier for
+      each OD pair, shape (..., num_cities, num_cities); None means no travel
+      restriction
+    :return: (np.ndarray) inflow - outflow, shape (..., num_cities, 4)
+    """
+    od_day = self.od_day(day)
+    if self.sparse:
+      edge_factor = None
+      if reduction_factor is not None:
+        origin, dest, _ = self.ODs.edges(od_day)
+        edge_factor = _on_edges(reduction_factor, origin, dest)
+      return self.ODs.travel(states, self.pops, od_day, edge_factor)
+    trips = self.ODs[od_day]
+    if reduction_factor is not None:
+      trips = trips * _dense(reduction_factor)
+    return self.travel(states, trips)
+
+  def economic_cost(self, reduction_factor, day=None):
+    """
+    Economic cost of a travel restriction, sum(-(10*(1-reduction_factor))**2)
+    over all the OD pairs. It is the same for dense and sparse OD data, and
+    for factored reduction factors it is computed from the factors without
+    forming the num_cities**2 matrix.
+
+    :param reduction_factor: (np.ndarray or FactoredReduction) multiplier for
+      each OD pair, shape (..., num_cities, num_cities)
+    :param day: (int) day index (0 based), unused: the cost is the same every
+      day
+    :return: (np.ndarray) cost of each batch member, shape (...,)
+    """
+    if isinstance(reduction_factor, FactoredReduction):
+      # sum((1 - U V^T)**2) = n**2 - 2 sum(U V^T) + sum((U^T U) * (V^T V)),
+      # in float64 (float16 actions would overflow on large graphs)
+      U = np.asarray(reduction_factor.U, dtype=np.float64)
+      V = np.asarray(reduction_factor.V, dtype=np.float64)
+      total = (U.sum(axis=-2) * V.sum(axis=-2)).sum(axis=-1)
+      squares = ((np.swapaxes(U, -1, -2) @ U) * (np.swapaxes(V, -1, -2) @ V)).sum(axis=(-2, -1))
+      return -100*(self.num_cities**2 - 2*total + squares)
+    cost = self._buffer('cost', reduction_factor.shape, reduction_factor.dtype)
+    np.subtract(1, reduction_factor, out=cost)
+    np.multiply(10, cost, out=cost)
+    np.square(cost, out=cost)
+    return -cost.sum(axis=(-2, -1))
+
+  def step(self, states, day, reduction_factor=None, out=None):
+    """
+    Advance the model by one day
+
+    :param states: (np.ndarray) compartments, shape (..., num_cities, 4)
+    :param day: (int or np.ndarray) day index (0 based) of the current state,
+      either shared by the batch or of shape (...,)
+    :param reduction_factor: (np.ndarray or FactoredReduction) multiplier for
+      each OD pair, shape (..., num_cities, num_cities); None means no travel
+      restriction
+    :param out: (np.ndarray) array for the result, may be states itself. With
+      dense OD data the step then runs in scratch arrays kept by the model and
+      allocates no new arrays.
+    :return: (np.ndarray) compartments on the next day
+    """
+    if out is not None:
+      if not self.sparse:
+        return self._step_into(states, day, reduction_factor, out)
+      out[...] = self.step(states, day, reduction_factor)
+      return out
+    St = states[..., S]
+    Et = states[..., E]
+    It = states[..., I]
+    infection = self.beta_day(day) * It * St / self.pops
+    incubation = Et / self.latent
+    recovery = self.gamma * It
+
+    if not self.sparse or np.ndim(day) == 0:
+      delta = self.travel_delta(states, day, reduction_factor)
+    else:
+      # the flows differ between days, so batch members are grouped by day
+      delta = np.empty_like(states)
+      for d in np.unique(day):
+        members = day == d
+        factor = reduction_factor
+        if factor is not None and _batch_ndim(factor) > 0:
+          factor = factor[members]
+        delta[members] = self.travel_delta(states[members], d, factor)
+    delta[..., S] -= infection
+    delta[..., E] += infection - incubation
+    delta[..., I] += incubation - recovery
+    delta[..., R] += recovery
+    return states + delta
+
+  def _step_into(self, states, day, reduction_factor, out):
+    # same arithmetic as step, written into preallocated arrays (dense OD)
+    n = self.num_cities
+    if isinstance(reduction_factor, FactoredReduction):
+      rf_out = self._buffer('rf_step', reduction_factor.batch_shape + (n, n))
+      reduction_factor = reduction_factor.dense(rf_out)
+    if np.ndim(day) == 0:
+      trips_shape = (n, n)
+    else:
+      trips_shape = np.shape(day) + (n, n)
+    if reduction_factor is not None and reduction_factor.ndim > 2:
+      trips_shape = reduction_factor.shape
+    trips = self._buffer('trips', trips_shape)
+    if np.ndim(day) == 0:
+      np.copyto(trips, self.ODs[self._od_row(day)])
+    else:
+      np.take(self.ODs, self.od_day(day), axis=0, out=trips)
+    if reduction_factor is not None:
+      np.multiply(trips, reduction_factor, out=trips)
+
+    # travel: inflow - outflow
+    share = self._buffer('share', states.shape)
+    delta = self._buffer('delta', states.shape)
+    total = self._buffer('total', trips_shape[:-1] + (1,))
+    np.divide(states, self.pops[:, None], out=share)
+    np.matmul(np.swapaxes(trips, -1, -2), share, out=delta)
+    np.sum(trips, axis=-1, keepdims=True, out=total)
+    np.multiply(total, share, out=share)
+    np.subtract(delta, share, out=delta)
+
+    # infection, incubation and recovery
+    infection  = self._buffer('infection', states.shape[:-1])
+    incubation = self._buffer('incubation', states.shape[:-1])
+    recovery   = self._buffer('recovery', states.shape[:-1])
+    change     = self._buffer('change', states.shape[:-1])
+    np.multiply(self.beta_day(day), states[..., I], out=infection)
+    np.multiply(infection, states[..., S], out=infection)
+    np.divide(infection, self.pops, out=infection)
+    np.divide(states[..., E], self.latent, out=incubation)
+    np.multiply(self.gamma, states[..., I], out=recovery)
+    np.subtract(delta[..., S], infection, out=delta[..., S])
+    np.subtract(infection, incubation, out=change)
+    np.add(delta[..., E], change, out=delta[..., E])
+    np.subtract(incubation, recovery, out=change)
+    np.add(delta[..., I], change, out=delta[..., I])
+    np.add(delta[..., R], recovery, out=delta[..., R])
+    return np.add(states, delta, out=out)
+
+  def predict(self, states, day, n_days, reduction_factor=None, out=None):
+    """
+    Advance the model by n_days with a constant reduction factor
+
+    :param states: (np.ndarray) compartments, shape (..., num_cities, 4)
+    :param day: (int or np.ndarray) day index (0 based) of the current state
+    :param n_days: (int) number of days to simulate
+    :param reduction_factor: (np.ndarray or FactoredReduction) multiplier for
+      each OD pair, shape (..., num_cities, num_cities); None means no travel
+      restriction
+    :param out: (np.ndarray) array for the result, may be states itself (see
+      step)
+    :return: (np.ndarray) compartments n_days later
+    """
+    if not self.sparse and isinstance(reduction_factor, FactoredReduction):
+      # expanded once, not every day
+      rf_out = None
+      if out is not None:
+        rf_out = self._buffer('rf', reduction_factor.batch_shape + (self.num_cities, self.num_cities))
+      reduction_factor = reduction_factor.dense(rf_out)
+    for d in range(n_days):
+      states = self.step(states, day + d, reduction_factor, out)
+    return states
+
+  def rollout(self, states, day, n_steps, step_days=1, reduction_factor=None, out=None):
+    """
+    Advance the model by n_steps steps of step_days days with a constant
+    reduction factor, keeping the compartments at the end of every step
+    (each step gives exactly the result of predict with n_days=step_days)
+
+    :param states: (np.ndarray) compartments, shape (..., num_cities, 4)
+    :param day: (int or np.ndarray) day index (0 based) of the current state
+    :param n_steps: (int) number of steps
+    :param step_days: (int) days per step
+    :param reduction_factor: (np.ndarray or FactoredReduction) multiplier for
+      each OD pair, shape (..., num_cities, num_cities); None means no travel
+      restriction
+    :param out: (np.ndarray) array for the result, shape (n_steps,) +
+      states.shape
+    :return: (np.ndarray) compartments after every step, shape (n_steps,) +
+      states.shape
+    """
+    if out is None:
+      out = np.empty((n_steps,) + np.shape(states))
+    if not self.sparse and isinstance(reduction_factor, FactoredReduction):
+      # expanded once for all the steps
+      rf_out = self._buffer('rf', reduction_factor.batch_shape + (self.num_cities, self.num_cities))
+      reduction_factor = reduction_factor.dense(rf_out)
+    for i in range(n_steps):
+      states = self.predict(states, day + i*step_days, step_days, reduction_factor, out=out[i])
+    return out
@@ -4,14 +4,24 @@ skeleton copied from:
     https://stable-baselines.readthedocs.io/en/master/guide/custom_env.html
 """
 
+import sys
+sys.path.append("..")
+
+import os
+
 import gym
 from gym import spaces
 from gym.utils import seeding
 
 import numpy as np
 
-import rpy2.robjects as robjects
-from rpy2.robjects import numpy2ri
+from COVID19_env.sir_model import sir_dopri5, sir_rk4, sir_trajectory
+from COVID19_env.env_state import rng_state, set_rng_state
+from COVID19_env.step_profiler import StepProfiler
+
+# R implementation of the SIR model, used by the 'r' backend
+SIR_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '..', 'COVID19_models', 'SIR', 'SIR_example.R')
 
 class simple_SIR_env(gym.Env):
   """
@@ -31,6 +41,9 @@ class simple_SIR_env(gym.Env):
         1       Infected          0       Total Population
         2       Recovered         0       Total Population
 
+        With stack_days=True: Box(3*action_repeat,), the compartments at the
+        end of every day of the step (see Action repeat)
+
   Actions:
         Type: Discrete(3)
         Num     Action                      Change in model
@@ -58,19 +71,51 @@ class simple_SIR_env(gym.Env):
   Episode Termination:
         Number of infections is zero
         Episode length (time) reaches specified maximum (end time)
+
+  Backends:
+        'native'   adaptive Dormand-Prince integrator in sir_model.py (default)
+        'rk4'      fixed step Runge-Kutta integrator in sir_model.py
+        'r'        sir_func in SIR_example.R, called through rpy2
+
+  Action repeat:
+        With action_repeat=k every step holds the action for k days: the k
+        days are simulated in one call (sir_trajectory) and the reward is the
+        sum of the k daily rewards. The step stops at the first day on which
+        the episode is over; info['days'] is the number of days simulated.
   """
 
 
   metadata = {'render.modes': ['human']}
 
-  def __init__(self, S0, I0, R0, hospitalCapacity):
+  backends = ('native', 'rk4', 'r')
+
+  def __init__(self, S0, I0, R0, hospitalCapacity, backend='native', profile=False,
+               action_repeat=1, stack_days=False):
+    """
+    :param S0: (float) number of susceptibles at time = 0
+    :param I0: (float) number of infectious at time = 0
+    :param R0: (float) number of recovered at time = 0
+    :param hospitalCapacity: (float) maximum number of people in the ICU
+    :param backend: (str) SIR model implementation, see Backends above
+    :param profile: (bool) time the phases of every step, see step_profiler.py
+    :param action_repeat: (int) days per step, see Action repeat above
+    :param stack_days: (bool) observe the compartments of every day of the
+      step instead of the last day only
+    """
     super(simple_SIR_env, self).__init__()
 
+    # SIR model backend
+    if backend not in self.backends:
+      raise ValueError("backend must be one of %s, got %r" % (self.backends, backend))
+    self.backend = backend
+
     # SIR model parameters
     self.beta  = 0.004     # infectious contact rate (/person/day)
     self.gamma = 0.5       # recovery rate (/day)
     self.hospitalCap = hospitalCapacity  # maximum number of people in the ICU
     self.dt = 1            # time step
+    self.action_repeat = int(action_repeat) # days per step
+    self.stack_days = stack_days
 
     # beta variation table, each corresponding to actions 0,1,2 respectively
     self.betaTable = (0.004,0.002,0.001)
@@ -89,6 +134,8 @@ class simple_SIR_env(gym.Env):
     low  = np.array([0,0,0],dtype=np.float64)
     high = np.array([totalPop,totalPop,totalPop],dtype=np.float64)
     self.action_space = spaces.Discrete(3)
+    if stack_days:
+      low, high = np.tile(low, self.action_repeat), np.tile(high, self.action_repeat)
     self.observation_space = spaces.Box(low, high,dtype=np.float64)
 
     # random seed
@@ -97,55 +144,147 @@ class simple_SIR_env(gym.Env):
     # initialize state
     self.state  = None
 
+    # step timers, None unless profiling
+    self._profiler = StepProfiler() if profile else None
+
   def seed(self, seed=None):
     self.np_random, seed = seeding.np_random(seed)
     return [seed]
 
   def step(self, action):
+    profiler = self._profiler
+    if profiler is not None:
+      profiler.start()
 
     # Check for valid action
     err_msg = "%r (%s) invalid" % (action, type(action))
     assert self.action_space.contains(action), err_msg
 
-    # R <--> python conversions
-    numpy2ri.activate() # automatic conversion of numpy objects to rpy2 objects
-    robjects.r('''
-           source('../COVID19_models/SIR/SIR_example.R')
-    ''') # source all R functions in the specified file
-    sir_r = robjects.globalenv['sir_func'] # get R model
-
     # Update model based on actions
     self.beta = self.betaTable[action]
-
-    # Unpack state
-    S0 = self.state[0]
-    I0 = self.state[1]
-    R0 = self.state[2]
-
-    # Plug in SIR model
-    times = np.array([0,self.dt])
-    modelOut = sir_r(self.beta, self.gamma, S0, I0, R0, times)
-    S  = modelOut[1][1]
-    I  = modelOut[1][2]
-    R  = modelOut[1][3]
+    if profiler is not None:
+      profiler.lap('conversion')
+
+    # Plug in SIR model, for action_repeat days
+    if self.backend == 'r':
+      trajectory = np.empty((self.action_repeat, 3))
+      for day in range(self.action_repeat):
+        trajectory[day] = self.state = self._step_r()
+        if trajectory[day, 1] < 0.5:
+          break # episode over
+    else:
+      integrator = sir_rk4 if self.backend == 'rk4' else sir_dopri5
+      trajectory = sir_trajectory(self.state, self.beta, self.gamma, self.dt,
+                                  self.action_repeat, integrator)
+    days = self._days(trajectory)
 
     # Update state
+    S, I, R = trajectory[days-1]
     self.state = (S,I,R)
+    if profiler is not None:
+      profiler.lap('dynamics')
 
-    # Reward
-    healthCost   = -1*I + -10*max(0,I - self.hospitalCap)
+    # Reward, summed over the days of the step
+    It = trajectory[:days, 1]
+    healthCost   = -1*It + -10*np.maximum(0,It - self.hospitalCap)
     economicCost = self.economicCost[action]
-    reward = healthCost + economicCost
+    reward = (healthCost + economicCost).sum()
+    if profiler is not None:
+      profiler.lap('reward')
 
     # Observation
-    observation = np.array(self.state)
+    if self.stack_days:
+      trajectory[days:] = trajectory[days-1] # the episode ended early
+      observation = trajectory.reshape(-1)
+    else:
+      observation = np.array(self.state)
 
     # Check if episode is over
     done = bool(
         I < 0.5
     )
 
-    return observation, reward, done, {}
+    info = {'days': days}
+    if profiler is not None:
+      profiler.lap('observation')
+      info['profile'] = profiler.stop()
+    return observation, reward, done, info
+
+  def _days(self, trajectory):
+    # days until (and including) the first one with no infections left
+    over = trajectory[:, 1] < 0.5
+    if over.any():
+      return int(np.argmax(over)) + 1
+    return len(trajectory)
+
+  def _observe(self):
+    if self.stack_days:
+      return np.tile(np.array(self.state, dtype=np.float64), self.action_repeat)
+    return np.array(self.state)
+
+  def _step_r(self):
+    from COVID19_env.r_models import activate_numpy2ri, sourced_function
+
+    # R <--> python conversions
+    activate_numpy2ri() # automatic conversion of numpy objects to rpy2 objects
+    sir_r = sourced_function(SIR_MODEL_PATH, 'sir_func') # get R model (sourced once per process)
+
+    # Unpack state
+    S0 = self.state[0]
+    I0 = self.state[1]
+    R0 = self.state[2]
+
+    # Plug in SIR model
+    times = np.array([0,self.dt])
+    if self._profiler is not None:
+      self._profiler.lap('conversion')
+    modelOut = sir_r(self.beta, self.gamma, S0, I0, R0, times)
+    if self._profiler is not None:
+      self._profiler.lap('dynamics')
+    S  = modelOut[1][1]
+    I  = modelOut[1][2]
+    R  = modelOut[1][3]
+    if self._profiler is not None:
+      self._profiler.lap('conversion')
+    return S, I, R
+
+  def profile_stats(self):
+    """
+    :return: (dict) step timers since the last reset_profile_stats (see
+      StepProfiler.stats), None if the env was created without profile=True
+    """
+    if self._profiler is None:
+      return None
+    return self._profiler.stats()
+
+  def reset_profile_stats(self):
+    if self._profiler is not None:
+      self._profiler.reset()
+
+  def get_state(self):
+    """
+    Snapshot of the episode, for branching rollouts (restore it with
+    set_state, here or in any simple_SIR_env / simple_SIR_vec_env replica)
+
+    :return: (dict) picklable snapshot: SIR compartments, beta and RNG state
+    """
+    return {'state': np.array(self.state, dtype=np.float64),
+            'beta': self.beta,
+            'rng': rng_state(self.np_random)}
+
+  def set_state(self, state):
+    """
+    Continue from a snapshot returned by get_state
+
+    :param state: (dict) snapshot
+    :return: (np.ndarray) observation of the restored state
+    """
+    S, I, R = state['state']
+    self.state = (S, I, R)
+    self.beta  = state['beta']
+    if 'rng' in state:
+      set_rng_state(self.np_random, state['rng'])
+    return self._observe()
 
   def reset(self):
     # reset to initial conditions
@@ -154,5 +293,5 @@ class simple_SIR_env(gym.Env):
     R = self.R0
     self.beta  = 0.004
     self.state = (S,I,R)
-    observation = np.array(self.state)
+    observation = self._observe()
     return observation  # reward, done, info can't be included
@@ -0,0 +1,219 @@
+"""
+vectorized version of simple_SIR_env
+
+Follows the Stable Baselines VecEnv interface:
+    https://stable-baselines.readthedocs.io/en/master/guide/vec_envs.html
+"""
+import sys
+sys.path.append("..")
+
+from gym import spaces
+from gym.utils import seeding
+
+import numpy as np
+
+from stable_baselines.common.vec_env import VecEnv
+
+from COVID19_env.sir_model import sir_dopri5, sir_rk4
+
+class simple_SIR_vec_env(VecEnv):
+  """
+  Description:
+        num_envs copies of simple_SIR_env advanced together in one process.
+        The states of all environments are held in a single (num_envs, 3)
+        array and every step is one vectorized update of that array, so there
+        is no per-environment Python object and nothing is sent through pipes.
+
+        Observations, actions, rewards and the episode termination rule are
+        the same as in simple_SIR_env. Environments whose episode is over are
+        reset automatically, and the last observation of the episode is
+        returned in info['terminal_observation'] (same as DummyVecEnv).
+
+  Backends:
+        'native'   adaptive Dormand-Prince integrator in sir_model.py (default)
+        'rk4'      fixed step Runge-Kutta integrator in sir_model.py
+  """
+
+  backends = ('native', 'rk4')
+
+  def __init__(self, num_envs, S0, I0, R0, hospitalCapacity, backend='native',
+               max_steps=None):
+    """
+    :param num_envs: (int) number of environments
+    :param S0: (float or np.ndarray) number of susceptibles at time = 0, per env
+    :param I0: (float or np.ndarray) number of infectious at time = 0, per env
+    :param R0: (float or np.ndarray) number of recovered at time = 0, per env
+    :param hospitalCapacity: (float or np.ndarray) maximum number of people in
+      the ICU, per env
+    :param backend: (str) SIR integrator, see Backends above
+    :param max_steps: (int) episode length limit in days, None for no limit
+    """
+    if backend not in self.backends:
+      raise ValueError("backend must be one of %s, got %r" % (self.backends, backend))
+    self.backend = backend
+
+    # SIR model parameters
+    self.gamma = 0.5       # recovery rate (/day)
+    self.dt = 1            # time step
+    self.hospitalCap = np.broadcast_to(np.asarray(hospitalCapacity, dtype=np.float64), (num_envs,))
+    self.max_steps = max_steps
+
+    # beta variation table, each corresponding to actions 0,1,2 respectively
+    self.betaTable = np.array((0.004,0.002,0.001))
+
+    # Economic cost table, each corresponding to actions 0,1,2 respectively
+    self.economicCost = np.array((0,-10,-100),dtype=np.float64)
+
+    # SIR model initial conditions, one row per env
+    self.state0 = np.empty((num_envs, 3))
+    self.state0[:, 0] = S0
+    self.state0[:, 1] = I0
+    self.state0[:, 2] = R0
+
+    # Define action and observation space
+    totalPop = self.state0.sum(axis=1).max()
+    low  = np.array([0,0,0],dtype=np.float64)
+    high = np.array([totalPop,totalPop,totalPop],dtype=np.float64)
+    action_space = spaces.Discrete(3)
+    observation_space = spaces.Box(low, high,dtype=np.float64)
+    VecEnv.__init__(self, num_envs, observation_space, action_space)
+
+    # random seed
+    self.seed()
+
+    # initialize state
+    self.state = self.state0.copy()
+    self.beta = np.full(num_envs, self.betaTable[0])
+    self.n_steps = np.zeros(num_envs, dtype=np.int64)
+    self.actions = None
+
+  def seed(self, seed=None):
+    self.np_random, seed = seeding.np_random(seed)
+    return [seed]
+
+  def step_async(self, actions):
+    self.actions = np.asarray(actions, dtype=np.int64).reshape(self.num_envs)
+
+  def step_wait(self):
+    actions = self.actions
+    assert ((actions >= 0) & (actions < 3)).all(), "%r invalid" % (actions,)
+
+    # Update model based on actions
+    self.beta = self.betaTable[actions]
+
+    # Plug in SIR model
+    if self.backend == 'rk4':
+      self.state = sir_rk4(self.state, self.beta, self.gamma, self.dt)
+    else:
+      self.state = sir_dopri5(self.state, self.beta, self.gamma, self.dt)
+    self.n_steps += 1
+    I = self.state[:, 1]
+
+    # Reward
+    healthCost   = -1*I + -10*np.maximum(0, I - self.hospitalCap)
+    economicCost = self.economicCost[actions]
+    rewards = healthCost + economicCost
+
+    # Check which episodes are over
+    dones = I < 0.5
+    if self.max_steps is not None:
+      dones |= self.n_steps >= self.max_steps
+
+    # Observation, with finished envs reset to their initial conditions
+    observations = self.state.copy()
+    infos = [{} for _ in range(self.num_envs)]
+    for i in np.flatnonzero(dones):
+      infos[i]['terminal_observation'] = observations[i].copy()
+    self._reset_envs(dones)
+    observations[dones] = self.state[dones]
+
+    return observations, rewards, dones, infos
+
+  def _reset_envs(self, mask):
+    self.state[mask] = self.state0[mask]
+    self.beta[mask] = self.betaTable[0]
+    self.n_steps[mask] = 0
+
+  def reset(self):
+    self._reset_envs(slice(None))
+    return self.state.copy()
+
+  def get_states(self, indices=None):
+    """
+    Snapshots of environments, same format as simple_SIR_env.get_state (the
+    generator is shared by all environments and is not part of them)
+
+    :param indices: (None, int, Iterable) environments, all by default
+    :return: (list) one snapshot dict per environment
+    """
+    return [{'state': self.state[i].copy(), 'beta': float(self.beta[i]),
+             'n_steps': int(self.n_steps[i])} for i in self._get_indices(indices)]
+
+  def set_states(self, states, indices=None):
+    """
+    Restore snapshots into environments in one vectorized assignment, e.g. to
+    branch one state of simple_SIR_env into all environments
+
+    :param states: (dict or list) one snapshot for all the environments, or
+      one per environment (from get_state or get_states)
+    :param indices: (None, int, Iterable) environments, all by default
+    :return: (np.ndarray) observations of the restored environments
+    """
+    indices = list(self._get_indices(indices))
+    if isinstance(states, dict):
+      states = [states]*len(indices)
+    self.state[indices] = np.array([s['state'] for s in states], dtype=np.float64)
+    self.beta[indices] = [s['beta'] for s in states]
+    self.n_steps[indices] = [s.get('n_steps', 0) for s in states]
+    return self.state[indices].copy()
+
+  def close(self):
+    pass
+
+  def get_attr(self, attr_name, indices=None):
+    value = getattr(self, attr_name)
+    indices = self._get_indices(indices)
+    if isinstance(value, np.ndarray) and value.shape[:1] == (self.num_envs,):
+      return [value[i] for i in indices]
+    return [value for _ in indices]
+
+  def set_attr(self, attr_name, value, indices=None):
+    current = getattr(self, attr_name)
+    if isinstance(current, np.ndarray) and current.shape[:1] == (self.num_envs,):
+      current = current.copy()
+      current[self._get_indices(indices)] = value
+      value = current
+    setattr(self, attr_name, value)
+
+  def profile_stats(self):
+    """
+    The batched env has no step timers (only the single env does, see
+    step_profiler.py), so ProfilingCallback logs nothing for it
+
+    :return: None
+    """
+    return None
+
+  def reset_profile_stats(self):
+    pass
+
+  def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+    """
+    Call a method of the batched env. There are no per-replica env objects:
+    the method is called once, on the whole batch, so indices must select
+    every replica (a subset of the replicas raises ValueError).
+
+    :param method_name: (str) name of a method of simple_SIR_vec_env
+    :param indices: (None, int, Iterable) replicas, all by default
+    :return: (list) the result, once per index
+    """
+    method = getattr(type(self), method_name, None)
+    if not callable(method):
+      raise AttributeError("simple_SIR_vec_env has no method %r (env_method calls methods of the "
+                           "batched env, not of single env replicas)" % method_name)
+    indices = list(self._get_indices(indices))
+    if sorted(indices) != list(range(self.num_envs)):
+      raise ValueError("simple_SIR_vec_env.env_method calls %r once on the whole batch, indices must "
+                       "select all %d replicas, got %s" % (method_name, self.num_envs, indices))
+    result = getattr(self, method_name)(*method_args, **method_kwargs)
+    return [result for _ in indices]
@@ -0,0 +1,131 @@
+"""
+native python implementation of the SIR model in SIR_example.R
+
+The R model (sir_func) hands the SIR equations to deSolve's `ode`. The
+integrators below solve the same equations with numpy only, so the
+simple_SIR_env environment can run without an R installation.
+
+All functions work on a state array of shape (..., 3) holding (S, I, R) along
+the last axis, so one call can advance a single state or a whole batch.
+"""
+
+import numpy as np
+
+# Dormand-Prince 5(4) coefficients
+_DP_C = (0., 1/5, 3/10, 4/5, 8/9, 1., 1.)
+_DP_A = ((),
+         (1/5,),
+         (3/40, 9/40),
+         (44/45, -56/15, 32/9),
+         (19372/6561, -25360/2187, 64448/6561, -212/729),
+         (9017/3168, -355/33, 46732/5247, 49/176, -5103/18656),
+         (35/384, 0., 500/1113, 125/192, -2187/6784, 11/84))
+_DP_B = _DP_A[6] + (0.,)
+_DP_E = (71/57600, 0., -71/16695, 71/1920, -17253/339200, 22/525, -1/40)
+
+
+def sir_derivatives(state, beta, gamma):
+  """
+  Right hand side of the SIR equations (same as sir_equations in SIR_example.R)
+
+  :param state: (np.ndarray) compartments (S, I, R) along the last axis
+  :param beta: (float or np.ndarray) infectious contact rate (/person/day)
+  :param gamma: (float or np.ndarray) recovery rate (/day)
+  :return: (np.ndarray) (dS, dI, dR) with the same shape as state
+  """
+  S = state[..., 0]
+  I = state[..., 1]
+  infection = beta * I * S
+  recovery  = gamma * I
+  return np.stack((-infection, infection - recovery, recovery), axis=-1)
+
+
+def sir_rk4(state, beta, gamma, dt, n_substeps=20):
+  """
+  Integrate the SIR equations over dt with fixed step classical Runge-Kutta
+
+  :param state: (np.ndarray) compartments (S, I, R) along the last axis
+  :param beta: (float or np.ndarray) infectious contact rate (/person/day)
+  :param gamma: (float or np.ndarray) recovery rate (/day)
+  :param dt: (float) length of the time interval (days)
+  :param n_substeps: (int) number of RK4 steps used to cover dt
+  :return: (np.ndarray) compartments at the end of the interval
+  """
+  y = np.asarray(state, dtype=np.float64)
+  h = dt / n_substeps
+  for _ in range(n_substeps):
+    k1 = sir_derivatives(y, beta, gamma)
+    k2 = sir_derivatives(y + 0.5*h*k1, beta, gamma)
+    k3 = sir_derivatives(y + 0.5*h*k2, beta, gamma)
+    k4 = sir_derivatives(y + h*k3, beta, gamma)
+    y = y + h/6*(k1 + 2*k2 + 2*k3 + k4)
+  return y
+
+
+def sir_dopri5(state, beta, gamma, dt, rtol=1e-6, atol=1e-6, max_steps=10000):
+  """
+  Integrate the SIR equations over dt with an adaptive Dormand-Prince 5(4)
+  scheme. The default tolerances are the ones deSolve's `ode` uses for
+  sir_func, so results agree with the R model to within those tolerances.
+
+  For a batch of states a single step size is shared by every member of the
+  batch and is chosen by the worst local error.
+
+  :param state: (np.ndarray) compartments (S, I, R) along the last axis
+  :param beta: (float or np.ndarray) infectious contact rate (/person/day)
+  :param gamma: (float or np.ndarray) recovery rate (/day)
+  :param dt: (float) length of the time interval (days)
+  :param rtol: (float) relative error tolerance
+  :param atol: (float) absolute error tolerance
+  :param max_steps: (int) maximum number of accepted and rejected steps
+  :return: (np.ndarray) compartments at the end of the interval
+  """
+  y = np.asarray(state, dtype=np.float64)
+  t = 0.
+  h = dt / 10
+  k = [None]*7
+  k[0] = sir_derivatives(y, beta, gamma)
+  for _ in range(max_steps):
+    if t >= dt:
+      return y
+    h = min(h, dt - t)
+
+    # Runge-Kutta stages
+    for i in range(1, 7):
+      dy = sum(a*kj for a, kj in zip(_DP_A[i], k) if a != 0.)
+      k[i] = sir_derivatives(y + h*dy, beta, gamma)
+    y_new = y + h*sum(b*kj for b, kj in zip(_DP_B, k) if b != 0.)
+
+    # Local error estimate (root mean square over all compartments)
+    err = h*sum(e*kj for e, kj in zip(_DP_E, k) if e != 0.)
+    scale = atol + rtol*np.maximum(np.abs(y), np.abs(y_new))
+    err_norm = np.sqrt(np.mean((err/scale)**2, axis=-1)).max()
+
+    if err_norm <= 1.:
+      t += h
+      y = y_new
+      k[0] = k[6] # first same as last
+    h *= min(5., max(0.2, 0.9*(err_norm + 1e-16)**-0.2))
+  raise RuntimeError("sir_dopri5 did not reach t=%g in %d steps" % (dt, max_steps))
+
+
+def sir_trajectory(state, beta, gamma, dt, n_steps, integrator=sir_dopri5):
+  """
+  Integrate the SIR equations over n_steps consecutive intervals of length
+  dt with the same parameters, keeping the state at the end of every interval
+  (each interval is integrated exactly as a separate call of the integrator)
+
+  :param state: (np.ndarray) compartments (S, I, R) along the last axis
+  :param beta: (float or np.ndarray) infectious contact rate (/person/day)
+  :param gamma: (float or np.ndarray) recovery rate (/day)
+  :param dt: (float) length of each interval (days)
+  :param n_steps: (int) number of intervals
+  :param integrator: (callable) sir_dopri5 or sir_rk4
+  :return: (np.ndarray) compartments after every interval, shape
+    (n_steps,) + state.shape
+  """
+  y = np.asarray(state, dtype=np.float64)
+  trajectory = np.empty((n_steps,) + y.shape)
+  for i in range(n_steps):
+    y = trajectory[i] = integrator(y, beta, gamma, dt)
+  return trajectory
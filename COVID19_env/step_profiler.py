@@ -0,0 +1,94 @@
+"""
+opt-in timers of the phases of an environment step
+
+With profile=True, simple_SIR_env and SEIR_env time every step in four
+phases and return the times of the step in info['profile'] (seconds):
+    conversion    action to model inputs (beta, reduction factors) and,
+                  with the R backend, numpy <--> R conversions
+    dynamics      the SIR / SEIR model
+    reward        health and economic cost
+    observation   building the observation and the done flag
+The totals since the last reset_profile_stats are returned by
+env.profile_stats(). A step costs a handful of perf_counter calls when
+profiling is on and one `is None` check per phase when it is off.
+
+COVID19_agents/callbacks.py has a Stable Baselines callback that collects
+the stats of every worker (env_method) and writes them to TensorBoard.
+"""
+import time
+
+PHASES = ('conversion', 'dynamics', 'reward', 'observation')
+
+
+class StepProfiler(object):
+  """
+  Per-phase timers and counters of env steps
+  """
+
+  def __init__(self):
+    self.last = dict.fromkeys(PHASES, 0.)
+    self.reset()
+
+  def reset(self):
+    self.steps = 0
+    self.totals = dict.fromkeys(PHASES, 0.)
+    self.calls = dict.fromkeys(PHASES, 0)
+    self._time = None
+
+  def start(self):
+    """
+    Start timing a step
+    """
+    for phase in PHASES:
+      self.last[phase] = 0.
+    self._time = time.perf_counter()
+
+  def lap(self, phase):
+    """
+    Charge the time since the last start / lap to a phase
+
+    :param phase: (str) one of PHASES
+    """
+    now = time.perf_counter()
+    self.last[phase] += now - self._time
+    self.calls[phase] += 1
+    self._time = now
+
+  def stop(self):
+    """
+    End the step
+
+    :return: (dict) seconds spent in every phase during the step
+    """
+    self.steps += 1
+    for phase, seconds in self.last.items():
+      self.totals[phase] += seconds
+    return dict(self.last)
+
+  def stats(self):
+    """
+    :return: (dict) number of steps, and per phase the total seconds, the
+      mean milliseconds per step and the number of timed calls
+    """
+    stats = {'steps': self.steps}
+    for phase in PHASES:
+      stats[phase] = {'total_s': self.totals[phase],
+                      'mean_ms': 1e3*self.totals[phase]/max(self.steps, 1),
+                      'calls': self.calls[phase]}
+    return stats
+
+
+def merge_stats(stats):
+  """
+  Combine the stats of several environments (e.g. the workers of a VecEnv)
+
+  :param stats: (list) dicts returned by StepProfiler.stats
+  :return: (dict) stats of all the steps
+  """
+  steps = sum(s['steps'] for s in stats)
+  merged = {'steps': steps}
+  for phase in PHASES:
+    total = sum(s[phase]['total_s'] for s in stats)
+    merged[phase] = {'total_s': total, 'mean_ms': 1e3*total/max(steps, 1),
+                     'calls': sum(s[phase]['calls'] for s in stats)}
+  return merged
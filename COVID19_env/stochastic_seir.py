@@ -0,0 +1,207 @@
+"""
+stochastic version of the SEIR model in seir_model.py
+
+StochasticSEIRModel advances integer numbers of people with a daily chain
+binomial scheme, in place of the expected values of SEIRModel:
+    S -> E    Binomial(S, 1 - exp(-beta*I/pop))
+    E -> I    Binomial(E, 1 - exp(-1/latent))
+    I -> R    Binomial(I, 1 - exp(-gamma))
+and then moves the people of every compartment between cities: each person
+of city i takes a flight to city j with probability trips[i, j]/pop_i, i.e.
+the people of a compartment are split between the destinations and staying
+with one multinomial draw. On average a day is the same as a day of
+SEIRModel, up to the exp(-rate) probabilities.
+
+Every replica (batch member) has its own counter-based random stream: a
+numpy Philox generator keyed by (seed, replica) whose counter is set to
+(day, episode) before each day is drawn. The numbers of a replica on a given
+day are therefore a function of the seed, the replica index, the episode and
+the day only; they do not depend on the other replicas, on how the replicas
+are split between processes, or on the days simulated before. SEIR_env
+(replica=i) and row i - replica_offset of SEIR_vec_env give the same episodes.
+
+The probabilities and the bookkeeping are computed for the whole batch at
+once; the draws take one binomial and one multinomial call per replica and
+day, each covering all cities and compartments.
+"""
+import sys
+sys.path.append("..")
+
+import numpy as np
+
+from COVID19_env.seir_model import (SEIRModel, FactoredReduction, _on_edges, _dense, _batch_ndim,
+                                    S, E, I, R)
+
+
+def replica_keys(seed, replicas):
+  """
+  Philox keys of the replica streams
+
+  :param seed: (int) seed shared by all replicas (e.g. from env.seed)
+  :param replicas: (int or np.ndarray) index of each replica
+  :return: (np.ndarray) keys, shape (num_replicas, 2), dtype uint64
+  """
+  seed = int(seed)
+  seed64 = (seed ^ (seed >> 64)) & 0xFFFFFFFFFFFFFFFF # gym seeds can be 128 bit
+  replicas = np.atleast_1d(np.asarray(replicas, dtype=np.uint64))
+  keys = np.empty((len(replicas), 2), dtype=np.uint64)
+  keys[:, 0] = seed64
+  keys[:, 1] = replicas
+  return keys
+
+
+class StochasticSEIRModel(SEIRModel):
+  """
+  Chain binomial metapopulation SEIR model, see the module docstring. The
+  arguments are the ones of SEIRModel; the replica streams are set with
+  set_replicas before the first step.
+
+  States hold whole numbers of people (as float64, like SEIRModel states).
+  Fractional states, e.g. the initial conditions, are rounded on the first
+  step.
+  """
+
+  def __init__(self, beta, latent, gamma, ODs, pops):
+    super(StochasticSEIRModel, self).__init__(beta, latent, gamma, ODs, pops)
+    self.keys = None
+    self.episode = None
+    self._generators = []
+
+  def set_replicas(self, seed, replicas):
+    """
+    :param seed: (int) seed shared by all replicas
+    :param replicas: (int or np.ndarray) index of each replica (batch member),
+      unique across all the processes of a run
+    """
+    self.keys = replica_keys(seed, replicas)
+    self.episode = np.zeros(len(self.keys), dtype=np.int64)
+    self._generators = [np.random.Generator(np.random.Philox(key=key)) for key in self.keys]
+
+  def generators(self, day):
+    """
+    Position the replica streams at the start of a day
+
+    :param day: (np.ndarray) day index (0 based) of each replica
+    :return: (list) np.random.Generator of each replica
+    """
+    for generator, key, d, episode in zip(self._generators, self.keys, day, self.episode):
+      generator.bit_generator.state = {
+          'bit_generator': 'Philox',
+          'state': {'counter': np.array([0, d, episode, 0], dtype=np.uint64), 'key': key},
+          'buffer': np.zeros(4, dtype=np.uint64), 'buffer_pos': 4,
+          'has_uint32': 0, 'uinteger': 0}
+    return self._generators
+
+  def step(self, states, day, reduction_factor=None, out=None):
+    """
+    Advance the model by one day with random transitions and travel
+
+    :param states: (np.ndarray) compartments, shape (..., num_cities, 4),
+      with one replica per batch member
+    :param day: (int or np.ndarray) day index (0 based) of the current state,
+      either shared by the batch or of shape (...,)
+    :param reduction_factor: (np.ndarray or FactoredReduction) multiplier for
+      each OD pair, shape (..., num_cities, num_cities); None means no travel
+      restriction
+    :param out: (np.ndarray) array for the result, may be states itself
+    :return: (np.ndarray) compartments on the next day
+    """
+    shape = np.shape(states)
+    batch = shape[:-2]
+    n_batch = int(np.prod(batch))
+    if self.keys is None or len(self.keys) != n_batch:
+      raise ValueError("StochasticSEIRModel needs set_replicas with one replica per batch member "
+                       "(%d), got %s" % (n_batch, None if self.keys is None else len(self.keys)))
+    n = self.num_cities
+    counts = np.rint(states).reshape(n_batch, n, 4)
+    days = np.broadcast_to(day, batch).reshape(n_batch)
+    generators = self.generators(days)
+
+    # S -> E, E -> I and I -> R, one binomial draw per replica
+    p = np.empty((n_batch, n, 3))
+    p[..., 0] = self.beta_day(days) * counts[..., I] / self.pops
+    p[..., 1] = 1 / self.latent
+    p[..., 2] = self.gamma
+    np.negative(np.expm1(-p), out=p)
+    people = counts[..., :3].astype(np.int64)
+    moves = np.empty((n_batch, n, 3))
+    for b, generator in enumerate(generators):
+      moves[b] = generator.binomial(people[b], p[b])
+    counts[..., S] -= moves[..., 0]
+    counts[..., E] += moves[..., 0] - moves[..., 1]
+    counts[..., I] += moves[..., 1] - moves[..., 2]
+    counts[..., R] += moves[..., 2]
+
+    # travel, grouped by OD day
+    factor = reduction_factor
+    if factor is not None and _batch_ndim(factor) > 0:
+      factor = _flatten_batch(factor, n_batch)
+    od_days = self.od_day(days)
+    if np.all(od_days == od_days[0]):
+      counts = self._travel(counts, generators, int(od_days[0]), factor)
+    else:
+      for d in np.unique(od_days):
+        members = np.flatnonzero(od_days == d)
+        member_factor = factor
+        if factor is not None and _batch_ndim(factor) > 0:
+          member_factor = factor[members]
+        counts[members] = self._travel(counts[members], [generators[b] for b in members],
+                                       int(d), member_factor)
+
+    counts = counts.reshape(shape)
+    if out is None:
+      return counts
+    np.copyto(out, counts)
+    return out
+
+  def _travel(self, counts, generators, od_day, reduction_factor):
+    # multinomial split of every compartment of every city between the
+    # destinations (columns 0..width-1) and staying (last column)
+    n_batch, n = len(counts), self.num_cities
+    if self.sparse:
+      origin, dest, trips = self.ODs.edges(od_day)
+      if reduction_factor is not None:
+        trips = trips * _on_edges(reduction_factor, origin, dest)
+      # column of each flow: its rank among the flows of its origin
+      column = np.arange(len(origin)) - np.searchsorted(origin, origin)
+      width = int(column.max()) + 1 if len(origin) else 0
+      prob = np.zeros((n_batch, n, width + 1))
+      prob[:, origin, column] = trips / self.pops[origin]
+    else:
+      trips = self.ODs[od_day]
+      if reduction_factor is not None:
+        trips = trips * _dense(reduction_factor)
+      width = n
+      prob = np.zeros((n_batch, n, n + 1))
+      prob[..., :n] = trips / self.pops[:, None]
+    leaving = prob[..., :width].sum(axis=-1)
+    over = leaving > 1 # more trips than people
+    if over.any():
+      prob[over, :width] /= leaving[over][:, None]
+      leaving[over] = 1
+    prob[..., width] = np.maximum(0., 1 - leaving)
+
+    people = counts.astype(np.int64)
+    movers = np.empty((n_batch, n, 4, width + 1))
+    for b, generator in enumerate(generators):
+      movers[b] = generator.multinomial(people[b], prob[b][:, None, :])
+
+    # (batch, origin, compartment, column) -> arrivals per destination
+    if self.sparse:
+      offset = (np.arange(n_batch)*n)[:, None]
+      bins = ((offset + dest)[:, :, None]*4 + np.arange(4)).ravel()
+      arriving = np.moveaxis(movers[:, origin, :, column], 0, 1) # (batch, flow, compartment)
+      inflow = np.bincount(bins, arriving.ravel(), minlength=n_batch*n*4).reshape(n_batch, n, 4)
+    else:
+      inflow = np.swapaxes(movers[..., :n].sum(axis=1), 1, 2)
+    return movers[..., width] + inflow
+
+
+def _flatten_batch(reduction_factor, n_batch):
+  # reduction factors with a single batch dimension, to select replicas
+  if isinstance(reduction_factor, FactoredReduction):
+    U, V = reduction_factor.U, reduction_factor.V
+    if V.ndim > 2:
+      V = V.reshape((n_batch,) + V.shape[-2:])
+    return FactoredReduction(U.reshape((n_batch,) + U.shape[-2:]), V)
+  return reduction_factor.reshape((n_batch,) + reduction_factor.shape[-2:])
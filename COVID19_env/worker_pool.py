@@ -0,0 +1,105 @@
+"""
+warm environment workers forked from a preloaded fork server
+
+SubprocVecEnv starts its workers with the 'forkserver' method, so every worker
+imports numpy, gym, stable_baselines (TensorFlow), the script that started
+the run and, with the R backend, starts an embedded R and loads the models
+again. With 64 workers that takes tens of seconds. Here the fork server
+imports all of it (and warms up the selected engine) once, before the first
+worker is started, and every worker is a fork of that warm process:
+    from COVID19_env.worker_pool import subproc_vec_env
+    env = subproc_vec_env([make_env(i) for i in range(64)], engine='native')
+
+The fork server is started once per process: call start_fork_server (or
+subproc_vec_env) before any other use of the 'forkserver' start method.
+"""
+import sys
+sys.path.append("..")
+
+import multiprocessing
+import multiprocessing.forkserver
+import os
+
+# modules imported by the fork server, for each engine (env backend)
+ENGINE_MODULES = {
+  'native': ('numpy', 'gym', 'COVID19_env.sir_model', 'COVID19_env.seir_model',
+             'COVID19_env.seir_inputs', 'COVID19_env.simple_SIR_env', 'COVID19_env.SEIR_env'),
+  'r': ('numpy', 'gym', 'COVID19_env.sir_model', 'COVID19_env.seir_model',
+        'COVID19_env.seir_inputs', 'COVID19_env.simple_SIR_env', 'COVID19_env.SEIR_env',
+        'rpy2.robjects', 'COVID19_env.r_models'),
+}
+
+# worker loop of SubprocVecEnv
+VEC_ENV_MODULE = 'stable_baselines.common.vec_env.subproc_vec_env'
+
+# tells the fork server which engine to warm up when it imports this module
+ENGINE_VARIABLE = 'COVID19_WORKER_ENGINE'
+
+
+def warm_up(engine):
+  """
+  Load what the first step of an env would load (called in the fork server)
+
+  :param engine: (str) 'native' or 'r'
+  """
+  if engine != 'r':
+    return
+  from COVID19_env.r_models import activate_numpy2ri, package_function, sourced_function
+  from COVID19_env.SEIR_env import SEIR_MODEL_DIR
+  from COVID19_env.simple_SIR_env import SIR_MODEL_PATH
+
+  activate_numpy2ri()
+  if os.path.exists(SIR_MODEL_PATH):
+    sourced_function(SIR_MODEL_PATH, 'sir_func')
+  if os.path.exists(SEIR_MODEL_DIR + 'seir_r.R'):
+    package_function(SEIR_MODEL_DIR + 'seir_r.R', 'seirPredictions')
+
+
+def start_fork_server(engine='native', preload_main=True, modules=()):
+  """
+  Start the fork server of this process with the engine preloaded (the
+  preloading runs in the background while the caller continues)
+
+  :param engine: (str) env backend of the workers, a key of ENGINE_MODULES
+  :param preload_main: (bool) also import the script that started the run
+    (as the workers would), guarded by `if __name__ == "__main__"` as usual
+  :param modules: (list) other modules the workers need
+  """
+  if engine not in ENGINE_MODULES:
+    raise ValueError("engine must be one of %s, got %r" % (sorted(ENGINE_MODULES), engine))
+  preload = list(ENGINE_MODULES[engine]) + [VEC_ENV_MODULE] + list(modules) + [__name__]
+  if preload_main:
+    preload.insert(0, '__main__')
+  multiprocessing.set_forkserver_preload(preload)
+
+  # the server inherits the environment when it is started
+  previous = os.environ.get(ENGINE_VARIABLE)
+  os.environ[ENGINE_VARIABLE] = engine
+  try:
+    multiprocessing.forkserver.ensure_running()
+  finally:
+    if previous is None:
+      del os.environ[ENGINE_VARIABLE]
+    else:
+      os.environ[ENGINE_VARIABLE] = previous
+
+
+def subproc_vec_env(env_fns, engine='native', preload_main=True, modules=()):
+  """
+  SubprocVecEnv whose workers are forked from the warm fork server
+
+  :param env_fns: (list) functions creating the envs, as for SubprocVecEnv
+  :param engine: (str) env backend of the workers, a key of ENGINE_MODULES
+  :param preload_main: (bool) see start_fork_server
+  :param modules: (list) see start_fork_server
+  :return: (SubprocVecEnv) the vectorized environment
+  """
+  from stable_baselines.common.vec_env import SubprocVecEnv
+
+  start_fork_server(engine, preload_main, modules)
+  return SubprocVecEnv(env_fns, start_method='forkserver')
+
+
+# in the fork server: warm up the engine once, every worker inherits it
+if os.environ.get(ENGINE_VARIABLE):
+  warm_up(os.environ[ENGINE_VARIABLE])
@@ -0,0 +1,74 @@
+"""
+binary checkpoints of the particle filter posterior
+
+Each day's posterior is stored as .npy files next to the csv outputs of the R
+script:
+    particles/<day>.npy     (num_particles, num_cities)
+    states/<day>.npy        (num_particles, num_cities, 4)
+    weights/<day>.npy       (num_particles, num_cities) log weights, only
+                            when the particles are not equally weighted
+The arrays are written with a single bulk write and read back with memory
+mapping, so opening any day's posterior costs no parsing and only the pages
+that are used are read from disk.
+"""
+import os
+
+import numpy as np
+
+
+def _path(data_path, folder, a_day):
+  return os.path.join(data_path, folder, '%d.npy' % a_day)
+
+
+def _save(path, array):
+  # write to a temporary file first so readers never see a partial checkpoint
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'wb') as f:
+    np.save(f, np.ascontiguousarray(array))
+  os.replace(tmp_path, path)
+
+
+def write_npy(data_path, a_day, particles, states, log_weights=None):
+  """
+  Store a day's posterior as particles/<day>.npy and states/<day>.npy (and
+  weights/<day>.npy if the particles are not equally weighted). Same
+  signature as SEIR_estimation.write_csv, so either can be used as the
+  estimation output.
+  """
+  _save(_path(data_path, 'particles', a_day), particles)
+  _save(_path(data_path, 'states', a_day), states)
+  weights_path = _path(data_path, 'weights', a_day)
+  if log_weights is not None and np.ptp(log_weights, axis=0).any():
+    _save(weights_path, log_weights)
+  elif os.path.exists(weights_path):
+    os.remove(weights_path) # left over from an earlier run
+
+
+def load_day(data_path, a_day, mmap_mode='r'):
+  """
+  Open a day's posterior
+
+  :param data_path: (str) directory holding particles/, states/ (and weights/)
+  :param a_day: (int) day of the posterior (1 = Jan 21)
+  :param mmap_mode: (str) np.load memory map mode, None to read into memory
+  :return: (np.ndarray, np.ndarray, np.ndarray) particles, states and log
+    weights (None when the particles are equally weighted)
+  """
+  particles = np.load(_path(data_path, 'particles', a_day), mmap_mode=mmap_mode)
+  states = np.load(_path(data_path, 'states', a_day), mmap_mode=mmap_mode)
+  weights_path = _path(data_path, 'weights', a_day)
+  log_weights = np.load(weights_path, mmap_mode=mmap_mode) if os.path.exists(weights_path) else None
+  return particles, states, log_weights
+
+
+def export_csv(data_path, a_day):
+  """
+  Write the csv files of a stored day (same layout as the R script)
+
+  :param data_path: (str) directory holding the checkpoints
+  :param a_day: (int) day of the posterior (1 = Jan 21)
+  """
+  from COVID19_models.SEIR_estimation import write_csv
+  particles, states, log_weights = load_day(data_path, a_day)
+  write_csv(data_path, a_day, particles, states, log_weights)
@@ -0,0 +1,167 @@
+"""
+python readers for the SEIR model data in "distributable version"
+
+These mirror the data import section of SEIR model (estimation).R and
+SEIR model (prediction).R: observed cases, metropolitan populations and the
+daily number of passengers travelling between the metro areas.
+"""
+import csv
+import datetime
+import hashlib
+import os
+
+import numpy as np
+
+# The directory where observed case data, population data and mobility data are stored
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'distributable version')
+
+# The airplane_capacity and airplane_occupancy are used to convert number of
+# flights into number of passengers travelling between two metro areas.
+AIRPLANE_CAPACITY = 200
+AIRPLANE_OCCUPANCY = ((0, 11, 0.8),     # Jan 21 - Jan 31
+                      (11, 40, 0.75),   # Feb
+                      (40, 62, 0.5))    # Mar 1 - Mar 22
+NUM_DAYS = 62   # Jan 21 to Mar 22
+
+
+def load_population(data_path=DATA_PATH):
+  """
+  :param data_path: (str) directory holding population.csv
+  :return: (list, np.ndarray) names and populations of the metro areas
+  """
+  with open(os.path.join(data_path, 'population.csv'), newline='') as f:
+    rows = list(csv.DictReader(f))
+  city_names = [row['City'] for row in rows]
+  pop_data = np.array([float(row['Population']) for row in rows])
+  return city_names, pop_data
+
+
+def load_cases(city_names, data_path=DATA_PATH):
+  """
+  Observed daily cases, with missing values set to 0
+
+  :param city_names: (list) metro areas, in the order of the output columns
+  :param data_path: (str) directory holding cases_data.csv
+  :return: (np.ndarray) cases, shape (num_days, num_cities)
+  """
+  with open(os.path.join(data_path, 'cases_data.csv'), newline='') as f:
+    rows = list(csv.DictReader(f))
+  return np.array([[float(row[c]) if row[c] not in ('', 'NA') else 0.
+                    for c in city_names] for row in rows])
+
+
+def _trip_data_file(data_path, a_city):
+  return os.path.join(data_path, 'trip_data', a_city + '.csv')
+
+
+def _expected_date(day):
+  # day 0 is Jan 21, written as 1_21 in the trip data files
+  date = datetime.date(2020, 1, 21) + datetime.timedelta(days=day)
+  return '%d_%d' % (date.month, date.day)
+
+
+def parse_trip_data(city_names, data_path=DATA_PATH):
+  """
+  Parse and validate the trip_data files (flights, not yet scaled to
+  passengers). Self entries ('-') are 0 and padded values such as '12 ' are
+  accepted.
+
+  :param city_names: (list) metro areas, in the order of the output axes
+  :param data_path: (str) directory holding trip_data/<city>.csv
+  :return: (np.ndarray) flights, shape (NUM_DAYS, num_cities, num_cities)
+  """
+  num_cities = len(city_names)
+  flights = np.zeros((NUM_DAYS, num_cities, num_cities))
+  for i, a_city in enumerate(city_names):
+    path = _trip_data_file(data_path, a_city)
+    with open(path, newline='') as f:
+      rows = list(csv.reader(f))
+    header = [c.strip() for c in rows[0]]
+    missing = [c for c in city_names if c not in header]
+    if missing:
+      raise ValueError("%s: no column for %s" % (path, ', '.join(missing)))
+    columns = [header.index(c) for c in city_names]
+    if len(rows) < NUM_DAYS + 1:
+      raise ValueError("%s: %d days of data, expected %d" % (path, len(rows) - 1, NUM_DAYS))
+    for day, row in enumerate(rows[1:NUM_DAYS+1]):
+      if row[0].strip() != _expected_date(day):
+        raise ValueError("%s, line %d: date %r, expected %r"
+                         % (path, day + 2, row[0], _expected_date(day)))
+      for j, col in enumerate(columns):
+        value = row[col].strip()
+        if j == i or value == '-':
+          continue # outflow from a_city to itself is assumed to be 0
+        try:
+          flights[day, i, j] = float(value)
+        except ValueError:
+          raise ValueError("%s, line %d: invalid value %r for %s"
+                           % (path, day + 2, row[col], city_names[j]))
+  if not np.isfinite(flights).all() or (flights < 0).any():
+    raise ValueError("trip data contains negative or non finite values")
+  return flights
+
+
+def extend_weekly(flows, num_days):
+  """
+  Extend daily flows beyond the available data, assuming repeating weekly
+  patterns of mobility (day d uses day d-7, as in the prediction script)
+
+  :param flows: (np.ndarray) daily flows, shape (days, num_cities, num_cities)
+  :param num_days: (int) number of days wanted
+  :return: (np.ndarray) flows, shape (num_days, num_cities, num_cities)
+  """
+  days = len(flows)
+  if num_days <= days:
+    return flows[:num_days]
+  index = np.arange(num_days)
+  late = index >= days
+  index[late] = days - 7 + (index[late] - days) % 7
+  return flows[index]
+
+
+def _trip_data_key(city_names, data_path):
+  # hash of everything the passenger array depends on
+  key = hashlib.sha256()
+  key.update(repr((list(city_names), NUM_DAYS, AIRPLANE_CAPACITY, AIRPLANE_OCCUPANCY)).encode())
+  for a_city in city_names:
+    with open(_trip_data_file(data_path, a_city), 'rb') as f:
+      key.update(f.read())
+  return key.hexdigest()[:16]
+
+
+def load_trip_data(city_names, data_path=DATA_PATH, num_days=NUM_DAYS, cache_dir=None):
+  """
+  Daily passenger flows between the metro areas. The entry [d, i, j] is the
+  number of passengers travelling from metro i to metro j on day d (0 based,
+  day 0 is Jan 21). Flights are converted to passengers with
+  AIRPLANE_CAPACITY and the monthly AIRPLANE_OCCUPANCY; trips from a metro
+  area to itself are 0.
+
+  The parsed array is cached as a .npy file named after a hash of the source
+  files, so later calls only hash the files and load the array. If the cache
+  directory is not writable the data is parsed every time.
+
+  :param city_names: (list) metro areas, in the order of the output axes
+  :param data_path: (str) directory holding trip_data/<city>.csv
+  :param num_days: (int) number of days; days past the data repeat the last week
+  :param cache_dir: (str) directory of the cache, default data_path/cache
+  :return: (np.ndarray) passengers, shape (num_days, num_cities, num_cities)
+  """
+  if cache_dir is None:
+    cache_dir = os.path.join(data_path, 'cache')
+  cache_path = os.path.join(cache_dir, 'passengers_%s.npy' % _trip_data_key(city_names, data_path))
+  if os.path.exists(cache_path):
+    flows = np.load(cache_path)
+  else:
+    flows = parse_trip_data(city_names, data_path)
+    for start, end, occupancy in AIRPLANE_OCCUPANCY:
+      flows[start:end] *= AIRPLANE_CAPACITY*occupancy
+    try:
+      os.makedirs(cache_dir, exist_ok=True)
+      tmp_path = cache_path + '.tmp'
+      with open(tmp_path, 'wb') as f:
+        np.save(f, flows)
+      os.replace(tmp_path, cache_path)
+    except OSError:
+      pass
+  return extend_weekly(flows, num_days)
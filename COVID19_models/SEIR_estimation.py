@@ -0,0 +1,453 @@
+"""
+vectorized python version of SEIR model (estimation).R
+
+Estimates the transmission rate of each metro area with a particle filter.
+Particles are kept in a (number_of_particles, num_cities) array and the
+particle states in a (number_of_particles, num_cities, 4) array holding
+(S, E, I, R) along the last axis, so each day's evolve / propagate / weight /
+resample step is a handful of array operations instead of per-city loops.
+
+Each day's posterior is stored as binary particles/<day>.npy and
+states/<day>.npy checkpoints (see SEIR_checkpoints.py). The csv outputs
+particles/<day>.csv and states/<day>.csv of the R script, with the same
+layout, are available with --csv (or output=write_csv).
+
+Once the day's travel flows are known the metro areas are independent, so
+with num_workers > 1 the metro areas are split across a pool of processes.
+Particles and states then live in shared memory and the workers only
+synchronize once per day, to exchange the mean state of their metro areas.
+
+To run the estimation with the default settings:
+    $ cd COVID19_models
+    $ python SEIR_estimation.py [--particles N] [--workers N] [--csv]
+"""
+import os
+import sys
+sys.path.append("..")
+
+import argparse
+import math
+import multiprocessing
+import threading
+
+import numpy as np
+
+from COVID19_models.SEIR_data import DATA_PATH, load_population, load_cases, load_trip_data
+from COVID19_models.SEIR_checkpoints import write_npy
+
+###Constants
+start_date = 1    #Starting date of model parameter estimation. Default is Jan. 21
+end_date = 62     #End date of model parameter estimation. Default is Mar. 22.
+number_of_particles = 50000    #Number of particles in the particle filtering algorithm
+initial_E_range = (0, 50)      #The number of exposed people on Jan. 21 in each metro area is assumed to be a random number in the range 0~50.
+initial_I = 0    #No one was in the infectious compartment on Jan. 21
+initial_R = 0    #No one was in the recovered compartment on Jan. 21
+prior_transmission_rate_mean = 0.18    #Transmission rate assumed at the begining of particle filtering
+prior_transmission_rate_var = 0.01     #Variance in the transmission rate
+latent_period = 5.1       #Length of the latent period as in the literature
+recovery_rate = 0.06      #Recovery rate as in the literature
+under_reporting = 0.65    #The proportion of infectious people that will be reported
+
+RESAMPLING_SCHEMES = ('multinomial', 'stratified', 'systematic', 'residual')
+
+
+def initial_particles(rng, num_particles, pop_data):
+  """
+  Draw the prior particles and states
+
+  :param rng: (np.random.Generator) random number generator
+  :param num_particles: (int) number of particles
+  :param pop_data: (np.ndarray) population of each metro area
+  :return: (np.ndarray, np.ndarray) particles (num_particles, num_cities) and
+    states (num_particles, num_cities, 4)
+  """
+  num_cities = len(pop_data)
+  particles = rng.gamma(shape=prior_transmission_rate_mean**2/prior_transmission_rate_var,
+                        scale=prior_transmission_rate_var/prior_transmission_rate_mean,
+                        size=(num_particles, num_cities))
+  states = np.empty((num_particles, num_cities, 4))
+  states[:, :, 1] = rng.uniform(initial_E_range[0], initial_E_range[1], size=(num_particles, num_cities))
+  states[:, :, 2] = initial_I
+  states[:, :, 3] = initial_R
+  states[:, :, 0] = pop_data - states[:, :, 1] - states[:, :, 2]
+  return particles, states
+
+
+def evolve_particles(rng, particles):
+  """
+  Add random noise to the transmission rates (normal truncated at 0, like
+  rtruncnorm(a=0, b=Inf) in the R script)
+
+  :param rng: (np.random.Generator) random number generator
+  :param particles: (np.ndarray) transmission rates, modified in place
+  """
+  sd = math.sqrt(prior_transmission_rate_var)
+  out = rng.normal(particles, sd)
+  redraw = np.flatnonzero(out < 0)
+  flat_out = out.reshape(-1)
+  flat_mean = particles.reshape(-1)
+  while len(redraw):
+    flat_out[redraw] = rng.normal(flat_mean[redraw], sd)
+    redraw = redraw[flat_out[redraw] < 0]
+  particles[...] = out
+
+
+def travel_flows(mean_states, trip_matrix, pop_data):
+  """
+  Net change of each compartment due to travel. It is assumed that the
+  compartment composition in the passenger flows is the same as the
+  compartment composition in the trip origin.
+
+  :param mean_states: (np.ndarray) mean state over particles, (num_cities, 4)
+  :param trip_matrix: (np.ndarray) passengers from metro i to metro j
+  :param pop_data: (np.ndarray) population of each metro area
+  :return: (np.ndarray) inflow - outflow, shape (num_cities, 4)
+  """
+  share = mean_states / pop_data[:, None]
+  return trip_matrix.T @ share - trip_matrix.sum(axis=1)[:, None] * share
+
+
+def propagate(particles, states, net_flow, pop_data):
+  """
+  Update the states by one day according to the SEIR model
+
+  :param particles: (np.ndarray) transmission rates, (num_particles, num_cities)
+  :param states: (np.ndarray) states, (num_particles, num_cities, 4), modified in place
+  :param net_flow: (np.ndarray) travel inflow - outflow, (num_cities, 4)
+  :param pop_data: (np.ndarray) population of each metro area
+  """
+  S, E, I = states[:, :, 0], states[:, :, 1], states[:, :, 2]
+  infection = particles*I*S/pop_data
+  incubation = E/latent_period
+  recovery = I*recovery_rate
+  delta = np.empty_like(states)
+  delta[:, :, 0] = -infection
+  delta[:, :, 1] = infection - incubation
+  delta[:, :, 2] = incubation - recovery
+  delta[:, :, 3] = recovery
+  states += delta + net_flow
+
+
+def log_likelihoods(states, observed_cases):
+  """
+  Log particle weights. Reported cases are assumed to follow a Poisson
+  distribution with mean I; compartments can not be negative.
+
+  :param states: (np.ndarray) states, (num_particles, num_cities, 4)
+  :param observed_cases: (np.ndarray) reported cases on the day, (num_cities,)
+  :return: (np.ndarray) log likelihoods, (num_particles, num_cities)
+  """
+  k = np.round(observed_cases/under_reporting)
+  lgamma_k = np.array([math.lgamma(x + 1) for x in k])
+  I = states[:, :, 2]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    log_l = np.where(k > 0, k*np.log(I), 0.) - I - lgamma_k
+  log_l[(states[:, :, :3] < 0).any(axis=2)] = -np.inf
+  return log_l
+
+
+def normalize(log_w):
+  """
+  Normalize log weights so that the weights of each column sum to 1
+
+  :param log_w: (np.ndarray) log weights, (num_particles, num_cities)
+  :return: (np.ndarray) normalized log weights
+  """
+  log_max = log_w.max(axis=0)
+  if not np.isfinite(log_max).all():
+    raise ValueError("all particles have zero likelihood in metro area(s) %s"
+                     % np.flatnonzero(~np.isfinite(log_max)))
+  return log_w - (log_max + np.log(np.exp(log_w - log_max).sum(axis=0)))
+
+
+def effective_sample_size(weights):
+  """
+  :param weights: (np.ndarray) normalized weights, (num_particles, num_cities)
+  :return: (np.ndarray) effective sample size of each metro area
+  """
+  return 1. / (weights**2).sum(axis=0)
+
+
+def _offspring_index(counts):
+  # counts[j, c] copies of particle j for metro c -> (num_particles, num_cities) index
+  num_particles, num_cities = counts.shape
+  index = np.repeat(np.tile(np.arange(num_particles), num_cities), counts.T.ravel())
+  return index.reshape(num_cities, num_particles).T
+
+
+def _stratified_counts(cdf, u):
+  # Number of offspring when the i-th draw lies in [i/N, (i+1)/N) at
+  # (i + u[i])/N: the draws below c are the floor(N*c) full strata plus one
+  # if u[floor(N*c)] < N*c - floor(N*c), so counting is linear in N.
+  num_particles = cdf.shape[0]
+  scaled = num_particles*cdf
+  k = np.minimum(np.floor(scaled).astype(np.int64), num_particles - 1)
+  below = k + (np.take_along_axis(u, k, axis=0) < scaled - k)
+  below[-1] = num_particles
+  return np.diff(below, axis=0, prepend=0)
+
+
+def resample_index(rng, weights, scheme='multinomial'):
+  """
+  Draw the indices of the resampled particles of each metro area
+
+  Schemes:
+        'multinomial'   independent draws, same as sample(replace=T,
+                        prob=likelihood) in the R script, O(N log N)
+        'stratified'    one uniform draw in each of N equal strata, O(N)
+        'systematic'    one uniform draw shifted by i/N, O(N)
+        'residual'      floor(N*w) deterministic copies plus a multinomial
+                        draw for the remainder, O(N)
+  The last three have lower variance than multinomial resampling.
+
+  :param rng: (np.random.Generator) random number generator
+  :param weights: (np.ndarray) normalized weights, (num_particles, num_cities)
+  :param scheme: (str) one of RESAMPLING_SCHEMES
+  :return: (np.ndarray) indices of the resampled particles, same shape as weights
+  """
+  num_particles, num_cities = weights.shape
+  if scheme == 'multinomial':
+    # one searchsorted over the stacked cumulative weights of all metro areas
+    cdf = np.cumsum(weights, axis=0)
+    cdf /= cdf[-1]
+    offsets = np.arange(num_cities)
+    # sorted draws make the lookups sequential in memory (the order of the
+    # resampled particles does not matter)
+    u = np.sort(rng.random((num_particles, num_cities)), axis=0) + offsets
+    index = np.searchsorted((cdf + offsets).T.ravel(), u.T.ravel(), side='right')
+    return np.minimum(index.reshape(num_cities, num_particles).T - offsets*num_particles,
+                      num_particles - 1)
+  if scheme == 'stratified':
+    u = rng.random((num_particles, num_cities))
+  elif scheme == 'systematic':
+    u = np.broadcast_to(rng.random(num_cities), (num_particles, num_cities))
+  elif scheme == 'residual':
+    copies = np.floor(num_particles*weights).astype(np.int64)
+    residual = num_particles*weights - copies
+    n_left = num_particles - copies.sum(axis=0)
+    residual /= np.maximum(residual.sum(axis=0), 1e-300)
+    copies += rng.multinomial(n_left, residual.T).T
+    return _offspring_index(copies)
+  else:
+    raise ValueError("scheme must be one of %s, got %r" % (RESAMPLING_SCHEMES, scheme))
+  cdf = np.cumsum(weights, axis=0)
+  cdf /= cdf[-1]
+  return _offspring_index(_stratified_counts(cdf, u))
+
+
+def resample(rng, particles, states, log_w, scheme='multinomial', ess_threshold=None):
+  """
+  Resample the particles of the metro areas whose effective sample size is
+  below ess_threshold*num_particles (all metro areas if ess_threshold is
+  None, as in the R script). Resampled metro areas get uniform weights, the
+  others keep their weights until a later day.
+
+  :param rng: (np.random.Generator) random number generator
+  :param particles: (np.ndarray) transmission rates, (num_particles, num_cities)
+  :param states: (np.ndarray) states, (num_particles, num_cities, 4)
+  :param log_w: (np.ndarray) normalized log weights, (num_particles, num_cities)
+  :param scheme: (str) resampling scheme, see resample_index
+  :param ess_threshold: (float) fraction of num_particles, or None
+  :return: (np.ndarray, np.ndarray, np.ndarray) particles, states and log weights
+  """
+  num_particles = particles.shape[0]
+  weights = np.exp(log_w)
+  if ess_threshold is None:
+    index = resample_index(rng, weights, scheme)
+    return (np.take_along_axis(particles, index, axis=0),
+            np.take_along_axis(states, index[:, :, None], axis=0),
+            np.full_like(log_w, -math.log(num_particles)))
+
+  cities = np.flatnonzero(effective_sample_size(weights) < ess_threshold*num_particles)
+  if len(cities):
+    index = resample_index(rng, weights[:, cities], scheme)
+    particles[:, cities] = np.take_along_axis(particles[:, cities], index, axis=0)
+    states[:, cities] = np.take_along_axis(states[:, cities], index[:, :, None], axis=0)
+    log_w[:, cities] = -math.log(num_particles)
+  return particles, states, log_w
+
+
+def filter_day(rng, particles, states, log_w, trip_matrix, observed_cases, pop_data,
+               scheme='multinomial', ess_threshold=None):
+  """
+  One day of particle filtering: (1) evolving the parameters; (2) updating
+  the states; (3) assigning particle weights; and (4) resampling particles.
+  Weights are carried in log space between days.
+
+  :return: (np.ndarray, np.ndarray, np.ndarray) posterior particles, states
+    and normalized log weights
+  """
+  evolve_particles(rng, particles)
+  mean_states = np.einsum('pc,pck->ck', np.exp(log_w), states)
+  net_flow = travel_flows(mean_states, trip_matrix, pop_data)
+  propagate(particles, states, net_flow, pop_data)
+  log_w = normalize(log_w + log_likelihoods(states, observed_cases))
+  return resample(rng, particles, states, log_w, scheme, ess_threshold)
+
+
+def write_csv(data_path, a_day, particles, states, log_weights=None):
+  """
+  Store a day's posterior as particles/<day>.csv and states/<day>.csv, with
+  the layout of write.csv in the R script (states have 4 columns per metro).
+  If the particles are not equally weighted (resampling triggered by the
+  effective sample size), the log weights are stored in weights/<day>.csv.
+  """
+  num_particles, num_cities = particles.shape
+  tables = [('particles', particles),
+            ('states', states.reshape(num_particles, 4*num_cities))]
+  if log_weights is not None and np.ptp(log_weights, axis=0).any():
+    tables.append(('weights', log_weights))
+  for folder, table in tables:
+    os.makedirs(os.path.join(data_path, folder), exist_ok=True)
+    header = ','.join('"V%d"' % (i+1) for i in range(table.shape[1]))
+    np.savetxt(os.path.join(data_path, folder, '%d.csv' % a_day), table,
+               fmt='%.15g', delimiter=',', header=header, comments='')
+
+
+def _shared_views(buffer, num_particles, num_cities):
+  # particles, states, log weights and the double buffered mean states in
+  # one shared block
+  data = np.frombuffer(buffer, dtype=np.float64)
+  n_p = num_particles*num_cities
+  particles = data[:n_p].reshape(num_particles, num_cities)
+  states = data[n_p:5*n_p].reshape(num_particles, num_cities, 4)
+  log_w = data[5*n_p:6*n_p].reshape(num_particles, num_cities)
+  mean_states = data[6*n_p:].reshape(2, num_cities, 4)
+  return particles, states, log_w, mean_states
+
+
+def _filter_worker(buffer, num_particles, cities, seed_seq, pop_data, case_data,
+                   passenger_flow_data, scheme, ess_threshold, barrier, errors,
+                   wait_for_output):
+  """
+  Particle filtering of the metro areas cities[0]:cities[1] in a worker
+  process. The mean states of day a_day are read from mean_states[a_day % 2]
+  and the new ones are written to the other buffer, so one barrier per day is
+  enough.
+  """
+  particles_all, states_all, log_w_all, mean_states = _shared_views(buffer, num_particles, len(pop_data))
+  lo, hi = cities
+  particles = particles_all[:, lo:hi]
+  states = states_all[:, lo:hi]
+  log_w = log_w_all[:, lo:hi]
+  rng = np.random.default_rng(seed_seq)
+  try:
+    for a_day in range(start_date, end_date+1):
+      evolve_particles(rng, particles)
+      net_flow = travel_flows(mean_states[a_day % 2], passenger_flow_data[a_day-1], pop_data)
+      propagate(particles, states, net_flow[lo:hi], pop_data[lo:hi])
+      log_w[...] = normalize(log_w + log_likelihoods(states, case_data[a_day-1, lo:hi]))
+      particles[...], states[...], log_w[...] = resample(rng, particles, states, log_w,
+                                                         scheme, ess_threshold)
+      mean_states[(a_day+1) % 2, lo:hi] = np.einsum('pc,pck->ck', np.exp(log_w), states)
+      barrier.wait()
+      if wait_for_output:
+        barrier.wait()
+  except threading.BrokenBarrierError:
+    pass
+  except Exception as e:
+    errors.put("metro areas %d-%d: %r" % (lo, hi-1, e))
+    barrier.abort()
+
+
+def _estimate_parallel(num_workers, particles0, states0, log_w0, pop_data, case_data,
+                       passenger_flow_data, scheme, ess_threshold, data_path, output, seed):
+  num_particles, num_cities = particles0.shape
+  buffer = multiprocessing.RawArray('d', 6*num_particles*num_cities + 2*num_cities*4)
+  particles, states, log_w, mean_states = _shared_views(buffer, num_particles, num_cities)
+  particles[...] = particles0
+  states[...] = states0
+  log_w[...] = log_w0
+  mean_states[start_date % 2] = states0.mean(axis=0)
+
+  # contiguous blocks of metro areas, one independent random stream per worker
+  bounds = np.linspace(0, num_cities, num_workers+1).astype(int)
+  seed_seqs = np.random.SeedSequence(seed).spawn(num_workers)
+  barrier = multiprocessing.Barrier(num_workers+1)
+  errors = multiprocessing.Queue()
+  workers = [multiprocessing.Process(target=_filter_worker,
+                                     args=(buffer, num_particles, (bounds[w], bounds[w+1]),
+                                           seed_seqs[w], pop_data, case_data,
+                                           passenger_flow_data, scheme, ess_threshold,
+                                           barrier, errors, output is not None))
+             for w in range(num_workers)]
+  for worker in workers:
+    worker.start()
+  try:
+    for a_day in range(start_date, end_date+1):
+      barrier.wait()
+      if output is not None:
+        output(data_path, a_day, particles, states, log_w)
+        barrier.wait()
+  except threading.BrokenBarrierError:
+    raise RuntimeError("particle filter worker failed: %s" % errors.get())
+  finally:
+    for worker in workers:
+      worker.join()
+  return particles.copy(), states.copy(), log_w.copy()
+
+
+def estimate(num_particles=number_of_particles, seed=3, data_path=DATA_PATH,
+             output=write_npy, num_workers=1, scheme='multinomial', ess_threshold=None):
+  """
+  Estimate the SEIR model parameters using particle filtering and the
+  observed case data
+
+  :param num_particles: (int) number of particles
+  :param seed: (int) seed of the random number generator
+  :param data_path: (str) directory holding the input data and the outputs
+  :param output: (callable) called as output(data_path, a_day, particles,
+    states, log_weights) after every day, None to skip storing daily outputs
+  :param num_workers: (int) number of worker processes (at most one per metro
+    area); the random streams depend on the number of workers
+  :param scheme: (str) resampling scheme, one of RESAMPLING_SCHEMES
+  :param ess_threshold: (float) resample a metro area only when its effective
+    sample size falls below ess_threshold*num_particles; None resamples every
+    day as in the R script
+  :return: (np.ndarray, np.ndarray) posterior particles and states on
+    end_date, as an equally weighted sample
+  """
+  rng = np.random.default_rng(seed)
+  city_names, pop_data = load_population(data_path)
+  case_data = load_cases(city_names, data_path)
+  passenger_flow_data = load_trip_data(city_names, data_path)
+
+  particles, states = initial_particles(rng, num_particles, pop_data)
+  log_w = np.full_like(particles, -math.log(num_particles))
+  num_workers = min(num_workers, len(city_names))
+  if num_workers > 1:
+    particles, states, log_w = _estimate_parallel(num_workers, particles, states, log_w,
+                                                  pop_data, case_data, passenger_flow_data,
+                                                  scheme, ess_threshold, data_path, output, seed)
+  else:
+    for a_day in range(start_date, end_date+1):
+      particles, states, log_w = filter_day(rng, particles, states, log_w,
+                                            passenger_flow_data[a_day-1],
+                                            case_data[a_day-1], pop_data,
+                                            scheme, ess_threshold)
+      if output is not None:
+        output(data_path, a_day, particles, states, log_w)
+
+  # metro areas that were not resampled on the last day still carry weights
+  if ess_threshold is not None:
+    particles, states, log_w = resample(rng, particles, states, log_w, scheme)
+  return particles, states
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="SEIR model parameter estimation")
+  parser.add_argument('--particles', type=int, default=number_of_particles, help="number of particles")
+  parser.add_argument('--workers', type=int, default=1, help="number of worker processes")
+  parser.add_argument('--scheme', default='multinomial', choices=RESAMPLING_SCHEMES, help="resampling scheme")
+  parser.add_argument('--ess', type=float, default=None,
+                      help="resample only when the effective sample size is below this fraction of the particles")
+  parser.add_argument('--csv', action='store_true', help="also write the daily outputs as csv files")
+  args = parser.parse_args()
+
+  def output(*day_posterior):
+    write_npy(*day_posterior)
+    if args.csv:
+      write_csv(*day_posterior)
+
+  estimate(num_particles=args.particles, num_workers=args.workers,
+           scheme=args.scheme, ess_threshold=args.ess, output=output)
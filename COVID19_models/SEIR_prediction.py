@@ -0,0 +1,66 @@
+"""
+python version of SEIR model (prediction).R
+
+Starts from the end_date posterior of the particle filter (opened with memory
+mapping from the binary checkpoints written by SEIR_estimation.py) and
+predicts the number of infected people (E + I) in each metro area on each day
+of the prediction window. The parameters still evolve during the prediction.
+
+To run the prediction with the default settings:
+    $ cd COVID19_models
+    $ python SEIR_prediction.py
+"""
+import os
+import sys
+sys.path.append("..")
+
+import numpy as np
+
+from COVID19_models.SEIR_data import DATA_PATH, load_population, load_trip_data
+from COVID19_models.SEIR_checkpoints import load_day
+from COVID19_models.SEIR_estimation import end_date, evolve_particles, travel_flows, propagate, resample
+
+prediction_window = 7    #How many days you want to predict forward after end_date? Default is 7 days.
+
+
+def predict(seed=3, data_path=DATA_PATH, window=prediction_window):
+  """
+  :param seed: (int) seed of the random number generator
+  :param data_path: (str) directory holding the input data and checkpoints
+  :param window: (int) number of days to predict after end_date
+  :return: (list, np.ndarray) metro area names and the mean number of
+    infected people, shape (window, num_cities)
+  """
+  rng = np.random.default_rng(seed)
+  city_names, pop_data = load_population(data_path)
+  #Extending mobility data to the prediction window, assuming repeating weekly patterns of mobility
+  passenger_flow_data = load_trip_data(city_names, data_path, num_days=end_date+window)
+
+  ###Importing estimated parameters (particles) and states
+  particles, states, log_w = load_day(data_path, end_date)
+  particles = np.array(particles)
+  states = np.array(states)
+  if log_w is not None:
+    particles, states, _ = resample(rng, particles, states, np.array(log_w))
+
+  infection_history = np.empty((window, len(city_names)))
+  for a_day in range(end_date+1, end_date+window+1):
+    evolve_particles(rng, particles)
+    net_flow = travel_flows(states.mean(axis=0), passenger_flow_data[a_day-1], pop_data)
+    propagate(particles, states, net_flow, pop_data)
+    infection_history[a_day-end_date-1] = (states[:, :, 1] + states[:, :, 2]).mean(axis=0)
+  return city_names, infection_history
+
+
+def write_predictions(city_names, infection_history, data_path=DATA_PATH):
+  """
+  Export the prediction to predicted_infections.csv (same layout as the R script)
+  """
+  with open(os.path.join(data_path, 'predicted_infections.csv'), 'w') as f:
+    f.write(','.join(['""'] + ['"%s"' % c for c in city_names]) + '\n')
+    for i, row in enumerate(infection_history):
+      f.write(','.join(['"%d"' % (i+1)] + ['%.15g' % x for x in row]) + '\n')
+
+
+if __name__ == "__main__":
+  write_predictions(*predict())